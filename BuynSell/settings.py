@@ -2,6 +2,7 @@ from pathlib import Path
 import os
 from dotenv import load_dotenv
 import dj_database_url
+from urllib.parse import urlparse
 import logging
 
 # Load environment variables from .env
@@ -112,6 +113,14 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock when a transaction starts, so concurrent
+        # checkouts queue up (for up to 20s) instead of failing on upgrade
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than shared-cache memory, so threaded tests see real locking
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -131,6 +140,21 @@ if DATABASE_URL and (DATABASE_URL.startswith('postgresql://') or DATABASE_URL.st
         db_config['OPTIONS'] = options
     DATABASES = {'default': db_config}
 
+# Cache (catalog pages and facets, see app/caching.py). CACHE_URL picks the backend:
+# redis://host:6379/0 (needs the redis package), file:///var/tmp/buynsell_cache,
+# db://cache_table (run createcachetable first) or locmem:// (default, per process)
+CACHE_URL = os.getenv('CACHE_URL', 'locmem://').strip()
+_cache_url = urlparse(CACHE_URL)
+if _cache_url.scheme in ('redis', 'rediss'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+elif _cache_url.scheme == 'file':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': _cache_url.path}}
+elif _cache_url.scheme == 'db':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': _cache_url.netloc or 'django_cache'}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'buynsell'}}
+CACHES['default']['KEY_PREFIX'] = os.getenv('CACHE_KEY_PREFIX', 'buynsell')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -173,6 +197,28 @@ LOGOUT_REDIRECT_URL = '/'
 CELERY_TIMEZONE = os.getenv('CELERY_TIMEZONE', 'Asia/Manila')
 CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'sqla+sqlite:///celery_messages.sqlite')
 CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'django-db')
+CELERY_BEAT_SCHEDULE = {
+    # Retries and anything the request-time enqueue missed (app/outbox.py)
+    'drain-email-outbox': {
+        'task': 'app.tasks.drain_email_outbox',
+        'schedule': 60.0,
+    },
+    # Corrects drift in the analytics rollup (app/analytics.py)
+    'reconcile-daily-stats': {
+        'task': 'app.tasks.reconcile_daily_stats',
+        'schedule': 60.0 * 60,
+    },
+    # Deletes idle chats and compacts long ones (app/chat.py)
+    'chat-retention': {
+        'task': 'app.tasks.enforce_chat_retention',
+        'schedule': 60.0 * 60 * 24,
+    },
+    # Deletes anonymous carts whose session has expired (app/cart.py)
+    'purge-abandoned-carts': {
+        'task': 'app.tasks.purge_abandoned_carts',
+        'schedule': 60.0 * 60 * 24,
+    },
+}
 
 # File Upload Size Limits - Prevent memory exhaustion from large file uploads
 # 3D models (GLB/GLTF files) can be large but we need to prevent OOM errors on Render
@@ -333,3 +379,83 @@ B2_BUCKET_NAME = os.getenv('B2_BUCKET_NAME', 'koyanardzstorage')
 B2_BUCKET_ID = os.getenv('B2_BUCKET_ID', '5ba4c7665f02d77991bf031d')
 B2_ENDPOINT = os.getenv('B2_ENDPOINT', 's3.us-west-004.backblazeb2.com')
 
+# Local disk cache in front of B2 for 3D model reads (set B2_CACHE_MAX_BYTES=0 to disable)
+B2_CACHE_DIR = os.getenv('B2_CACHE_DIR', '')
+B2_CACHE_MAX_BYTES = int(os.getenv('B2_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Uploads above B2_LARGE_FILE_THRESHOLD are streamed to B2 in parts; peak memory
+# is roughly B2_UPLOAD_PART_SIZE x B2_UPLOAD_CONCURRENCY (B2 requires parts >= 5MB)
+B2_LARGE_FILE_THRESHOLD = int(os.getenv('B2_LARGE_FILE_THRESHOLD', 20 * 1024 * 1024))
+B2_UPLOAD_PART_SIZE = int(os.getenv('B2_UPLOAD_PART_SIZE', 10 * 1024 * 1024))
+B2_UPLOAD_CONCURRENCY = int(os.getenv('B2_UPLOAD_CONCURRENCY', 2))
+
+# Re-authorize the shared B2 client before its 24h auth token expires
+B2_AUTH_REFRESH_SECONDS = int(os.getenv('B2_AUTH_REFRESH_SECONDS', 23 * 60 * 60))
+
+# Seconds B2 file metadata (and "file not found" results) are cached per process
+B2_METADATA_CACHE_TTL = int(os.getenv('B2_METADATA_CACHE_TTL', 300))
+B2_METADATA_MISSING_TTL = int(os.getenv('B2_METADATA_MISSING_TTL', 30))
+
+# Upper bound on how long a catalog facet snapshot (brand/category counts, price
+# ranges) is cached; catalog changes invalidate it immediately via signals
+CATALOG_FACETS_CACHE_SECONDS = int(os.getenv('CATALOG_FACETS_CACHE_SECONDS', 600))
+
+# Upper bound on how long cached catalog pages data (latest products, categories,
+# chatbot recommendations) lives; catalog changes also invalidate it via signals
+CATALOG_CACHE_SECONDS = int(os.getenv('CATALOG_CACHE_SECONDS', 600))
+
+# Single-flight cache rebuilds (app/caching.py): how long one process may hold the
+# rebuild lock of a key, and how long others wait for its result before building it too
+CACHE_BUILD_LOCK_SECONDS = int(os.getenv('CACHE_BUILD_LOCK_SECONDS', 30))
+CACHE_BUILD_WAIT_SECONDS = float(os.getenv('CACHE_BUILD_WAIT_SECONDS', 5))
+
+# Appointment calendar: hourly slots from the opening hour up to (not including)
+# the closing hour, how many bookings each slot and each day take, and weekdays
+# the shop is closed (0=Monday ... 6=Sunday). Blackout dates are set in the admin.
+APPOINTMENT_OPENING_HOUR = int(os.getenv('APPOINTMENT_OPENING_HOUR', 10))
+APPOINTMENT_CLOSING_HOUR = int(os.getenv('APPOINTMENT_CLOSING_HOUR', 18))
+APPOINTMENT_SLOT_CAPACITY = int(os.getenv('APPOINTMENT_SLOT_CAPACITY', 1))
+APPOINTMENT_DAILY_CAPACITY = int(os.getenv('APPOINTMENT_DAILY_CAPACITY', 10))
+APPOINTMENT_CLOSED_WEEKDAYS = [int(d) for d in os.getenv('APPOINTMENT_CLOSED_WEEKDAYS', '6').split(',') if d.strip()]
+
+# Transactional email outbox (app/outbox.py): delivery attempts before an email is
+# marked Dead, and the retry backoff (doubling from the base, capped at the max)
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 6))
+EMAIL_OUTBOX_RETRY_BASE_SECONDS = int(os.getenv('EMAIL_OUTBOX_RETRY_BASE_SECONDS', 30))
+EMAIL_OUTBOX_RETRY_MAX_SECONDS = int(os.getenv('EMAIL_OUTBOX_RETRY_MAX_SECONDS', 3600))
+# 'celery' hands new emails to a worker; 'sync' sends them from the request once its
+# transaction commits (retries are then left to the drain-email-outbox beat job).
+# Only a broker shared with the web process can reach a worker, so the default is
+# 'sync' unless CELERY_BROKER_URL is set (render.yaml sets it to BuynSell-broker).
+EMAIL_OUTBOX_DELIVERY = os.getenv('EMAIL_OUTBOX_DELIVERY', 'celery' if os.getenv('CELERY_BROKER_URL') else 'sync')
+
+# Chat retention (app/chat.py, daily beat task): conversations idle for this many days
+# are deleted (0 keeps them), and histories growing past CHAT_COMPACT_AFTER messages are
+# folded into the conversation summary down to the last CHAT_KEEP_MESSAGES. Each run
+# handles at most CHAT_RETENTION_MAX_BATCHES batches of CHAT_RETENTION_BATCH_SIZE.
+CHAT_ANONYMOUS_RETENTION_DAYS = int(os.getenv('CHAT_ANONYMOUS_RETENTION_DAYS', 30))
+CHAT_USER_RETENTION_DAYS = int(os.getenv('CHAT_USER_RETENTION_DAYS', 0))
+CHAT_COMPACT_AFTER = int(os.getenv('CHAT_COMPACT_AFTER', 200))
+CHAT_KEEP_MESSAGES = int(os.getenv('CHAT_KEEP_MESSAGES', 100))
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv('CHAT_SUMMARY_MAX_CHARS', 2000))
+CHAT_RETENTION_BATCH_SIZE = int(os.getenv('CHAT_RETENTION_BATCH_SIZE', 200))
+CHAT_RETENTION_MAX_BATCHES = int(os.getenv('CHAT_RETENTION_MAX_BATCHES', 10))
+
+# Product page assistant (app/llm.py): replies are generated server-side and streamed
+# to the browser. CHAT_LLM_BACKEND is 'gemini', 'stub' (deterministic local replies,
+# only ever used when set explicitly, e.g. for tests or local development) or a
+# dotted path to an upstream class; CHAT_LLM_MODELS are tried in order. Without
+# GEMINI_API_KEY the gemini backend fails each reply with an error event.
+CHAT_LLM_BACKEND = os.getenv('CHAT_LLM_BACKEND', 'gemini')
+CHAT_LLM_MODELS = [m.strip() for m in os.getenv('CHAT_LLM_MODELS', 'gemini-2.5-flash,gemini-2.0-flash').split(',') if m.strip()]
+# A streamed reply occupies a web worker thread until it ends, so the web service
+# runs gunicorn gthread workers (render.yaml, Procfile): a long reply then ties up
+# one thread, not the site, and is not killed by gunicorn's --timeout, which only
+# watches the worker process. Keep CHAT_LLM_TIMEOUT_SECONDS (connect / wait between
+# chunks) well below that --timeout and CHAT_LLM_MAX_REPLY_SECONDS (a whole reply)
+# below the proxy's idle timeout.
+CHAT_LLM_TIMEOUT_SECONDS = int(os.getenv('CHAT_LLM_TIMEOUT_SECONDS', 10))
+CHAT_LLM_MAX_REPLY_SECONDS = int(os.getenv('CHAT_LLM_MAX_REPLY_SECONDS', 60))
+CHAT_CONTEXT_MESSAGES = int(os.getenv('CHAT_CONTEXT_MESSAGES', 20))
+# Store name rendered into the assistant's system prompt (app/gemini_system_prompt.txt)
+STORE_NAME = os.getenv('STORE_NAME', 'Koyanardzshop')
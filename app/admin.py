@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.html import format_html
-from .models import CustomUser, OtpToken, Product, ProductImage, ProductVariation, Category
+from .models import CustomUser, OtpToken, Product, ProductImage, ProductVariation, Category, SearchSynonym, AppointmentDay, AppointmentSlot, OutboxEmail
+from . import outbox
 from django import forms
 
 class CustomUserCreationForm(forms.ModelForm):
@@ -210,4 +211,48 @@ class ProductAdmin(admin.ModelAdmin):
                 }
             )
         self.message_user(request, f'Variant creation initiated for {queryset.count()} product(s). Please edit them to customize.')
-    add_variant_action.short_description = 'Add new variant to selected products'
\ No newline at end of file
+    add_variant_action.short_description = 'Add new variant to selected products'
+
+@admin.register(SearchSynonym)
+class SearchSynonymAdmin(admin.ModelAdmin):
+    list_display = ('term', 'aliases', 'category_aliases')
+    search_fields = ('term',)
+
+@admin.register(AppointmentDay)
+class AppointmentDayAdmin(admin.ModelAdmin):
+    list_display = ('date', 'capacity', 'booked', 'closed', 'note')
+    list_editable = ('capacity', 'closed')
+    list_filter = ('closed',)
+    date_hierarchy = 'date'
+    readonly_fields = ('booked',)
+
+@admin.register(AppointmentSlot)
+class AppointmentSlotAdmin(admin.ModelAdmin):
+    list_display = ('date', 'time', 'capacity', 'booked')
+    list_editable = ('capacity',)
+    date_hierarchy = 'date'
+    readonly_fields = ('booked',)
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipient_list', 'status', 'attempts', 'next_attempt_at', 'sent_at', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'idempotency_key', 'recipients')
+    date_hierarchy = 'created_at'
+    readonly_fields = (
+        'idempotency_key', 'recipients', 'subject', 'text', 'html', 'from_email', 'status',
+        'attempts', 'next_attempt_at', 'locked_at', 'last_error', 'created_at', 'sent_at',
+    )
+    actions = ['retry_now']
+
+    def has_add_permission(self, request):
+        return False
+
+    def recipient_list(self, obj):
+        return ', '.join(obj.recipients)
+    recipient_list.short_description = 'To'
+
+    def retry_now(self, request, queryset):
+        count = outbox.retry(queryset)
+        self.message_user(request, f'{count} email(s) queued for another delivery attempt.')
+    retry_now.short_description = 'Retry delivery of selected emails'
@@ -0,0 +1,208 @@
+"""
+Daily rollups for the admin analytics charts.
+
+DailyStat keeps one row per day of appointment and trade activity and
+DailyCategoryStat the units and revenue sold per category per day. The
+post_save receivers in signals.py call record_appointment() and
+record_trade() when an appointment or trade is created or changes status
+(finished_appointment, cancel_appointment, complete_trade, cancel_trade),
+which moves the counters with F() updates. Charts then read one row per
+day, however many orders there are.
+
+Sales count on the day an appointment is Finished and are taken back from
+that day if it is cancelled afterwards. Bulk updates and deletes skip the
+signals, so rebuild() recomputes a range of days from the raw tables: the
+migration runs it over all history and the reconcile_daily_stats beat task
+over the last RECONCILE_DAYS days.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, F, Min, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+from .models import Appointment, AppointmentProduct, DailyCategoryStat, DailyStat, Selling
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Chart windows offered by the analytics endpoint, in days
+ANALYTICS_WINDOWS = (30, 90, 365)
+
+# Days (ending today) recomputed by the reconcile_daily_stats beat task
+RECONCILE_DAYS = 3
+
+COUNTERS = (
+    'appointments_created', 'appointments_finished', 'appointments_cancelled',
+    'trades_created', 'trades_completed', 'trades_cancelled',
+    'units_sold', 'revenue',
+)
+
+APPOINTMENT_COUNTERS = {'Finished': 'appointments_finished', 'Cancelled': 'appointments_cancelled'}
+TRADE_COUNTERS = {'Completed': 'trades_completed', 'Cancelled': 'trades_cancelled'}
+
+
+def _day(moment):
+    return timezone.localdate(moment) if moment else timezone.localdate()
+
+
+def _bump(day, **deltas):
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+    DailyStat.objects.bulk_create([DailyStat(date=day)], ignore_conflicts=True)
+    DailyStat.objects.filter(date=day).update(**{field: F(field) + value for field, value in deltas.items()})
+
+
+def _bump_sales(day, appointment, sign):
+    """Add (sign=1) or take back (sign=-1) an appointment's lines on ``day``."""
+    per_category = (
+        AppointmentProduct.objects.filter(appointment=appointment)
+        .values('product__category_name')
+        .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('price')))
+        .order_by()
+    )
+    units, revenue = 0, Decimal('0')
+    for row in per_category:
+        category_id = row['product__category_name']
+        row_units, row_revenue = sign * row['units'], sign * row['revenue']
+        # Category rows are always summed when read, so a duplicate from a
+        # concurrent create is harmless (and merged by the next rebuild)
+        if not DailyCategoryStat.objects.filter(date=day, category_id=category_id).update(
+            units_sold=F('units_sold') + row_units, revenue=F('revenue') + row_revenue,
+        ):
+            DailyCategoryStat.objects.create(date=day, category_id=category_id, units_sold=row_units, revenue=row_revenue)
+        units += row_units
+        revenue += row_revenue
+    _bump(day, units_sold=units, revenue=revenue)
+
+
+def _record(instance, created, created_at, created_counter, counters, sales_status=None):
+    previous = 'Pending' if created else getattr(instance, '_previous_status', None)
+    with transaction.atomic():
+        if created:
+            _bump(_day(created_at), **{created_counter: 1})
+        if previous is None or previous == instance.status:
+            return
+
+        if previous in counters:
+            day = _day(instance._previous_status_changed_at or created_at)
+            _bump(day, **{counters[previous]: -1})
+            if previous == sales_status:
+                _bump_sales(day, instance, -1)
+        if instance.status in counters:
+            day = _day(instance.status_changed_at or created_at)
+            _bump(day, **{counters[instance.status]: 1})
+            if instance.status == sales_status:
+                _bump_sales(day, instance, 1)
+
+
+def record_appointment(appointment, created):
+    """Update the rollups after an appointment was created or saved."""
+    _record(appointment, created, appointment.created_at, 'appointments_created', APPOINTMENT_COUNTERS, 'Finished')
+
+
+def record_trade(selling, created):
+    """Update the rollups after a trade (Selling) was created or saved."""
+    _record(selling, created, selling.selling_at, 'trades_created', TRADE_COUNTERS)
+
+
+def rebuild(start=None, end=None):
+    """
+    Recompute the rollups for ``start``..``end`` (inclusive, default: from the
+    first order until today) from Appointment, Selling and AppointmentProduct.
+    Returns the number of days with activity.
+    """
+    end = end or timezone.localdate()
+    if start is None:
+        firsts = [
+            Appointment.objects.aggregate(first=Min('created_at'))['first'],
+            Selling.objects.aggregate(first=Min('selling_at'))['first'],
+        ]
+        firsts = [moment for moment in firsts if moment]
+        if not firsts:
+            start = end
+        else:
+            start = min(_day(moment) for moment in firsts)
+
+    stats = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    def count(queryset, moment, counter):
+        rows = (
+            queryset.annotate(day=TruncDate(moment)).filter(day__range=(start, end))
+            .values('day').annotate(n=Count('id')).values_list('day', 'n').order_by()
+        )
+        for day, n in rows:
+            stats[day][counter] = n
+
+    count(Appointment.objects.all(), 'created_at', 'appointments_created')
+    count(Selling.objects.all(), 'selling_at', 'trades_created')
+    for status, counter in APPOINTMENT_COUNTERS.items():
+        count(Appointment.objects.filter(status=status), Coalesce('status_changed_at', 'created_at'), counter)
+    for status, counter in TRADE_COUNTERS.items():
+        count(Selling.objects.filter(status=status), Coalesce('status_changed_at', 'selling_at'), counter)
+
+    sales = (
+        AppointmentProduct.objects.filter(appointment__status='Finished')
+        .annotate(day=TruncDate(Coalesce('appointment__status_changed_at', 'appointment__created_at')))
+        .filter(day__range=(start, end))
+        .values('day', 'product__category_name')
+        .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('price')))
+        .order_by()
+    )
+    category_rows = []
+    for row in sales:
+        stats[row['day']]['units_sold'] += row['units']
+        stats[row['day']]['revenue'] += row['revenue']
+        category_rows.append(DailyCategoryStat(
+            date=row['day'], category_id=row['product__category_name'],
+            units_sold=row['units'], revenue=row['revenue'],
+        ))
+
+    with transaction.atomic():
+        DailyStat.objects.filter(date__range=(start, end)).delete()
+        DailyCategoryStat.objects.filter(date__range=(start, end)).delete()
+        DailyStat.objects.bulk_create([DailyStat(date=day, **counters) for day, counters in stats.items()])
+        DailyCategoryStat.objects.bulk_create(category_rows)
+
+    logger.info(f"Rebuilt daily stats for {start}..{end}: {len(stats)} active day(s)")
+    return len(stats)
+
+
+def reconcile():
+    """Recompute the last RECONCILE_DAYS days, correcting any drift in the live counters."""
+    today = timezone.localdate()
+    return rebuild(today - timedelta(days=RECONCILE_DAYS - 1), today)
+
+
+def daily_series(start, end):
+    """{'labels': [...], counter: [...]} with one entry per day from ``start`` to ``end``, zeros included."""
+    rows = {row['date']: row for row in DailyStat.objects.filter(date__range=(start, end)).values('date', *COUNTERS)}
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    series = {'labels': [day.isoformat() for day in days]}
+    for counter in COUNTERS:
+        series[counter] = [rows[day][counter] if day in rows else 0 for day in days]
+    return series
+
+
+def totals(start=None, end=None):
+    """Every counter summed over ``start``..``end`` (all days when omitted)."""
+    queryset = DailyStat.objects.all()
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    sums = queryset.aggregate(**{counter: Sum(counter) for counter in COUNTERS})
+    return {counter: value or 0 for counter, value in sums.items()}
+
+
+def category_totals(start=None, end=None):
+    """{category_id or None: (units, revenue)} sold over ``start``..``end`` (all days when omitted)."""
+    queryset = DailyCategoryStat.objects.all()
+    if start:
+        queryset = queryset.filter(date__gte=start)
+    if end:
+        queryset = queryset.filter(date__lte=end)
+    rows = queryset.values('category').annotate(units=Sum('units_sold'), revenue=Sum('revenue')).order_by()
+    return {row['category']: (row['units'] or 0, row['revenue'] or 0) for row in rows}
@@ -6,6 +6,8 @@ from django.db import models
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.db.models import Q
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
 from .models import Product
 import requests
 import os
@@ -13,15 +15,99 @@ import json
 import logging
 import jwt
 import io
+import hashlib
+import re
+import time
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# Chunk size used when streaming 3D model files to the browser
+MODEL_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Accept-Encoding header values that take gzipped bodies
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+
+def _parse_range_header(range_header, file_size):
+    """
+    Parse a single-range ``Range: bytes=...`` header.
+    Returns (start, end) inclusive, None when the header should be ignored
+    (missing, malformed or multi-range), or raises ValueError when the range
+    cannot be satisfied for a file of ``file_size`` bytes.
+    """
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+
+    ranges = range_header[len('bytes='):].strip()
+    if ',' in ranges:
+        # Multiple ranges are optional per RFC 9110 - serve the full file instead
+        return None
+
+    start_str, sep, end_str = ranges.partition('-')
+    if not sep or not (start_str or end_str):
+        return None
+
+    if not (start_str.isdigit() or start_str == '') or not (end_str.isdigit() or end_str == ''):
+        return None
+
+    if start_str == '':
+        # Suffix range: last N bytes
+        if not end_str or int(end_str) == 0:
+            raise ValueError(f"Range {range_header} not satisfiable")
+        start = max(0, file_size - int(end_str))
+        end = file_size - 1
+    else:
+        start = int(start_str)
+        end = min(int(end_str), file_size - 1) if end_str else file_size - 1
+
+    if start >= file_size or start > end:
+        raise ValueError(f"Range {range_header} not satisfiable for {file_size} bytes")
+
+    return start, end
+
+
+def _stream_file_range(file_obj, start, length, chunk_size=MODEL_STREAM_CHUNK_SIZE):
+    """Yield ``length`` bytes of ``file_obj`` from ``start`` in fixed-size chunks."""
+    try:
+        file_obj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file_obj.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file_obj.close()
+
+
+def _model_file_validators(storage, name, file_size):
+    """
+    Return (etag, last_modified_timestamp) for a stored model file.
+    Storages that cannot report a modification time still get an ETag
+    derived from the file name and size.
+    """
+    last_modified = None
+    try:
+        modified_time = storage.get_modified_time(name)
+        if modified_time is not None:
+            last_modified = int(modified_time.timestamp())
+    except (NotImplementedError, OSError):
+        pass
+
+    fingerprint = f"{name}:{file_size}:{last_modified or ''}"
+    etag = '"%s"' % hashlib.md5(fingerprint.encode('utf-8')).hexdigest()
+    return etag, last_modified
+
+
 @csrf_exempt
 @require_http_methods(["GET"])
 def api_serve_3d_model(request, product_id):
     """
-    Serve 3D model file from local storage with proper CORS headers.
+    Serve 3D model file from storage with proper CORS headers.
+    The file is streamed in chunks (so memory use does not grow with model
+    size) and Range/If-Range requests are answered with 206 partial content.
     """
     try:
         product = get_object_or_404(Product, id=product_id)
@@ -32,23 +118,64 @@ def api_serve_3d_model(request, product_id):
         logger.info(f"Serving 3D model for product {product_id}: {product.model_3d.name}")
         
         try:
-            # Read file from local storage
-            file_content = product.model_3d.read()
-            
-            # Create response with file content
-            response = HttpResponse(file_content, content_type='model/gltf-binary')
+            storage = product.model_3d.storage
+            name = product.model_3d.name
+            file_size = storage.size(name)
+            etag, last_modified = _model_file_validators(storage, name, file_size)
+
+            # Answer If-None-Match / If-Modified-Since revalidation without touching the file
+            conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if conditional is not None:
+                response = conditional
+                file_obj = None
+            else:
+                byte_range = None
+                if_range = request.META.get('HTTP_IF_RANGE')
+                range_applies = (
+                    not if_range
+                    or if_range == etag
+                    or (last_modified is not None and parse_http_date_safe(if_range) == last_modified)
+                )
+                if range_applies:
+                    try:
+                        byte_range = _parse_range_header(request.META.get('HTTP_RANGE', ''), file_size)
+                    except ValueError:
+                        response = HttpResponse(status=416)
+                        response['Content-Range'] = f'bytes */{file_size}'
+                        response['Access-Control-Allow-Origin'] = '*'
+                        return response
+
+                start, end = byte_range if byte_range else (0, file_size - 1)
+                length = max(0, end - start + 1)
+
+                file_obj = storage.open(name, 'rb')
+                response = StreamingHttpResponse(
+                    _stream_file_range(file_obj, start, length),
+                    content_type='model/gltf-binary',
+                    status=206 if byte_range else 200,
+                )
+                response['Content-Length'] = str(length)
+                if byte_range:
+                    response['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+                response['Content-Disposition'] = f'inline; filename="{os.path.basename(name)}"'
             
             # Add CORS headers to allow browser to load the model
             response['Access-Control-Allow-Origin'] = '*'
             response['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-            response['Access-Control-Allow-Headers'] = 'Content-Type, Range'
+            response['Access-Control-Allow-Headers'] = 'Content-Type, Range, If-Range, If-None-Match'
+            response['Access-Control-Expose-Headers'] = 'Content-Length, Content-Range, Accept-Ranges, ETag'
             
             # Add cache headers for better performance
             response['Cache-Control'] = 'public, max-age=2592000'
-            response['Content-Disposition'] = f'inline; filename="{product.model_3d.name}"'
-            response['Content-Length'] = len(file_content)
+            response['Accept-Ranges'] = 'bytes'
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
             
-            logger.info(f"✓ Successfully served 3D model: {product.model_3d.name} ({len(file_content)} bytes)")
+            if file_obj is None:
+                logger.info(f"✓ 3D model not modified: {name}")
+            else:
+                logger.info(f"✓ Streaming 3D model: {name} ({response['Content-Length']} of {file_size} bytes)")
             return response
             
         except Exception as e:
@@ -218,26 +345,35 @@ def botpress_test(request):
 def api_gemini_system_prompt(request):
     """
     API endpoint to get the Gemini AI system prompt
-    Returns the system instructions that guide the AI's behavior
+    Returns the system instructions that guide the AI's behavior, rendered
+    with the store's live categories and price range (see app/llm.py).
+    The body is prebuilt (gzipped when the client accepts it) and sent with
+    an ETag; a repeat fetch with If-None-Match gets a 304.
     """
     try:
-        prompt_path = os.path.join(os.path.dirname(__file__), 'gemini_system_prompt.txt')
-        
-        if os.path.exists(prompt_path):
-            with open(prompt_path, 'r', encoding='utf-8') as f:
-                prompt_content = f.read()
-            
-            return JsonResponse({
-                'success': True,
-                'prompt': prompt_content
-            })
-        else:
-            logger.warning(f"System prompt file not found: {prompt_path}")
-            return JsonResponse({
-                'success': False,
-                'error': 'System prompt file not found'
-            }, status=404)
-    
+        from .llm import rendered_prompt
+
+        prompt = rendered_prompt()
+        gzipped = ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')) is not None
+        etag = prompt['gzip_etag'] if gzipped else prompt['etag']
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(prompt['gzip_body'] if gzipped else prompt['body'], content_type='application/json')
+            if gzipped:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, no-cache'
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+    except FileNotFoundError as e:
+        logger.warning(f"System prompt file not found: {e.filename}")
+        return JsonResponse({
+            'success': False,
+            'error': 'System prompt file not found'
+        }, status=404)
+
     except Exception as e:
         logger.error(f"Error loading system prompt: {str(e)}")
         return JsonResponse({
@@ -251,225 +387,74 @@ def api_products_recommend(request):
     """
     API endpoint for product recommendations
     Chatbot uses this to search and recommend products from store inventory
-    Supports category parameter for strict category filtering
+    Category, synonym, name and brand matches are ranked together in one query
     """
     try:
-        from .models import Product
-        from django.db.models import Q
-        
+        from .search import recommend_products
+        from .catalog import catalog_cached
+        from decimal import Decimal, InvalidOperation
+
         query = request.GET.get('query', '').strip()
         category = request.GET.get('category', '').strip()
-        max_price = request.GET.get('max_price')
-        max_results = int(request.GET.get('max_results', 6))
-        
-        products_list = []
-        
-        # If category parameter is provided, search by category
-        if category:
-            try:
-                category_lower = category.lower()
-                
-                # Create flexible search query using Q objects
-                # This allows multiple search terms to work
-                search_query = Q()
-                
-                # Add the main category search
-                search_query |= Q(category_name__category_name__icontains=category_lower)
-                
-                # Add aliases for common component names
-                if 'gpu' in category_lower or 'graphic' in category_lower or 'video card' in category_lower:
-                    # Search for GPU, graphics card, or any variant
-                    search_query |= Q(category_name__category_name__icontains='gpu')
-                    search_query |= Q(category_name__category_name__icontains='graphics')
-                    search_query |= Q(category_name__category_name__icontains='card')
-                    search_query |= Q(product_name__icontains='graphics')
-                    search_query |= Q(product_name__icontains='gpu')
-                
-                # Strategy 1: Try category_name match with flexible search
-                products_list = list(Product.objects.filter(
-                    Q(stock__gt=0) & search_query
-                ).select_related('brand', 'category_name')[:max_results])
-                
-                # Strategy 2: If no results, try product name (case-insensitive)
-                if not products_list:
-                    products_list = list(Product.objects.filter(
-                        stock__gt=0,
-                        product_name__icontains=category
-                    ).select_related('brand', 'category_name')[:max_results])
-                
-                # Apply price filter if results found
-                if products_list and max_price:
-                    try:
-                        max_price_val = float(max_price)
-                        products_list = [p for p in products_list if p.price <= max_price_val]
-                    except:
-                        pass
-                
-                # Format and return results
-                if products_list:
-                    products_data = []
-                    for product in products_list:
-                        brand_name = 'Unknown'
-                        if product.brand:
-                            brand_name = product.brand.brand if hasattr(product.brand, 'brand') else str(product.brand)
-                        
-                        category_name = 'Unknown'
-                        if product.category_name:
-                            category_name = product.category_name.category_name
-                        
-                        # Safely get image URL
-                        image_url = '/static/images/placeholder.png'
-                        if product.has_valid_image():
-                            try:
-                                image_url = product.image.url
-                            except (ValueError, AttributeError):
-                                image_url = '/static/images/placeholder.png'
-                        
-                        products_data.append({
-                            'id': product.id,
-                            'name': product.product_name,
-                            'brand': brand_name,
-                            'price': float(product.price),
-                            'category': category_name,
-                            'image_url': image_url,
-                            'description': product.description or '',
-                            'model_3d': f'/api/product/{product.id}/model-3d/' if product.model_3d else None
-                        })
-                    
-                    return JsonResponse({
-                        'success': True,
-                        'count': len(products_data),
-                        'products': products_data
-                    })
-            except Exception as cat_error:
-                logger.error(f"Category filter error: {str(cat_error)}")
-                pass
-        
-        # Fall back to query parameter search if no category or no results
-        if not query and not products_list:
-            return JsonResponse({
-                'success': True,
-                'count': 0,
-                'products': []
-            })
-        
-        if query:
-            # Create flexible search query using Q objects
-            search_query = Q()
-            
-            # Add the main query search
-            search_query |= Q(category_name__category_name__icontains=query)
-            
-            # Add special aliases for common components
-            if 'gpu' in query.lower() or 'graphic' in query.lower() or 'video' in query.lower():
-                # Graphics card search - find any variant
-                search_query |= Q(category_name__category_name__icontains='gpu')
-                search_query |= Q(category_name__category_name__icontains='graphics')
-                search_query |= Q(product_name__icontains='graphics')
-                search_query |= Q(product_name__icontains='gpu')
-            
-            # Try category and product name search first
-            try:
-                category_products = Product.objects.filter(
-                    Q(stock__gt=0) & search_query
-                ).select_related('brand', 'category_name')
-                
-                if category_products.exists():
-                    # Apply price filter
-                    if max_price:
-                        try:
-                            max_price_val = float(max_price)
-                            category_products = category_products.filter(price__lte=max_price_val)
-                        except:
-                            pass
-                    
-                    products_list = list(category_products[:max_results])
-            except Exception as cat_error:
-                logger.error(f"Category search error: {str(cat_error)}")
-                pass
-            
-            # If no category results, try product name search
-            if not products_list:
-                try:
-                    name_products = Product.objects.filter(
-                        stock__gt=0,
-                        product_name__icontains=query
-                    ).select_related('brand', 'category_name')
-                    
-                    if name_products.exists():
-                        # Apply price filter
-                        if max_price:
-                            try:
-                                max_price_val = float(max_price)
-                                name_products = name_products.filter(price__lte=max_price_val)
-                            except:
-                                pass
-                        
-                        products_list = list(name_products[:max_results])
-                except Exception as name_error:
-                    logger.error(f"Product name search error: {str(name_error)}")
-                    pass
-            
-            # If still no results, try brand search
-            if not products_list:
+
+        max_price = None
+        try:
+            max_price = Decimal(request.GET.get('max_price') or '')
+            if not max_price.is_finite():
+                max_price = None
+        except InvalidOperation:
+            pass
+
+        try:
+            max_results = min(max(int(request.GET.get('max_results', 6)), 0), 50)
+        except (TypeError, ValueError):
+            max_results = 6
+
+        def build():
+            products_list = recommend_products(query=query, category=category, max_price=max_price, limit=max_results)
+
+            # Format results
+            products_data = []
+            for product in products_list:
                 try:
-                    brand_products = Product.objects.filter(
-                        stock__gt=0,
-                        brand__brand__icontains=query
-                    ).select_related('brand', 'category_name')
-                    
-                    if brand_products.exists():
-                        # Apply price filter
-                        if max_price:
-                            try:
-                                max_price_val = float(max_price)
-                                brand_products = brand_products.filter(price__lte=max_price_val)
-                            except:
-                                pass
-                        
-                        products_list = list(brand_products[:max_results])
-                except Exception as brand_error:
-                    logger.error(f"Brand search error: {str(brand_error)}")
-                    pass
-        
-        # Format results
-        products_data = []
-        for product in products_list:
-            try:
-                cat_name = 'Unknown'
-                if product.category_name:
-                    cat_name = product.category_name.category_name or 'Unknown'
+                    cat_name = 'Unknown'
+                    if product.category_name:
+                        cat_name = product.category_name.category_name or 'Unknown'
                 
-                brand_name = 'Unknown'
-                if product.brand:
-                    brand_name = product.brand.brand or 'Unknown'
+                    brand_name = 'Unknown'
+                    if product.brand:
+                        brand_name = product.brand.brand or 'Unknown'
                 
-                image_url = '/static/images/placeholder.png'
-                if product.has_valid_image():
-                    try:
-                        image_url = product.image.url
-                    except (ValueError, AttributeError):
-                        image_url = '/static/images/placeholder.png'
+                    image_url = '/static/images/placeholder.png'
+                    if product.has_valid_image():
+                        try:
+                            image_url = product.image.url
+                        except (ValueError, AttributeError):
+                            image_url = '/static/images/placeholder.png'
                 
-                model_3d_url = None
-                if product.model_3d:
-                    model_3d_url = f'/api/product/{product.id}/model-3d/'
+                    model_3d_url = None
+                    if product.model_3d:
+                        model_3d_url = f'/api/product/{product.id}/model-3d/'
                 
-                product_dict = {
-                    'id': product.id,
-                    'name': product.product_name or 'Unnamed',
-                    'category': cat_name,
-                    'price': float(product.price or 0),
-                    'description': product.description or '',
-                    'image_url': image_url,
-                    'brand': brand_name,
-                    'model_3d': model_3d_url
-                }
-                products_data.append(product_dict)
-            except Exception as item_error:
-                logger.error(f"Error formatting product: {str(item_error)}")
-                continue
-        
+                    product_dict = {
+                        'id': product.id,
+                        'name': product.product_name or 'Unnamed',
+                        'category': cat_name,
+                        'price': float(product.price or 0),
+                        'description': product.description or '',
+                        'image_url': image_url,
+                        'brand': brand_name,
+                        'model_3d': model_3d_url
+                    }
+                    products_data.append(product_dict)
+                except Exception as item_error:
+                    logger.error(f"Error formatting product: {str(item_error)}")
+                    continue
+            return products_data
+
+        # Cached per query until the catalog changes
+        products_data = catalog_cached('recommend', build, query, category, str(max_price), max_results)
+
         return JsonResponse({
             'success': True,
             'count': len(products_data),
@@ -494,11 +479,11 @@ def api_available_categories(request):
     Used by chatbot to know what categories actually exist
     """
     try:
-        from .models import Category
+        from .catalog import get_facets
         
-        # Get all categories
-        categories = Category.objects.all().values_list('category_name', flat=True).distinct()
-        categories_list = sorted(list(categories))
+        # All category names, from the cached catalog facets
+        categories = {c['category_name'] for c in get_facets()['categories'] if c['category_name']}
+        categories_list = sorted(categories)
         
         return JsonResponse({
             'success': True,
@@ -521,26 +506,14 @@ def api_store_info(request):
     Includes product categories, component types, and general store info
     """
     try:
-        from .models import Category, Product
-        from django.db.models import Min, Max
+        from .catalog import get_facets, categories_in_stock
         
-        # Get all available categories with stock
-        categories_with_stock = Product.objects.filter(
-            stock__gt=0
-        ).values_list('category_name__category_name', flat=True).distinct()
-        categories_list = sorted(list(set([c for c in categories_with_stock if c])))
-        
-        # Get price range
-        price_data = Product.objects.filter(stock__gt=0).aggregate(
-            min_price=Min('price'),
-            max_price=Max('price')
-        )
-        
-        min_price = float(price_data['min_price'] or 0)
-        max_price = float(price_data['max_price'] or 0)
-        
-        # Count total products in stock
-        total_products = Product.objects.filter(stock__gt=0).count()
+        # Categories, price range and stock count all come from one cached snapshot
+        facets = get_facets()
+        categories_list = categories_in_stock(facets)
+        min_price = facets['in_stock_price_range']['min'] or 0.0
+        max_price = facets['in_stock_price_range']['max'] or 0.0
+        total_products = facets['total_in_stock']
         
         return JsonResponse({
             'success': True,
@@ -562,6 +535,181 @@ def api_store_info(request):
         }, status=500)
 
 
+def _chat_session_error(request, session_id):
+    """A JsonResponse rejecting ``session_id`` for this visitor, or None when it is theirs to write."""
+    if not session_id:
+        return JsonResponse({'success': False, 'error': 'session_id required'}, status=400)
+    if request.user.is_authenticated:
+        # For logged-in users, session_id should be user-{id}-chat
+        if session_id != f'user-{request.user.id}-chat':
+            return JsonResponse({'success': False, 'error': 'Invalid session for logged-in user'}, status=403)
+    elif not session_id.startswith('anon-'):
+        # For anonymous users, session_id should start with 'anon-'
+        return JsonResponse({'success': False, 'error': 'Invalid session for anonymous user'}, status=403)
+    return None
+
+
+def _writable_conversation(request, session_id):
+    """(conversation, None) for this visitor's conversation (created if needed), or (None, error response)."""
+    from .models import ChatConversation
+
+    error = _chat_session_error(request, session_id)
+    if error:
+        return None, error
+
+    # Get or create conversation - each user gets their own
+    conversation, created = ChatConversation.objects.get_or_create(
+        session_id=session_id,
+        defaults={'user': request.user if request.user.is_authenticated else None}
+    )
+
+    # Verify user ownership (for logged-in users)
+    if request.user.is_authenticated and conversation.user != request.user:
+        return None, JsonResponse({'success': False, 'error': 'Unauthorized: Cannot modify another user\'s conversation'}, status=403)
+    return conversation, None
+
+
+@require_http_methods(["POST"])
+def api_append_chat_messages(request):
+    """
+    Append new chat messages (and optionally the build state) to a conversation
+    POST data: {
+        "session_id": "unique-session-id",
+        "after_seq": 12,  (the last message number the client already saved)
+        "messages": [{"role": "user/model", "content": "..."}],  (only the new ones)
+        "build_state": { "selectedComponents": {...}, ... }  (optional)
+    }
+    Messages the server already has are skipped, so retries are safe. When
+    after_seq is ahead of the server the response is a 409 with last_seq,
+    and the client should resend from there.
+    """
+    from .chat import append_messages, ChatSequenceConflict, MAX_APPEND_MESSAGES
+
+    try:
+        data = json.loads(request.body)
+        after_seq = int(data.get('after_seq', 0))
+        messages = data.get('messages', [])
+        if after_seq < 0 or not isinstance(messages, list):
+            raise ValueError
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'after_seq (number) and messages (list) required'}, status=400)
+    if len(messages) > MAX_APPEND_MESSAGES:
+        return JsonResponse({'success': False, 'error': f'At most {MAX_APPEND_MESSAGES} messages per request'}, status=400)
+
+    try:
+        conversation, error = _writable_conversation(request, data.get('session_id', ''))
+        if error:
+            return error
+        try:
+            last_seq, appended = append_messages(conversation, after_seq, messages, data.get('build_state') or None)
+        except ChatSequenceConflict as e:
+            return JsonResponse({'success': False, 'error': str(e), 'last_seq': e.last_seq}, status=409)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+        return JsonResponse({
+            'success': True,
+            'conversation_id': conversation.id,
+            'last_seq': last_seq,
+            'appended': appended,
+        })
+
+    except Exception as e:
+        logger.error(f"Error appending chat messages: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+
+def _sse(event, data):
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@require_http_methods(["POST"])
+def api_stream_chat(request):
+    """
+    Ask the assistant and stream its reply as Server-Sent Events
+    POST data: {
+        "session_id": "unique-session-id",
+        "after_seq": 12,  (the last message number the client already saved)
+        "messages": [{"role": "user", "content": "..."}]  (the unsaved ones, ending with the question)
+    }
+    The prompt (system prompt, store inventory, summary and recent history)
+    is assembled here. Events: "token" {"text"} for each chunk, then "done"
+    {"last_seq", "text", "ttft_ms"} once the messages and the reply are
+    stored, or "error" {"error"} (nothing is stored). Request errors are
+    answered before streaming, as JSON with the same statuses as
+    api_append_chat_messages.
+    """
+    from .chat import append_messages, parse_messages, ChatSequenceConflict, MAX_APPEND_MESSAGES
+    from . import llm
+
+    try:
+        data = json.loads(request.body)
+        after_seq = int(data.get('after_seq', 0))
+        messages = data.get('messages', [])
+        if after_seq < 0 or not isinstance(messages, list) or not messages:
+            raise ValueError
+    except (TypeError, ValueError):
+        return JsonResponse({'success': False, 'error': 'after_seq (number) and messages (non-empty list) required'}, status=400)
+    if len(messages) > MAX_APPEND_MESSAGES:
+        return JsonResponse({'success': False, 'error': f'At most {MAX_APPEND_MESSAGES} messages per request'}, status=400)
+    try:
+        parsed = parse_messages(messages)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    if parsed[-1][0] != 'user' or not parsed[-1][1].strip():
+        return JsonResponse({'success': False, 'error': 'The last message must be the user\'s question'}, status=400)
+
+    try:
+        conversation, error = _writable_conversation(request, data.get('session_id', ''))
+        if error:
+            return error
+        if after_seq > conversation.last_seq:
+            return JsonResponse({'success': False, 'error': f'Conversation only has {conversation.last_seq} message(s)', 'last_seq': conversation.last_seq}, status=409)
+        system, contents = llm.build_prompt(conversation, after_seq, [{'role': role, 'content': content} for role, content, meta in parsed])
+        upstream = llm.get_upstream()
+    except Exception as e:
+        logger.error(f"Error preparing chat reply: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)}, status=500)
+
+    def events():
+        reply = llm.TimedStream(upstream.stream(system, contents))
+        try:
+            for chunk in reply:
+                yield _sse('token', {'text': chunk})
+        except GeneratorExit:
+            # The browser went away: nothing is stored, the client resends the question
+            reply.finish(disconnected=True)
+            raise
+        except Exception as e:
+            logger.error(f"Chat upstream failed: {str(e)}")
+            reply.finish(error=True)
+            yield _sse('error', {'error': 'AI service unavailable. Please try again in a moment.'})
+            return
+        reply.finish(error=not reply.text.strip())
+        if not reply.text.strip():
+            yield _sse('error', {'error': 'Empty response from AI. Please try again.'})
+            return
+
+        turn = messages + [{'role': 'assistant', 'content': reply.text.strip(), 'timestamp': int(time.time() * 1000)}]
+        try:
+            last_seq, _ = append_messages(conversation, after_seq, turn)
+        except ChatSequenceConflict as e:
+            yield _sse('error', {'error': str(e), 'last_seq': e.last_seq})
+            return
+        except Exception as e:
+            logger.error(f"Error storing chat reply: {str(e)}")
+            yield _sse('error', {'error': 'Could not save the reply. Please try again.'})
+            return
+        yield _sse('done', {'last_seq': last_seq, 'text': reply.text.strip(), 'ttft_ms': round(reply.ttft_ms, 1)})
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @require_http_methods(["POST"])
 def api_save_chat_conversation(request):
     """
@@ -572,48 +720,29 @@ def api_save_chat_conversation(request):
         "messages": [{"role": "user/model", "content": "..."}],
         "build_state": { "selectedComponents": {...}, ... }  (optional)
     }
+    Kept for clients that send the whole history; only messages beyond the
+    stored ones are written. New clients use api_append_chat_messages.
     """
+    from .chat import save_history
+
     try:
-        from .models import ChatConversation
-        
         data = json.loads(request.body)
-        session_id = data.get('session_id', '')
         messages = data.get('messages', [])
-        build_state = data.get('build_state', {})
-        
-        if not session_id:
-            return JsonResponse({'success': False, 'error': 'session_id required'}, status=400)
-        
-        # Validate session ID format
-        if request.user.is_authenticated:
-            # For logged-in users, session_id should be user-{id}-chat
-            expected_session = f'user-{request.user.id}-chat'
-            if session_id != expected_session:
-                return JsonResponse({'success': False, 'error': 'Invalid session for logged-in user'}, status=403)
-        else:
-            # For anonymous users, session_id should start with 'anon-'
-            if not session_id.startswith('anon-'):
-                return JsonResponse({'success': False, 'error': 'Invalid session for anonymous user'}, status=403)
-        
-        # Get or create conversation - each user gets their own
-        conversation, created = ChatConversation.objects.get_or_create(
-            session_id=session_id,
-            defaults={'user': request.user if request.user.is_authenticated else None}
-        )
-        
-        # Verify user ownership (for logged-in users)
-        if request.user.is_authenticated and conversation.user != request.user:
-            return JsonResponse({'success': False, 'error': 'Unauthorized: Cannot modify another user\'s conversation'}, status=403)
-        
-        # Update messages and build state
-        conversation.messages = messages
-        if build_state:
-            conversation.build_state = build_state
-        conversation.save()
-        
+        if not isinstance(messages, list):
+            return JsonResponse({'success': False, 'error': 'messages must be a list'}, status=400)
+
+        conversation, error = _writable_conversation(request, data.get('session_id', ''))
+        if error:
+            return error
+        try:
+            last_seq, appended = save_history(conversation, messages, data.get('build_state') or None)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
         return JsonResponse({
             'success': True,
             'conversation_id': conversation.id,
+            'last_seq': last_seq,
             'message': 'Conversation saved'
         })
     
@@ -626,15 +755,29 @@ def api_save_chat_conversation(request):
 def api_load_chat_conversation(request):
     """
     Load chat conversation for logged-in users or by session_id
-    GET params: session_id (required)
+    GET params: session_id (required), then either
+      limit (newest page first, up to 100 messages) and before (the seq of
+      the oldest message the client has, for the next older page), or
+      after (only messages with a higher seq), or neither (everything)
+    Sends an ETag; an unchanged conversation answers If-None-Match with a 304.
     """
     try:
         from .models import ChatConversation
+        from .chat import messages_after, page_before, history_etag, MAX_PAGE_SIZE
         
         session_id = request.GET.get('session_id', '')
         
         if not session_id:
             return JsonResponse({'success': False, 'error': 'session_id required'}, status=400)
+
+        try:
+            after_seq = max(int(request.GET.get('after', 0)), 0)
+            limit = request.GET.get('limit')
+            limit = min(max(int(limit), 1), MAX_PAGE_SIZE) if limit else None
+            before_seq = request.GET.get('before')
+            before_seq = int(before_seq) if before_seq else None
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'after, before and limit must be numbers'}, status=400)
         
         # Try to get conversation
         conversation = ChatConversation.objects.filter(session_id=session_id).first()
@@ -644,15 +787,33 @@ def api_load_chat_conversation(request):
             return JsonResponse({
                 'success': True,
                 'messages': [],
-                'found': False
+                'found': False,
+                'last_seq': 0,
+                'has_more': False
             })
-        
-        return JsonResponse({
-            'success': True,
-            'messages': conversation.messages,
-            'found': True,
-            'conversation_id': conversation.id
-        })
+
+        etag = history_etag(conversation)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            if limit:
+                messages, has_more = page_before(conversation, before_seq, limit)
+            else:
+                messages, has_more = messages_after(conversation, after_seq), False
+            response = JsonResponse({
+                'success': True,
+                'messages': messages,
+                'found': True,
+                'conversation_id': conversation.id,
+                'last_seq': conversation.last_seq,
+                'has_more': has_more,
+                # Seq to pass as ?before= for the next older page
+                'next_before': messages[0]['seq'] if has_more else None,
+                'summary': conversation.summary
+            })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        response['Vary'] = 'Cookie'
+        return response
     
     except Exception as e:
         logger.error(f"Error loading chat: {str(e)}")
@@ -674,19 +835,9 @@ def api_delete_chat_conversation(request):
         data = json.loads(request.body)
         session_id = data.get('session_id', '')
         
-        if not session_id:
-            return JsonResponse({'success': False, 'error': 'session_id required'}, status=400)
-        
-        # Validate session ID format
-        if request.user.is_authenticated:
-            # For logged-in users, session_id should be user-{id}-chat
-            expected_session = f'user-{request.user.id}-chat'
-            if session_id != expected_session:
-                return JsonResponse({'success': False, 'error': 'Invalid session for logged-in user'}, status=403)
-        else:
-            # For anonymous users, session_id should start with 'anon-'
-            if not session_id.startswith('anon-'):
-                return JsonResponse({'success': False, 'error': 'Invalid session for anonymous user'}, status=403)
+        error = _chat_session_error(request, session_id)
+        if error:
+            return error
         
         # Get conversation first to verify ownership
         conversation = ChatConversation.objects.filter(session_id=session_id).first()
@@ -0,0 +1,159 @@
+"""
+Appointment slot capacity.
+
+Every date has an AppointmentDay row (daily capacity, booked counter and a
+blackout flag) and every bookable hour an AppointmentSlot row. The rows
+are created with the configured capacities the first time a date is booked
+(or a blackout day is added in the admin); a date without rows is empty.
+Every appointment that is not cancelled holds one place at its date and
+time: saving or deleting an Appointment (hold_slot and the post_delete
+receiver in app/signals.py) books, moves and releases it with guarded F()
+updates in the same transaction, so two customers cannot both take the
+last place, and availability for any window of dates is a couple of
+indexed range reads.
+
+Opening hours, capacities and closed weekdays come from the APPOINTMENT_*
+settings.
+"""
+from datetime import time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import Appointment, AppointmentDay, AppointmentSlot
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Widest window the availability endpoint will answer for
+MAX_WINDOW_DAYS = 366
+
+
+class SlotUnavailable(Exception):
+    """Raised when a date/time cannot take another appointment"""
+    pass
+
+
+def slot_times():
+    return [time(hour) for hour in range(settings.APPOINTMENT_OPENING_HOUR, settings.APPOINTMENT_CLOSING_HOUR)]
+
+
+def slot_choices():
+    """(value, label) pairs for the appointment form, e.g. ("13:00", "01:00 PM")."""
+    return [(t.strftime('%H:%M'), t.strftime('%I:%M %p')) for t in slot_times()]
+
+
+def closed_weekday(day):
+    return day.weekday() in settings.APPOINTMENT_CLOSED_WEEKDAYS
+
+
+def ensure_day(day):
+    """Create the day and slot rows for ``day`` with the configured capacities, if missing."""
+    AppointmentDay.objects.bulk_create([AppointmentDay(date=day)], ignore_conflicts=True)
+    AppointmentSlot.objects.bulk_create(
+        [AppointmentSlot(date=day, time=t) for t in slot_times()],
+        ignore_conflicts=True,
+    )
+
+
+def book_slot(day, at):
+    """Take one place on ``day`` at ``at``, or raise SlotUnavailable."""
+    if closed_weekday(day) or at not in slot_times():
+        raise SlotUnavailable(f"{day} {at:%H:%M} is outside opening hours")
+    with transaction.atomic():
+        ensure_day(day)
+        if not AppointmentDay.objects.filter(date=day, closed=False, booked__lt=F('capacity')).update(booked=F('booked') + 1):
+            raise SlotUnavailable(f"{day} is fully booked")
+        if not AppointmentSlot.objects.filter(date=day, time=at, booked__lt=F('capacity')).update(booked=F('booked') + 1):
+            raise SlotUnavailable(f"{day} {at:%H:%M} is fully booked")
+
+
+def release_slot(day, at):
+    """Give back the place taken by a cancelled, moved or deleted appointment."""
+    with transaction.atomic():
+        AppointmentDay.objects.filter(date=day).update(booked=Greatest(F('booked') - 1, Value(0)))
+        AppointmentSlot.objects.filter(date=day, time=at).update(booked=Greatest(F('booked') - 1, Value(0)))
+
+
+def held_place(date, at, status):
+    """(date, time) of the place an appointment in this state holds, None when cancelled."""
+    if status == 'Cancelled':
+        return None
+    return (
+        Appointment._meta.get_field('date').to_python(date),
+        Appointment._meta.get_field('time').to_python(at),
+    )
+
+
+def hold_slot(appointment):
+    """
+    Before an appointment is saved: book its place when it is created or
+    un-cancelled, move it when the date or time changed and release it when
+    it is cancelled. Raises SlotUnavailable when the new place is taken.
+    """
+    previous = None
+    if not appointment._state.adding:
+        previous = getattr(appointment, '_stored_place', None)
+        if previous is None:
+            previous = Appointment.objects.filter(pk=appointment.pk).values_list('date', 'time', 'status').first()
+    held = held_place(*previous) if previous else None
+    wanted = held_place(appointment.date, appointment.time, appointment.status)
+    if held == wanted:
+        return
+    with transaction.atomic():
+        if held:
+            release_slot(*held)
+        if wanted:
+            book_slot(*wanted)
+
+
+def available_times(day):
+    """The free slot times on ``day`` (none for past, closed or full days)."""
+    if day < timezone.localdate() or closed_weekday(day):
+        return []
+    day_row = AppointmentDay.objects.filter(date=day).first()
+    if day_row and (day_row.closed or day_row.booked >= day_row.capacity):
+        return []
+    full = set(
+        AppointmentSlot.objects.filter(date=day, booked__gte=F('capacity')).values_list('time', flat=True)
+    )
+    return [t for t in slot_times() if t not in full]
+
+
+def is_available(day, at):
+    return at in available_times(day)
+
+
+def unavailable_dates(start, end):
+    """
+    Dates between ``start`` and ``end`` (inclusive) that cannot be booked, as
+    (full, closed): full dates have no place left, closed ones are blackout
+    days or closed weekdays.
+    """
+    closed = set()
+    full = set()
+    day = start
+    while day <= end:
+        if closed_weekday(day):
+            closed.add(day)
+        day += timedelta(days=1)
+
+    for date, capacity, booked, is_closed in AppointmentDay.objects.filter(date__range=(start, end)).values_list(
+        'date', 'capacity', 'booked', 'closed'
+    ):
+        if is_closed:
+            closed.add(date)
+        elif booked >= capacity:
+            full.add(date)
+
+    times = slot_times()
+    slot_counts = AppointmentSlot.objects.filter(date__range=(start, end), time__in=times).values('date').annotate(
+        slots=Count('id'),
+        open=Count('id', filter=Q(booked__lt=F('capacity'))),
+    ).order_by()
+    for row in slot_counts:
+        if row['slots'] == len(times) and row['open'] == 0:
+            full.add(row['date'])
+
+    return sorted(full - closed), sorted(closed)
@@ -0,0 +1,100 @@
+"""
+Read-through caching with single-flight rebuilds and hit/miss metrics.
+
+get_or_build(key, build, timeout) returns the cached value for ``key`` or
+stores build()'s result in the configured cache (settings.CACHES). When a
+key is missing, only the caller that takes its short-lived lock key runs
+build(); the others poll for the result for up to CACHE_BUILD_WAIT_SECONDS
+and only build it themselves if it has not appeared by then. A failing
+cache backend is logged and bypassed, never surfaced to the page.
+
+Callers make keys versioned so they can invalidate a whole family at once
+(see catalog_cached() in app/catalog.py). Hits, misses, builds and waits
+are counted per metric name in this process; stats() reports them.
+"""
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.core.cache import cache
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks while another caller rebuilds a key
+BUILD_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+_stats = defaultdict(Counter)
+_stats_lock = threading.Lock()
+
+
+def _count(name, event, amount=1):
+    with _stats_lock:
+        _stats[name][event] += amount
+
+
+def stats():
+    """Per-name counters for this process, with hit rate and mean build time."""
+    with _stats_lock:
+        snapshot = {name: dict(counts) for name, counts in _stats.items()}
+    for counts in snapshot.values():
+        lookups = counts.get('hits', 0) + counts.get('misses', 0)
+        counts['hit_rate'] = round(counts.get('hits', 0) / lookups, 3) if lookups else None
+        builds = counts.get('builds', 0)
+        counts['mean_build_ms'] = round(counts.pop('build_seconds', 0) * 1000 / builds, 1) if builds else None
+    return snapshot
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _cache_call(method, *args, default=None, **kwargs):
+    try:
+        return getattr(cache, method)(*args, **kwargs)
+    except Exception as e:
+        logger.warning(f"Cache {method} failed for {args[0]!r}: {e}")
+        return default
+
+
+def _build(name, key, build, timeout):
+    started = time.monotonic()
+    value = build()
+    _count(name, 'builds')
+    _count(name, 'build_seconds', time.monotonic() - started)
+    _cache_call('set', key, value, timeout)
+    return value
+
+
+def get_or_build(key, build, timeout, name=None):
+    """
+    Return the value cached under ``key``, building and caching it (for
+    ``timeout`` seconds) on a miss. ``name`` groups the metrics, default the
+    first part of the key.
+    """
+    name = name or key.split(':', 1)[0]
+    value = _cache_call('get', key, _MISSING, default=_MISSING)
+    if value is not _MISSING:
+        _count(name, 'hits')
+        return value
+    _count(name, 'misses')
+
+    lock_key = f"{key}:building"
+    if _cache_call('add', lock_key, 1, settings.CACHE_BUILD_LOCK_SECONDS, default=True):
+        try:
+            return _build(name, key, build, timeout)
+        finally:
+            _cache_call('delete', lock_key)
+
+    # Another caller is rebuilding this key: wait for its result
+    _count(name, 'waits')
+    deadline = time.monotonic() + settings.CACHE_BUILD_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(BUILD_POLL_INTERVAL)
+        value = _cache_call('get', key, _MISSING, default=_MISSING)
+        if value is not _MISSING:
+            return value
+    logger.warning(f"Gave up waiting for {key!r} to be rebuilt, building it here")
+    return _build(name, key, build, timeout)
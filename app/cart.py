@@ -0,0 +1,417 @@
+"""
+Server-side shopping cart backed by the Cart table.
+
+Lines belong to the logged-in user, or to an anonymous visitor through a
+random token kept in the session (the session key itself changes on login,
+the token survives it). Only the token lives in the session; names, prices,
+images and stock are always read live from Product/ProductVariation with
+one joined query per request, however many lines the cart has.
+
+An anonymous cart is only reachable while its session lasts: purge_abandoned()
+(the daily purge_abandoned_carts beat task) deletes token carts that have not
+had a line added for SESSION_COOKIE_AGE.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+from .models import Cart, Product, ProductVariation
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
+
+SESSION_TOKEN_KEY = 'cart_token'
+# Where the cart lived before it moved to the database
+LEGACY_SESSION_KEY = 'cart'
+
+
+def product_cart_key(product_id):
+    return str(product_id)
+
+
+def variation_cart_key(variation_id):
+    return f"variant-{variation_id}"
+
+
+class CartLine:
+    """A cart row with live name, price, stock and image from its product or variation"""
+
+    def __init__(self, row):
+        self.row = row
+        self.product = row.produkto
+        self.variation = row.variation
+        self.cart_key = row.cart_key
+        self.quantity = row.quantity
+        self.product_id = row.produkto_id
+        self.variant_id = row.variation_id
+
+    @property
+    def price(self):
+        return float(self.variation.price if self.variation else self.product.price)
+
+    @property
+    def stock(self):
+        return self.variation.stock if self.variation else self.product.stock
+
+    @property
+    def variation_name(self):
+        return self.variation.product_variation if self.variation else None
+
+    @property
+    def product_name(self):
+        if self.variation:
+            return f"{self.product.product_name} ({self.variation.product_variation})"
+        return self.product.product_name
+
+    @property
+    def image(self):
+        try:
+            if self.variation and self.variation.image:
+                return self.variation.image.url
+            if self.product.image:
+                return self.product.image.url
+        except ValueError:
+            pass
+        return None
+
+    @property
+    def category_name(self):
+        category = self.product.category_name
+        return category.category_name if category else 'Unknown'
+
+    @property
+    def sub_total(self):
+        return self.price * self.quantity
+
+    def as_dict(self):
+        return {
+            'cart_key': self.cart_key,
+            'product_id': self.product_id,
+            'variant_id': self.variant_id,
+            'product_name': self.product_name,
+            'category_name': self.category_name,
+            'image': self.image,
+            'price': self.price,
+            'quantity': self.quantity,
+            'stock': self.stock,
+            'sub_total': self.sub_total,
+        }
+
+
+class ShoppingCart:
+    """The current request's cart. Create one per request with ``ShoppingCart(request)``."""
+
+    def __init__(self, request):
+        self.request = request
+        self.session = request.session
+        self._lines = None
+        self._import_legacy_session_cart()
+
+    # --- ownership ---
+
+    def _owner(self, create=False):
+        """Filter kwargs selecting this cart's rows, or None for an anonymous visitor without a cart yet."""
+        user = getattr(self.request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return {'user': user}
+        token = self.session.get(SESSION_TOKEN_KEY)
+        if not token:
+            if not create:
+                return None
+            token = str(uuid.uuid4())
+            self.session[SESSION_TOKEN_KEY] = token
+        return {'session_token': token}
+
+    def _rows(self):
+        owner = self._owner()
+        if owner is None:
+            return Cart.objects.none()
+        return Cart.objects.filter(**owner)
+
+    # --- reading ---
+
+    def lines(self):
+        """Every line with its product, category and variation, in one query."""
+        if self._lines is None:
+            rows = self._rows().select_related('produkto__category_name', 'variation').order_by('added_at', 'id')
+            self._lines = [CartLine(row) for row in rows]
+        return self._lines
+
+    def get_line(self, cart_key):
+        for line in self.lines():
+            if line.cart_key == str(cart_key):
+                return line
+        return None
+
+    def as_dict(self):
+        """{cart_key: CartLine} in the order lines were added."""
+        return {line.cart_key: line for line in self.lines()}
+
+    def total_price(self):
+        return sum(line.sub_total for line in self.lines())
+
+    def count(self):
+        """Total quantity across all lines."""
+        if self._lines is not None:
+            return sum(line.quantity for line in self._lines)
+        if self._owner() is None:
+            return 0
+        return self._rows().aggregate(total=Sum('quantity'))['total'] or 0
+
+    def __len__(self):
+        return len(self.lines())
+
+    def __bool__(self):
+        return bool(self.lines())
+
+    # --- writing ---
+
+    def add(self, product, quantity=1, variation=None):
+        """
+        Add ``quantity`` of a product (or one of its variations), capped at
+        the live stock. Returns the line's new quantity (0 when out of stock).
+        """
+        result = self._apply_additions([(product, variation, int(quantity))])[0]
+        return result['quantity']
+
+    def add_many(self, items):
+        """
+        Add a batch of lines, e.g. a whole PC build, in a constant number of queries.
+
+        ``items`` is a list of dicts with ``id`` (or ``product_id``), optional
+        ``variant_id`` and optional ``quantity`` (default 1). The whole batch is
+        validated first: if any line is malformed or names an unknown product
+        or variation, nothing is added. Returns (ok, report) where report has
+        one entry per requested line with a ``status`` of added, clamped,
+        out_of_stock, not_found or invalid (skipped for good lines of a
+        rejected batch).
+        """
+        parsed = []
+        for item in items:
+            entry = {'product_id': None, 'variant_id': None, 'requested': None}
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError
+                product_id = item.get('product_id', item.get('id'))
+                variant_id = item.get('variant_id')
+                entry['product_id'] = int(product_id) if product_id not in (None, '') else None
+                entry['variant_id'] = int(variant_id) if variant_id not in (None, '') else None
+                entry['requested'] = int(item.get('quantity', 1))
+                if entry['requested'] < 1 or (entry['product_id'] is None and entry['variant_id'] is None):
+                    raise ValueError
+            except (TypeError, ValueError):
+                entry['status'] = 'invalid'
+            parsed.append(entry)
+
+        product_ids = {e['product_id'] for e in parsed if 'status' not in e and e['variant_id'] is None}
+        variant_ids = {e['variant_id'] for e in parsed if 'status' not in e and e['variant_id'] is not None}
+        products = Product.objects.in_bulk(product_ids) if product_ids else {}
+        variations = ProductVariation.objects.select_related('product').in_bulk(variant_ids) if variant_ids else {}
+
+        additions = []
+        for entry in parsed:
+            if 'status' in entry:
+                continue
+            if entry['variant_id'] is not None:
+                variation = variations.get(entry['variant_id'])
+                if variation is None or (entry['product_id'] is not None and variation.product_id != entry['product_id']):
+                    entry['status'] = 'not_found'
+                    continue
+                entry['product_id'] = variation.product_id
+                additions.append((variation.product, variation, entry['requested']))
+            else:
+                product = products.get(entry['product_id'])
+                if product is None:
+                    entry['status'] = 'not_found'
+                    continue
+                additions.append((product, None, entry['requested']))
+
+        if any('status' in entry for entry in parsed):
+            for entry in parsed:
+                entry.setdefault('status', 'skipped')
+            return False, parsed
+
+        for entry, result in zip(parsed, self._apply_additions(additions)):
+            entry.update(result)
+        return True, parsed
+
+    def _apply_additions(self, additions):
+        """
+        Add (product, variation, quantity) lines against live stock using one
+        read of the affected rows, one bulk update and one bulk create.
+        Returns a result dict per addition, in order.
+        """
+        owner = self._owner(create=True)
+        self._lines = None
+        keyed = [
+            (variation_cart_key(variation.pk) if variation else product_cart_key(product.pk), product, variation, quantity)
+            for product, variation, quantity in additions
+        ]
+
+        try:
+            return self._write_additions(owner, keyed)
+        except IntegrityError:
+            # A concurrent request created one of the new lines first (locking
+            # cannot stop that): the rows exist now, so lock them and add to them
+            logger.info(f"Cart lines {[k for k, _, _, _ in keyed]} were created concurrently, re-applying")
+            return self._write_additions(owner, keyed)
+
+    def _write_additions(self, owner, keyed):
+        """One locked read-modify-write of the lines in ``keyed``, rolled back as a whole if it fails."""
+        with transaction.atomic():
+            rows = {
+                row.cart_key: row
+                for row in Cart.objects.select_for_update().filter(cart_key__in={k for k, _, _, _ in keyed}, **owner)
+            }
+            new_rows = {}
+            changed = {}
+            emptied = set()
+            results = []
+            for cart_key, product, variation, quantity in keyed:
+                stock = max(variation.stock if variation else product.stock, 0)
+                row = rows.get(cart_key) or new_rows.get(cart_key)
+                current = row.quantity if row else 0
+                new_quantity = min(current + quantity, stock)
+                added = max(new_quantity - current, 0)
+                if row is None:
+                    if new_quantity > 0:
+                        new_rows[cart_key] = Cart(
+                            produkto=product, variation=variation, cart_key=cart_key,
+                            quantity=new_quantity, **owner,
+                        )
+                elif new_quantity != current:
+                    row.quantity = new_quantity
+                    if row.pk and new_quantity > 0:
+                        changed[cart_key] = row
+                    elif row.pk:
+                        emptied.add(row.pk)
+                        changed.pop(cart_key, None)
+
+                if stock <= 0:
+                    status = 'out_of_stock'
+                elif added < quantity:
+                    status = 'clamped'
+                else:
+                    status = 'added'
+                results.append({'added': added, 'quantity': new_quantity, 'stock': stock, 'status': status})
+
+            if emptied:
+                Cart.objects.filter(pk__in=emptied).delete()
+            if changed:
+                Cart.objects.bulk_update(list(changed.values()), ['quantity'])
+            if new_rows:
+                Cart.objects.bulk_create(list(new_rows.values()))
+        return results
+
+    def update(self, cart_key, action=None, quantity=None):
+        """Increase/decrease a line by one, or set it to ``quantity`` (1..stock)."""
+        line = self.get_line(cart_key)
+        if line is None:
+            return None
+        stock = line.stock
+        new_quantity = line.quantity
+        if action == 'increase':
+            if new_quantity < stock:
+                new_quantity += 1
+        elif action == 'decrease':
+            if new_quantity > 1:
+                new_quantity -= 1
+        else:
+            new_quantity = max(1, min(int(quantity or 1), stock))
+
+        if new_quantity != line.quantity:
+            Cart.objects.filter(pk=line.row.pk).update(quantity=new_quantity)
+        self._lines = None
+        return new_quantity
+
+    def remove(self, cart_key):
+        self._rows().filter(cart_key=str(cart_key)).delete()
+        self._lines = None
+
+    def clear(self):
+        self._rows().delete()
+        self._lines = None
+
+    # --- migration of session carts ---
+
+    def _import_legacy_session_cart(self):
+        """Move a cart stored in the session by older code into the table, once."""
+        legacy = self.session.get(LEGACY_SESSION_KEY)
+        if legacy is None:
+            return
+        del self.session[LEGACY_SESSION_KEY]
+        if not isinstance(legacy, dict) or not legacy:
+            return
+
+        variation_ids = set()
+        product_ids = set()
+        for key, item in legacy.items():
+            if not isinstance(item, dict):
+                continue
+            if str(key).startswith('variant-') and item.get('variant_id'):
+                variation_ids.add(int(item['variant_id']))
+            elif str(key).isdigit():
+                product_ids.add(int(key))
+        variations = ProductVariation.objects.select_related('product').in_bulk(variation_ids)
+        products = Product.objects.in_bulk(product_ids)
+
+        additions = []
+        for key, item in legacy.items():
+            if not isinstance(item, dict):
+                continue
+            try:
+                quantity = int(item.get('quantity', 1))
+                if str(key).startswith('variant-'):
+                    variation = variations.get(int(item.get('variant_id') or 0))
+                    if variation:
+                        additions.append((variation.product, variation, quantity))
+                elif str(key).isdigit() and int(key) in products:
+                    additions.append((products[int(key)], None, quantity))
+            except (TypeError, ValueError):
+                logger.warning(f"Dropping unreadable session cart line {key!r}")
+        if additions:
+            self._apply_additions(additions)
+
+
+def merge_session_cart(request, user):
+    """
+    Move the anonymous cart identified by the session token into ``user``'s
+    cart (summing quantities of lines both carts have, capped at stock).
+    """
+    token = request.session.pop(SESSION_TOKEN_KEY, None)
+    if not token:
+        return
+
+    with transaction.atomic():
+        anonymous = list(Cart.objects.select_for_update().filter(session_token=token).select_related('produkto', 'variation'))
+        if not anonymous:
+            return
+        existing = {row.cart_key: row for row in Cart.objects.select_for_update().filter(user=user)}
+        for row in anonymous:
+            stock = row.variation.stock if row.variation else row.produkto.stock
+            if row.cart_key in existing:
+                target = existing[row.cart_key]
+                target.quantity = max(1, min(target.quantity + row.quantity, stock))
+                target.save(update_fields=['quantity'])
+                row.delete()
+            else:
+                row.user = user
+                row.session_token = None
+                row.save(update_fields=['user', 'session_token'])
+    logger.info(f"Merged {len(anonymous)} anonymous cart line(s) into {user}'s cart")
+
+
+def purge_abandoned(now=None):
+    """
+    Delete the lines of anonymous carts whose newest line is older than
+    SESSION_COOKIE_AGE, by which time the session holding their token has
+    expired. Returns the number of lines deleted.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.SESSION_COOKIE_AGE)
+    live_tokens = Cart.objects.filter(session_token__isnull=False, added_at__gte=cutoff).values('session_token')
+    deleted, _ = Cart.objects.filter(session_token__isnull=False).exclude(session_token__in=live_tokens).delete()
+    if deleted:
+        logger.info(f"Purged {deleted} abandoned anonymous cart line(s)")
+    return deleted
@@ -0,0 +1,156 @@
+"""
+Cached catalog reads: facets (brand and category counts, price ranges and
+in-stock counts) for the storefront sidebar and the chatbot store-info APIs,
+plus the category list and latest products shown on most pages.
+
+Everything is cached under the current catalog version through
+app/caching.py. Product, ProductImage, ProductVariation, ProductReview,
+Brand and Category signals bump the version (after commit), so a catalog
+change makes the next request build fresh data instead of waiting for expiry.
+"""
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, Max, Q
+from .caching import get_or_build
+from .models import Product, Brand, Category
+import hashlib
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION_KEY = 'catalog:version'
+FACETS_KEY = 'catalog:facets:{version}'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Seed from the clock so a lost key never resurrects an old snapshot
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        return cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(CATALOG_VERSION_KEY, version, timeout=None)
+        return version
+
+
+def catalog_changed():
+    """Invalidate cached facets once the current transaction commits."""
+    transaction.on_commit(bump_catalog_version)
+
+
+def _price(value):
+    return float(value) if value is not None else None
+
+
+def _build_facets():
+    in_stock = Q(stock__gt=0)
+    rows = Product.objects.values('category_name_id', 'brand_id').annotate(
+        products=Count('id'),
+        in_stock=Count('id', filter=in_stock),
+        min_price=Min('price'),
+        max_price=Max('price'),
+        min_stock_price=Min('price', filter=in_stock),
+        max_stock_price=Max('price', filter=in_stock),
+    ).order_by()
+
+    category_totals = defaultdict(lambda: {'product_count': 0, 'in_stock': 0})
+    brand_totals = defaultdict(lambda: {'product_count': 0, 'in_stock': 0})
+    brands_by_category = defaultdict(set)
+    totals = {'products': 0, 'in_stock': 0}
+    prices = {'min': None, 'max': None}
+    stock_prices = {'min': None, 'max': None}
+
+    def widen(bounds, low, high):
+        if low is not None and (bounds['min'] is None or low < bounds['min']):
+            bounds['min'] = low
+        if high is not None and (bounds['max'] is None or high > bounds['max']):
+            bounds['max'] = high
+
+    for row in rows:
+        for bucket in (category_totals[row['category_name_id']], brand_totals[row['brand_id']]):
+            bucket['product_count'] += row['products']
+            bucket['in_stock'] += row['in_stock']
+        if row['category_name_id'] is not None and row['brand_id'] is not None:
+            brands_by_category[row['category_name_id']].add(row['brand_id'])
+        totals['products'] += row['products']
+        totals['in_stock'] += row['in_stock']
+        widen(prices, row['min_price'], row['max_price'])
+        widen(stock_prices, row['min_stock_price'], row['max_stock_price'])
+
+    categories = [
+        {'id': pk, 'category_name': name, 'parent_id': parent_id, **category_totals[pk]}
+        for pk, name, parent_id in Category.objects.order_by('id').values_list('id', 'category_name', 'parent_id')
+    ]
+    brands = [
+        {'id': pk, 'brand': name, **brand_totals[pk]}
+        for pk, name in Brand.objects.order_by('brand', 'id').values_list('id', 'brand')
+    ]
+    # Alphabetical, with "Others" at the end
+    brands.sort(key=lambda brand: brand['brand'].lower() == 'others')
+
+    return {
+        'categories': categories,
+        'brands': brands,
+        'brands_by_category': {pk: sorted(ids) for pk, ids in brands_by_category.items()},
+        'total_products': totals['products'],
+        'total_in_stock': totals['in_stock'],
+        'price_range': {'min': _price(prices['min']), 'max': _price(prices['max'])},
+        'in_stock_price_range': {'min': _price(stock_prices['min']), 'max': _price(stock_prices['max'])},
+    }
+
+
+def get_facets():
+    """Return the facet snapshot for the current catalog version."""
+    version = get_catalog_version()
+
+    def build():
+        facets = _build_facets()
+        facets['version'] = version
+        return facets
+
+    return get_or_build(FACETS_KEY.format(version=version), build, settings.CATALOG_FACETS_CACHE_SECONDS, name='facets')
+
+
+def catalog_cached(name, build, *parts):
+    """
+    build()'s result, cached under the current catalog version. ``parts``
+    (e.g. request parameters) are hashed into the key.
+    """
+    key = f"catalog:{name}:{get_catalog_version()}"
+    if parts:
+        key += ':' + hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    return get_or_build(key, build, settings.CATALOG_CACHE_SECONDS, name=name)
+
+
+def all_categories():
+    """Every Category, as a list."""
+    return catalog_cached('categories', lambda: list(Category.objects.all()))
+
+
+def latest_products(limit):
+    """The ``limit`` newest products with an image, with category, brand and reviews loaded."""
+    return catalog_cached('latest_products', lambda: list(
+        Product.objects.filter(has_image=True).select_related('category_name', 'brand')
+        .prefetch_related('reviews').order_by('-created_at')[:limit]
+    ), limit)
+
+
+def brands_for_category(facets, category_id):
+    """Brands (sidebar order) with at least one product in ``category_id``."""
+    brand_ids = set(facets['brands_by_category'].get(category_id, ()))
+    return [brand for brand in facets['brands'] if brand['id'] in brand_ids]
+
+
+def categories_in_stock(facets):
+    """Sorted names of categories with at least one product in stock."""
+    return sorted({category['category_name'] for category in facets['categories'] if category['in_stock'] and category['category_name']})
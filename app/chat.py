@@ -0,0 +1,251 @@
+"""
+Chat history storage for the product page assistant.
+
+A ChatConversation's messages are ChatMessage rows numbered 1, 2, 3...;
+conversation.last_seq is the newest. Clients send only the messages after
+the last sequence number they know (append_messages) and read back only
+the ones they are missing (messages_after), so a turn writes one or two
+small rows instead of rewriting the whole history.
+
+enforce_retention() (the daily enforce_chat_retention beat task) deletes
+conversations idle past the CHAT_*_RETENTION_DAYS settings and folds the
+oldest messages of long ones into conversation.summary. It works in bounded
+batches and locks each conversation the same way appends do, so it can run
+while people are chatting.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Length
+from django.utils import timezone
+from .models import ChatConversation, ChatMessage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Messages accepted by one append request
+MAX_APPEND_MESSAGES = 50
+
+# Messages per page when loading history newest-first
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Characters of each customer message kept in the rolling summary
+SUMMARY_TOPIC_CHARS = 120
+
+
+class ChatSequenceConflict(Exception):
+    """Raised when a client appends after a sequence number the server does not have"""
+
+    def __init__(self, last_seq):
+        self.last_seq = last_seq
+        super().__init__(f"Conversation only has {last_seq} message(s)")
+
+
+def _split(message):
+    """(role, content, meta) from a client message, or ValueError if it is malformed."""
+    if not isinstance(message, dict) or not isinstance(message.get('role'), str) or not message['role']:
+        raise ValueError('Each message needs a role')
+    content = message.get('content', '')
+    if not isinstance(content, str):
+        raise ValueError('Message content must be a string')
+    meta = {key: value for key, value in message.items() if key not in ('role', 'content', 'seq')}
+    return message['role'][:20], content, meta
+
+
+def parse_messages(messages):
+    """[(role, content, meta)] for a list of client messages, or ValueError if one is malformed."""
+    return [_split(message) for message in messages]
+
+
+def message_dict(message):
+    """A ChatMessage as the client stored it, plus its seq."""
+    return {**message.meta, 'role': message.role, 'content': message.content, 'seq': message.seq}
+
+
+def append_messages(conversation, after_seq, messages, build_state=None):
+    """
+    Append ``messages``, which follow message number ``after_seq``. Leading
+    messages the server already has (a retried request) are skipped, so
+    appending is idempotent. Returns (last_seq, number appended); raises
+    ChatSequenceConflict when ``after_seq`` is ahead of the server and
+    ValueError for malformed messages.
+    """
+    parsed = parse_messages(messages)
+    with transaction.atomic():
+        locked = ChatConversation.objects.select_for_update().get(pk=conversation.pk)
+        if after_seq > locked.last_seq:
+            raise ChatSequenceConflict(locked.last_seq)
+
+        fresh = parsed[locked.last_seq - after_seq:]
+        ChatMessage.objects.bulk_create([
+            ChatMessage(conversation=locked, seq=locked.last_seq + offset, role=role, content=content, meta=meta)
+            for offset, (role, content, meta) in enumerate(fresh, start=1)
+        ])
+        locked.last_seq += len(fresh)
+        update_fields = ['last_seq', 'updated_at']
+        if build_state:
+            locked.build_state = build_state
+            update_fields.append('build_state')
+        if fresh or build_state:
+            locked.save(update_fields=update_fields)
+
+    conversation.last_seq = locked.last_seq
+    return locked.last_seq, len(fresh)
+
+
+def save_history(conversation, messages, build_state=None):
+    """
+    Store a full history as sent by older clients. A history that extends
+    the stored one only writes its new tail. Once a conversation has been
+    compacted, a client that reloaded it only has the messages after
+    compacted_seq, so a history at least that long continues from there. A
+    shorter one (the chat was cleared and restarted) replaces the stored
+    messages and summary.
+    """
+    with transaction.atomic():
+        locked = ChatConversation.objects.select_for_update().get(pk=conversation.pk)
+        if len(messages) >= locked.last_seq:
+            return append_messages(locked, 0, messages, build_state)
+        if len(messages) >= locked.last_seq - locked.compacted_seq:
+            return append_messages(locked, locked.compacted_seq, messages, build_state)
+        locked.chat_messages.all().delete()
+        locked.last_seq = locked.compacted_seq = 0
+        locked.summary = ''
+        locked.save(update_fields=['last_seq', 'compacted_seq', 'summary', 'updated_at'])
+        return append_messages(locked, 0, messages, build_state)
+
+
+def messages_after(conversation, after_seq=0):
+    """Message dicts with a sequence number above ``after_seq``, oldest first."""
+    return [
+        message_dict(message)
+        for message in conversation.chat_messages.filter(seq__gt=after_seq).order_by('seq')
+    ]
+
+
+def page_before(conversation, before_seq=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    The ``limit`` newest messages below ``before_seq`` (the latest ones when
+    None), oldest first, and whether older messages remain.
+    """
+    messages = conversation.chat_messages.order_by('-seq')
+    if before_seq is not None:
+        messages = messages.filter(seq__lt=before_seq)
+    page = list(messages[:limit + 1])
+    has_more = len(page) > limit
+    return [message_dict(message) for message in reversed(page[:limit])], has_more
+
+
+def history_etag(conversation):
+    """Changes whenever the conversation's messages, summary or build state do."""
+    return f'"chat-{conversation.pk}-{conversation.last_seq}-{conversation.updated_at.timestamp():.6f}"'
+
+
+def _text_size(messages):
+    """(rows, characters of role and content) of a ChatMessage queryset."""
+    totals = messages.aggregate(rows=Count('id'), text=Sum(Length('content')) + Sum(Length('role')))
+    return totals['rows'], totals['text'] or 0
+
+
+def purge_idle(now=None):
+    """
+    Delete conversations idle past their retention period, oldest first.
+    Rows locked by an append in progress are skipped until the next run.
+    Returns (conversations, messages, characters) deleted.
+    """
+    now = now or timezone.now()
+    conversations = messages = text = 0
+    policies = (
+        (ChatConversation.objects.filter(session_id__startswith='anon-'), settings.CHAT_ANONYMOUS_RETENTION_DAYS),
+        (ChatConversation.objects.filter(user__isnull=False), settings.CHAT_USER_RETENTION_DAYS),
+    )
+    for queryset, days in policies:
+        if days <= 0:
+            continue
+        idle = queryset.filter(updated_at__lt=now - timedelta(days=days)).order_by('updated_at')
+        for _ in range(settings.CHAT_RETENTION_MAX_BATCHES):
+            with transaction.atomic():
+                ids = list(idle.select_for_update(skip_locked=True).values_list('pk', flat=True)[:settings.CHAT_RETENTION_BATCH_SIZE])
+                if not ids:
+                    break
+                rows, chars = _text_size(ChatMessage.objects.filter(conversation_id__in=ids))
+                ChatConversation.objects.filter(pk__in=ids).delete()
+            conversations += len(ids)
+            messages += rows
+            text += chars
+    return conversations, messages, text
+
+
+def summarize(summary, messages):
+    """
+    Fold ``messages`` into the rolling ``summary``: what the customer asked
+    for, keeping the most recent part when it grows past CHAT_SUMMARY_MAX_CHARS.
+    """
+    topics = [
+        ' '.join(message.content.split())[:SUMMARY_TOPIC_CHARS]
+        for message in messages
+        if message.role == 'user' and message.content.strip()
+    ]
+    text = '; '.join(part for part in [summary] + topics if part)
+    limit = settings.CHAT_SUMMARY_MAX_CHARS
+    if len(text) > limit:
+        text = '…' + text[-(limit - 1):]
+    return text
+
+
+def compact(conversation_id):
+    """
+    Keep the last CHAT_KEEP_MESSAGES messages of a conversation and fold the
+    older ones into its summary. Returns (messages, characters) removed.
+    """
+    with transaction.atomic():
+        conversation = ChatConversation.objects.select_for_update().get(pk=conversation_id)
+        through = conversation.last_seq - settings.CHAT_KEEP_MESSAGES
+        if through <= conversation.compacted_seq:
+            return 0, 0
+        folded = conversation.chat_messages.filter(seq__lte=through)
+        rows, chars = _text_size(folded)
+        conversation.summary = summarize(conversation.summary, folded.only('role', 'content').order_by('seq'))
+        conversation.compacted_seq = through
+        # Saving updated_at also changes the history ETag clients revalidate against
+        conversation.save(update_fields=['summary', 'compacted_seq', 'updated_at'])
+        folded.delete()
+    return rows, chars
+
+
+def compact_long():
+    """Compact every conversation with more than CHAT_COMPACT_AFTER uncompacted messages, in bounded batches."""
+    limit = settings.CHAT_RETENTION_BATCH_SIZE * settings.CHAT_RETENTION_MAX_BATCHES
+    long_ids = list(
+        ChatConversation.objects.filter(last_seq__gt=F('compacted_seq') + settings.CHAT_COMPACT_AFTER)
+        .order_by('pk').values_list('pk', flat=True)[:limit]
+    )
+    conversations = messages = text = 0
+    for conversation_id in long_ids:
+        try:
+            rows, chars = compact(conversation_id)
+        except ChatConversation.DoesNotExist:
+            continue
+        if rows:
+            conversations += 1
+            messages += rows
+            text += chars
+    return conversations, messages, text
+
+
+def enforce_retention():
+    """Delete idle conversations and compact long ones. Returns a report dict."""
+    deleted = purge_idle()
+    compacted = compact_long()
+    report = {
+        'deleted_conversations': deleted[0],
+        'deleted_messages': deleted[1],
+        'compacted_conversations': compacted[0],
+        'compacted_messages': compacted[1],
+        'reclaimed_rows': deleted[0] + deleted[1] + compacted[1],
+        'reclaimed_chars': deleted[2] + compacted[2],
+    }
+    logger.info(f"Chat retention: {report}")
+    return report
@@ -1,4 +1,5 @@
 from .models import Product, Favorite
+from .cart import ShoppingCart
 
 def favorites_context(request):
     """Populate context with favorite products from database (auth) or session (anonymous)."""
@@ -26,9 +27,8 @@ def favorites_context(request):
         if p.has_valid_image():
             valid_products.append(p)
     
-    # Get cart count from session
-    cart = request.session.get('cart', {})
-    cart_count = sum(item.get('quantity', 0) for item in cart.values())
+    # Cart count from the server-side cart
+    cart_count = ShoppingCart(request).count()
     
     return {
         'products_favorite': valid_products,
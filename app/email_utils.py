@@ -51,3 +51,77 @@ def send_email(subject, text='', html=None, from_email=None, recipient_list=None
     except Exception:
         logger.exception("Failed to send email via Django backend to %s", recipient_list)
         raise
+
+
+# MailerSend accepts up to 500 emails per bulk request
+MAILERSEND_BULK_LIMIT = 500
+
+
+def send_bulk_email(messages, from_email=None):
+    """Send many emails in as few provider round trips as possible.
+
+    ``messages`` is a list of dicts with ``subject``, ``recipient_list`` and
+    ``text`` and/or ``html``. With MailerSend configured they go out through
+    its bulk endpoint (one request per 500); otherwise over a single Django
+    email backend connection. Returns one True/False per message, in order.
+    Failures are logged, not raised, so one bad address does not stop the batch.
+    """
+    if not messages:
+        return []
+
+    chosen_from = from_email or getattr(settings, 'DEFAULT_FROM_EMAIL', None) or getattr(settings, 'EMAIL_HOST_USER', None)
+
+    api_key = os.getenv('MAILERSEND_API_KEY', '').strip()
+    if api_key:
+        headers = {
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json',
+        }
+        results = []
+        for start in range(0, len(messages), MAILERSEND_BULK_LIMIT):
+            chunk = messages[start:start + MAILERSEND_BULK_LIMIT]
+            payload = []
+            for message in chunk:
+                item = {
+                    'from': {'email': chosen_from or '', 'name': 'Koya Nardz Shop'},
+                    'to': [{'email': r} for r in message['recipient_list']],
+                    'subject': message['subject'],
+                    'text': message.get('text', ''),
+                }
+                if message.get('html'):
+                    item['html'] = message['html']
+                payload.append(item)
+            try:
+                resp = requests.post('https://api.mailersend.com/v1/bulk-email', json=payload, headers=headers, timeout=30)
+                ok = resp.status_code in (200, 201, 202)
+                if not ok:
+                    logger.error("MailerSend bulk API returned %s: %s", resp.status_code, resp.text)
+            except Exception:
+                logger.exception("Failed to send %d emails via MailerSend bulk API", len(chunk))
+                ok = False
+            results.extend([ok] * len(chunk))
+        return results
+
+    # Fallback to one Django email backend connection for the whole batch
+    from django.core.mail import get_connection, EmailMultiAlternatives
+    results = []
+    try:
+        with get_connection(fail_silently=False) as connection:
+            for message in messages:
+                email = EmailMultiAlternatives(
+                    message['subject'], message.get('text', ''), chosen_from, message['recipient_list'],
+                    connection=connection,
+                )
+                if message.get('html'):
+                    email.attach_alternative(message['html'], 'text/html')
+                try:
+                    results.append(bool(email.send()))
+                except Exception:
+                    logger.exception("Failed to send email via Django backend to %s", message['recipient_list'])
+                    results.append(False)
+    except Exception:
+        # Opening (or closing) the connection failed: whatever was not sent counts as failed
+        logger.exception("Email backend connection failed after %d of %d emails", len(results), len(messages))
+        results.extend([False] * (len(messages) - len(results)))
+    logger.info("Sent %d of %d emails in one batch", sum(results), len(results))
+    return results
@@ -1,5 +1,6 @@
 from django import forms
 from .models import CustomUser, Category, Brand, Product, ProductVariation, ProductReview, Appointment, Selling
+from .booking import slot_choices
 from django.contrib.auth.forms import UserCreationForm, UserChangeForm, AuthenticationForm, PasswordResetForm, SetPasswordForm
 from django.contrib.auth import get_user_model
 from datetime import date
@@ -157,19 +158,8 @@ class ProductReviewForm(forms.ModelForm):
         }
 
 class AppointmentForm(forms.ModelForm):
-    TIME_CHOICES = [
-        ("10:00", "10:00 AM"),
-        ("11:00", "11:00 AM"),
-        ("12:00", "12:00 PM"),
-        ("13:00", "01:00 PM"),
-        ("14:00", "02:00 PM"),
-        ("15:00", "03:00 PM"),
-        ("16:00", "04:00 PM"),
-        ("17:00", "05:00 PM"),
-    ]
-
     time = forms.ChoiceField(
-        choices=TIME_CHOICES,
+        choices=slot_choices,
         widget=forms.Select()
     )
 
@@ -0,0 +1,129 @@
+"""
+Stock reservation for checkout.
+
+reserve_stock() turns an order into AppointmentProduct rows and takes the
+ordered quantities out of stock inside one transaction. The affected
+Product and ProductVariation rows are locked in primary-key order (so two
+checkouts sharing products cannot deadlock) and decremented with one
+guarded UPDATE per table, which only succeeds where enough stock is left.
+Either every line is reserved or StockShortfall is raised and nothing is
+written.
+"""
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Case, When, F, Q, IntegerField
+from .catalog import catalog_changed
+from .models import AppointmentProduct, Product, ProductVariation
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StockShortfall(Exception):
+    """Raised when an order asks for more than is in stock. ``shortfalls`` lists each short line"""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__('; '.join(
+            f"{line['name']}: requested {line['requested']}, available {line['available']}"
+            for line in shortfalls
+        ))
+
+
+def _lock_stock(model, pks):
+    """Lock the rows (in pk order) and return {pk: stock}."""
+    if not pks:
+        return {}
+    return dict(
+        model.objects.select_for_update()
+        .filter(pk__in=pks)
+        .order_by('pk')
+        .values_list('pk', 'stock')
+    )
+
+
+def _decrement_stock(model, demand):
+    """
+    Take ``demand`` ({pk: quantity}) out of stock with a single UPDATE that
+    skips any row without enough stock. Returns True when every row was updated.
+    """
+    if not demand:
+        return True
+    enough = Q()
+    for pk, quantity in demand.items():
+        enough |= Q(pk=pk, stock__gte=quantity)
+    updated = model.objects.filter(enough).update(stock=Case(
+        *[When(pk=pk, then=F('stock') - quantity) for pk, quantity in demand.items()],
+        default=F('stock'),
+        output_field=IntegerField(),
+    ))
+    return updated == len(demand)
+
+
+def _shortfalls(lines, demand, available):
+    short = []
+    for product, variation, quantity, _ in lines:
+        model, pk = (ProductVariation, variation.pk) if variation else (Product, product.pk)
+        stock = available[model].get(pk, 0)
+        if demand[model][pk] > stock:
+            name = product.product_name
+            if variation:
+                name = f"{name} ({variation.product_variation})"
+            short.append({
+                'product_id': product.pk,
+                'variant_id': variation.pk if variation else None,
+                'name': name,
+                'requested': quantity,
+                'available': stock,
+            })
+    return short
+
+
+def reserve_stock(appointment, lines):
+    """
+    Reserve ``lines`` for ``appointment``.
+
+    ``lines`` is a list of (product, variation or None, quantity, price).
+    Stock is taken from the variation when there is one, otherwise from the
+    product. Returns the created AppointmentProduct rows, or raises
+    StockShortfall (rolling back this call's changes) if any line is short.
+    """
+    lines = list(lines)
+    demand = {Product: defaultdict(int), ProductVariation: defaultdict(int)}
+    for product, variation, quantity, _ in lines:
+        if quantity < 1:
+            raise ValueError(f"Invalid quantity {quantity} for {product}")
+        if variation:
+            demand[ProductVariation][variation.pk] += quantity
+        else:
+            demand[Product][product.pk] += quantity
+
+    with transaction.atomic():
+        # Always lock products before variations, each in pk order
+        available = {model: _lock_stock(model, sorted(demand[model])) for model in (Product, ProductVariation)}
+        short = _shortfalls(lines, demand, available)
+        if short:
+            raise StockShortfall(short)
+
+        for model in (Product, ProductVariation):
+            if not _decrement_stock(model, demand[model]):
+                # Only reachable where the database could not lock the rows above
+                current = {model: _lock_stock(model, sorted(demand[model])) for model in (Product, ProductVariation)}
+                raise StockShortfall(_shortfalls(lines, demand, current) or [])
+
+        reserved = AppointmentProduct.objects.bulk_create([
+            AppointmentProduct(
+                appointment=appointment,
+                product=product,
+                quantity=quantity,
+                price=price,
+                variation=variation.product_variation if variation else None,
+            )
+            for product, variation, quantity, price in lines
+        ])
+
+        # Bulk updates skip post_save, so invalidate the in-stock facets here
+        catalog_changed()
+
+    logger.info(f"Reserved {len(reserved)} line(s) for appointment {appointment.pk}")
+    return reserved
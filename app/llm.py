@@ -0,0 +1,265 @@
+"""
+Server-side chat completions for the product page assistant.
+
+api_stream_chat assembles the prompt here (the system prompt, the
+conversation summary and its recent messages), sends it to the configured
+upstream and relays the reply as it is generated. The API key never reaches
+the browser.
+
+The system prompt is gemini_system_prompt.txt rendered as a Django template
+with the store name and live inventory (categories in stock, price range).
+The file is read once per process and again only when its mtime or size
+changes; the rendered prompt, with its JSON response body, gzipped body and
+ETag for api_gemini_system_prompt, is cached under the catalog version so a
+catalog change re-renders it.
+
+Upstreams are classes with ``stream(system, contents)`` yielding text
+chunks, chosen by settings.CHAT_LLM_BACKEND: 'gemini', 'stub' (a
+deterministic local reply, for development and tests) or a dotted path to
+another class. Time to first token and totals are kept per process and
+reported by stats().
+"""
+from collections import Counter, deque
+from django.conf import settings
+from django.template import Context, Engine
+from django.utils.module_loading import import_string
+from .catalog import catalog_cached, categories_in_stock, get_facets
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(__file__), 'gemini_system_prompt.txt')
+
+# The prompt is plain text, so nothing is HTML-escaped
+PROMPT_ENGINE = Engine(autoescape=False)
+
+# Characters of each history message sent upstream
+MAX_CONTEXT_MESSAGE_CHARS = 4000
+
+# Time-to-first-token samples kept for the percentiles in stats()
+TTFT_SAMPLES = 500
+
+
+class UpstreamError(Exception):
+    """Raised when the model could not produce a reply"""
+
+
+class StubUpstream:
+    """Deterministic local model: replies with a fixed sentence about the last user message."""
+
+    def stream(self, system, contents):
+        question = contents[-1]['text'] if contents else ''
+        reply = f"(stub reply to {len(contents)} message(s)) You asked: {' '.join(question.split())[:200]}"
+        for word in reply.split(' '):
+            yield word + ' '
+
+
+class GeminiUpstream:
+    """Google Gemini streamGenerateContent, trying each of CHAT_LLM_MODELS until one answers."""
+
+    URL = 'https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent'
+
+    def stream(self, system, contents):
+        api_key = os.getenv('GEMINI_API_KEY', '')
+        if not api_key:
+            raise UpstreamError('GEMINI_API_KEY is not configured')
+        body = {
+            'systemInstruction': {'parts': [{'text': system}]},
+            'contents': [
+                {'role': 'user' if message['role'] == 'user' else 'model', 'parts': [{'text': message['text']}]}
+                for message in contents
+            ],
+            'tools': [{'googleSearch': {}}],
+        }
+        last_error = None
+        for model in settings.CHAT_LLM_MODELS:
+            try:
+                response = requests.post(
+                    self.URL.format(model=model), params={'alt': 'sse'}, json=body, stream=True,
+                    headers={'x-goog-api-key': api_key}, timeout=settings.CHAT_LLM_TIMEOUT_SECONDS,
+                )
+            except requests.RequestException as e:
+                last_error = f"{model}: {e}"
+                continue
+            if response.status_code != 200:
+                last_error = f"{model} failed with status {response.status_code}"
+                response.close()
+                continue
+            # Once text is flowing a failure can no longer fall back to the next model
+            with response:
+                yield from self._texts(response, time.monotonic() + settings.CHAT_LLM_MAX_REPLY_SECONDS)
+            return
+        raise UpstreamError(last_error or 'No model configured')
+
+    def _texts(self, response, deadline):
+        for line in response.iter_lines(decode_unicode=True):
+            if time.monotonic() > deadline:
+                raise UpstreamError(f"Reply took longer than {settings.CHAT_LLM_MAX_REPLY_SECONDS}s")
+            if not line or not line.startswith('data:'):
+                continue
+            chunk = json.loads(line[len('data:'):])
+            if chunk.get('error'):
+                raise UpstreamError(chunk['error'].get('message', 'Upstream error'))
+            for candidate in chunk.get('candidates', [])[:1]:
+                for part in (candidate.get('content') or {}).get('parts', []):
+                    if part.get('text'):
+                        yield part['text']
+
+
+BACKENDS = {'gemini': GeminiUpstream, 'stub': StubUpstream}
+
+
+def get_upstream():
+    backend = settings.CHAT_LLM_BACKEND
+    return (BACKENDS.get(backend) or import_string(backend))()
+
+
+_prompt_file = {'signature': None, 'template': None}
+_prompt_file_lock = threading.Lock()
+
+
+def _prompt_template():
+    """((mtime, size), compiled template) of the prompt file, re-read only when it changed."""
+    stat = os.stat(SYSTEM_PROMPT_PATH)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _prompt_file_lock:
+        if _prompt_file['signature'] != signature:
+            with open(SYSTEM_PROMPT_PATH, encoding='utf-8') as f:
+                _prompt_file['template'] = PROMPT_ENGINE.from_string(f.read())
+            _prompt_file['signature'] = signature
+            logger.info(f"Loaded system prompt template ({stat.st_size} bytes)")
+        return signature, _prompt_file['template']
+
+
+def _render_prompt(template):
+    facets = get_facets()
+    price_range = facets['in_stock_price_range']
+    text = template.render(Context({
+        'store_name': settings.STORE_NAME,
+        'categories': ', '.join(categories_in_stock(facets)) or 'none',
+        'price_range': f"₱{price_range['min'] or 0:,.2f} - ₱{price_range['max'] or 0:,.2f}",
+        'products_in_stock': facets['total_in_stock'],
+    }))
+    body = json.dumps({'success': True, 'prompt': text}).encode('utf-8')
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    return {
+        'text': text,
+        'body': body,
+        'etag': f'"prompt-{etag}"',
+        'gzip_body': gzip.compress(body, mtime=0),
+        'gzip_etag': f'"prompt-{etag}-gzip"',
+    }
+
+
+def rendered_prompt():
+    """
+    The system prompt for the current prompt file and catalog version:
+    {'text', 'body', 'etag', 'gzip_body', 'gzip_etag'}, where the bodies are
+    api_gemini_system_prompt's JSON response.
+    """
+    signature, template = _prompt_template()
+    return catalog_cached('system_prompt', lambda: _render_prompt(template), *signature)
+
+
+def system_prompt():
+    return rendered_prompt()['text']
+
+
+def build_prompt(conversation, after_seq, messages):
+    """
+    (system instruction, contents) for a reply to ``messages``, which follow
+    stored message ``after_seq``. Contents are the last CHAT_CONTEXT_MESSAGES
+    messages as {'role', 'text'}, oldest first.
+    """
+    system = system_prompt()
+    if conversation.summary:
+        system += f"\n\nEARLIER IN THIS CONVERSATION the customer asked about: {conversation.summary}"
+
+    limit = settings.CHAT_CONTEXT_MESSAGES
+    stored = []
+    if conversation.pk and len(messages) < limit:
+        stored = list(
+            conversation.chat_messages.filter(seq__lte=after_seq).order_by('-seq')
+            .values('role', 'content')[:limit - len(messages)]
+        )[::-1]
+    contents = [
+        {'role': message['role'], 'text': message['content'][:MAX_CONTEXT_MESSAGE_CHARS]}
+        for message in stored + list(messages)[-limit:]
+        if message['content'].strip()
+    ]
+    return system, contents
+
+
+_stats = Counter()
+_ttft_ms = deque(maxlen=TTFT_SAMPLES)
+_stats_lock = threading.Lock()
+
+
+def record(ttft_ms=None, duration_ms=0.0, chars=0, error=False, disconnected=False):
+    """Count one streamed reply; ``ttft_ms`` is None when no text arrived."""
+    with _stats_lock:
+        _stats['replies'] += 1
+        _stats['errors'] += error
+        _stats['disconnects'] += disconnected
+        _stats['chars'] += chars
+        _stats['duration_ms'] += duration_ms
+        if ttft_ms is not None:
+            _ttft_ms.append(ttft_ms)
+
+
+def stats():
+    """Reply counters for this process with time-to-first-token percentiles in ms."""
+    with _stats_lock:
+        counts = dict(_stats)
+        samples = sorted(_ttft_ms)
+    replies = counts.get('replies', 0)
+    report = {
+        'backend': settings.CHAT_LLM_BACKEND,
+        'replies': replies,
+        'errors': counts.get('errors', 0),
+        'disconnects': counts.get('disconnects', 0),
+        'mean_duration_ms': round(counts['duration_ms'] / replies, 1) if replies else None,
+        'mean_chars': round(counts['chars'] / replies) if replies else None,
+        'ttft_samples': len(samples),
+    }
+    for name, quantile in (('ttft_p50_ms', 0.5), ('ttft_p95_ms', 0.95)):
+        report[name] = round(samples[min(int(len(samples) * quantile), len(samples) - 1)], 1) if samples else None
+    return report
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+        _ttft_ms.clear()
+
+
+class TimedStream:
+    """Iterates an upstream reply, recording time to first token, duration and size."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.started = time.monotonic()
+        self.ttft_ms = None
+        self.text = ''
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self.ttft_ms is None:
+                self.ttft_ms = (time.monotonic() - self.started) * 1000
+            self.text += chunk
+            yield chunk
+
+    def finish(self, error=False, disconnected=False):
+        duration_ms = (time.monotonic() - self.started) * 1000
+        record(self.ttft_ms, duration_ms, len(self.text), error, disconnected)
+        logger.info(
+            f"Chat reply via {settings.CHAT_LLM_BACKEND}: ttft={self.ttft_ms or 0:.0f}ms "
+            f"total={duration_ms:.0f}ms chars={len(self.text)} error={error} disconnected={disconnected}"
+        )
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from app.chat import append_messages
+from app.models import ChatConversation
+import json
+import random
+import time
+
+USER_LINES = [
+    'Help me build a gaming PC', 'What GPU fits a 30k budget?', 'Is this motherboard compatible?',
+    'Show me monitors', 'Any cheaper RAM?', 'Add that to my build',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare bytes written per chat turn when the whole history is saved as one JSON blob '
+        '(the old api/chat/save/) with appending message rows (api/chat/append/). Rolled back afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--turns', type=int, default=200, help='User/assistant exchanges in the conversation')
+        parser.add_argument('--reply-size', type=int, default=700, help='Approximate characters per assistant reply')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._run(options['turns'], options['reply_size'])
+            transaction.set_rollback(True)
+
+    def _run(self, turns, reply_size):
+        rng = random.Random(turns)
+        conversation = ChatConversation.objects.create(session_id=f'anon-benchmark-{turns}')
+        history = []
+        blob = {'request': [], 'written': []}
+        rows = {'request': [], 'written': [], 'queries': [], 'ms': []}
+
+        for turn in range(turns):
+            fresh = [
+                {'role': 'user', 'content': rng.choice(USER_LINES), 'timestamp': 1700000000000 + turn * 2},
+                {'role': 'assistant', 'content': ('lorem ipsum ' * reply_size)[:reply_size], 'timestamp': 1700000000001 + turn * 2},
+            ]
+            history.extend(fresh)
+
+            # Before: the browser posts the whole history and the JSON column is rewritten
+            body = json.dumps({'session_id': conversation.session_id, 'messages': history})
+            blob['request'].append(len(body.encode('utf-8')))
+            blob['written'].append(len(json.dumps(history).encode('utf-8')))
+
+            # After: only the new messages are posted and inserted as rows
+            body = json.dumps({'session_id': conversation.session_id, 'after_seq': len(history) - 2, 'messages': fresh})
+            rows['request'].append(len(body.encode('utf-8')))
+            rows['written'].append(sum(
+                len(message['role']) + len(message['content'].encode('utf-8')) + len(json.dumps({'timestamp': message['timestamp']}))
+                for message in fresh
+            ))
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                append_messages(conversation, len(history) - 2, fresh)
+            rows['ms'].append((time.perf_counter() - started) * 1000)
+            rows['queries'].append(len(queries))
+
+        self.stdout.write(f"{turns} turns, ~{reply_size} character replies")
+        self.stdout.write(f"{'':<22}{'per turn avg':>14}{'last turn':>12}{'session total':>16}")
+        for label, series in (
+            ('JSON blob: request', blob['request']),
+            ('JSON blob: written', blob['written']),
+            ('rows: request', rows['request']),
+            ('rows: written', rows['written']),
+        ):
+            self.stdout.write(f"{label:<22}{sum(series) / turns:>12.0f} B{series[-1]:>10} B{sum(series):>14} B")
+        self.stdout.write(
+            f"Rows write {sum(blob['written']) / sum(rows['written']):.0f}x fewer bytes over the session; "
+            f"append took {sum(rows['queries']) / turns:.1f} queries and {sum(rows['ms']) / turns:.2f} ms per turn "
+            f"(last turn {rows['ms'][-1]:.2f} ms)."
+        )
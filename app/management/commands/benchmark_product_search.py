@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from app.models import Product, Brand, Category
+from app.search import search_products, rebuild_index, search_index_available
+import random
+import statistics
+import time
+
+WORDS = [
+    'ryzen', 'intel', 'core', 'gaming', 'wireless', 'mechanical', 'keyboard', 'mouse', 'monitor',
+    'curved', 'ultrawide', 'graphics', 'card', 'memory', 'ddr5', 'ssd', 'nvme', 'cooler', 'liquid',
+    'tower', 'case', 'power', 'supply', 'modular', 'motherboard', 'headset', 'rgb', 'silent', 'pro',
+]
+BRANDS = ['Asus', 'MSI', 'Gigabyte', 'Corsair', 'Kingston', 'Samsung', 'Logitech', 'Razer']
+CATEGORIES = ['CPU', 'GPU', 'RAM', 'Storage', 'Motherboard', 'PSU', 'Case', 'Peripherals']
+QUERIES = ['ryzen', 'gaming keyboard', 'corsair', 'nvme ssd', 'ultra', 'xyznotfound']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark icontains vs full-text product search on synthetic catalogs (rolled back afterwards).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000', help='Comma separated catalog sizes')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per query')
+
+    def handle(self, *args, **options):
+        if not search_index_available():
+            self.stdout.write(self.style.WARNING('Search index is not available on this database; run migrate first.'))
+            return
+
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        for size in sizes:
+            with transaction.atomic():
+                self._run(size, options['repeat'])
+                transaction.set_rollback(True)
+
+    def _run(self, size, repeat):
+        rng = random.Random(size)
+        brands = [Brand.objects.create(brand=name) for name in BRANDS]
+        categories = [Category.objects.create(category_name=name) for name in CATEGORIES]
+
+        existing = Product.objects.count()
+        batch = []
+        for i in range(max(size - existing, 0)):
+            batch.append(Product(
+                product_name=' '.join(rng.sample(WORDS, 3)).title() + f' {i}',
+                description=' '.join(rng.choices(WORDS, k=20)),
+                brand=rng.choice(brands),
+                category_name=rng.choice(categories),
+                price=rng.randint(500, 90000),
+                stock=rng.randint(0, 50),
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_create(batch)
+
+        started = time.perf_counter()
+        count = rebuild_index()
+        self.stdout.write(f"\n{count} products, index built in {(time.perf_counter() - started) * 1000:.0f} ms")
+        # Full result sets, as the product page evaluates every match
+        self.stdout.write(f"{'query':<18}{'icontains ms':>14}{'index ms':>12}{'ranked ms':>12}{'hits':>8}")
+        for query in QUERIES:
+            legacy = Product.objects.filter(
+                Q(category_name__category_name__icontains=query) |
+                Q(brand__brand__icontains=query) |
+                Q(product_name__icontains=query) |
+                Q(description__icontains=query)
+            ).values_list('id', flat=True)
+            indexed = search_products(Product.objects.all(), query)
+            legacy_ms = self._time(lambda: list(legacy.all()), repeat)
+            indexed_ms = self._time(lambda: list(indexed.values_list('id', flat=True)), repeat)
+            ranked_ms = self._time(lambda: list(indexed.order_by('-search_rank')[:48]), repeat)
+            hits = indexed.count()
+            self.stdout.write(f"{query:<18}{legacy_ms:>14.1f}{indexed_ms:>12.1f}{ranked_ms:>12.1f}{hits:>8}")
+
+    def _time(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,20 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from app.analytics import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily analytics rollup from appointment and trade history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='First day to rebuild (YYYY-MM-DD), default: the first order')
+        parser.add_argument('--to', dest='end', help='Last day to rebuild (YYYY-MM-DD), default: today')
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else None
+            end = date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError:
+            raise CommandError('--from and --to must be YYYY-MM-DD')
+        days = rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt daily stats: {days} day(s) with activity."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from app.sales import rebuild_sales_counters, top_seller_threshold
+
+
+class Command(BaseCommand):
+    help = 'Rebuild product and variation sales counters from appointment history.'
+
+    def handle(self, *args, **options):
+        products, variations = rebuild_sales_counters()
+        threshold = top_seller_threshold()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt sales counters: {products} product(s) and {variations} variation(s) with sales. "
+            f"Top seller threshold: {threshold if threshold is not None else 'n/a'} unit(s)."
+        ))
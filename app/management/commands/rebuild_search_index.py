@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from app.search import create_search_index, rebuild_index, search_index_available
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index from the product table.'
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.stdout.write(self.style.WARNING(
+                f"No search index for the '{connection.vendor}' backend; product search uses icontains."
+            ))
+            return
+
+        if not search_index_available():
+            create_search_index(connection)
+
+        with transaction.atomic():
+            count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} product(s)."))
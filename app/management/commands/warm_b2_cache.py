@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from app.models import Product
+from app.storage_b2 import B2Storage, get_disk_cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Pre-warm the local B2 disk cache with every product 3D model.'
+
+    def handle(self, *args, **options):
+        cache = get_disk_cache()
+        if cache is None:
+            self.stdout.write(self.style.WARNING('B2 disk cache is disabled (B2_CACHE_MAX_BYTES=0). Nothing to do.'))
+            return
+
+        products = Product.objects.exclude(model_3d='').exclude(model_3d__isnull=True).only('id', 'model_3d')
+
+        warmed = 0
+        skipped = 0
+        failed = 0
+        for product in products.iterator():
+            storage = product.model_3d.storage
+            if not isinstance(storage, B2Storage):
+                skipped += 1
+                continue
+            try:
+                if storage.warm_cache(product.model_3d.name):
+                    warmed += 1
+                    self.stdout.write(f"Cached product {product.id}: {product.model_3d.name}")
+                else:
+                    skipped += 1
+                    self.stdout.write(self.style.WARNING(f"Product {product.id}: {product.model_3d.name} is larger than the cache budget"))
+            except Exception as e:
+                failed += 1
+                logger.exception(f"Failed to warm B2 cache for product {product.id}")
+                self.stderr.write(self.style.ERROR(f"Product {product.id}: {e}"))
+
+        stats = cache.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {warmed} model(s), skipped {skipped}, failed {failed}. "
+            f"Cache hits={stats['hits']} misses={stats['misses']} evictions={stats['evictions']}"
+        ))
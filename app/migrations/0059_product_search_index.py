@@ -0,0 +1,76 @@
+from django.db import migrations
+
+# Frozen copies of the DDL and backfill in app/search.py as of this migration,
+# run on the migration's connection against the historical tables
+SEARCH_TABLE = 'app_product_search'
+FTS5_WEIGHTS = (10.0, 5.0, 5.0, 1.0)
+
+
+def create_index(apps, schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor not in ('sqlite', 'postgresql'):
+        return
+    products = apps.get_model('app', 'Product')._meta.db_table
+    brands = apps.get_model('app', 'Brand')._meta.db_table
+    categories = apps.get_model('app', 'Category')._meta.db_table
+    source = (
+        "SELECT p.id, p.product_name, COALESCE(b.brand, ''), "
+        "COALESCE(c.category_name, ''), COALESCE(p.description, '') "
+        f"FROM {products} p "
+        f"LEFT JOIN {brands} b ON b.id = p.brand_id "
+        f"LEFT JOIN {categories} c ON c.id = p.category_name_id"
+    )
+
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                "product_name, brand, category, description, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+            weights = ', '.join(str(w) for w in FTS5_WEIGHTS)
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', %s)",
+                [f"bm25({weights})"],
+            )
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE} (rowid, product_name, brand, category, description) {source}")
+        else:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                f"product_id bigint PRIMARY KEY REFERENCES {products}(id) "
+                "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin "
+                f"ON {SEARCH_TABLE} USING GIN (document)"
+            )
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (product_id, document) "
+                "SELECT src.id, "
+                "setweight(to_tsvector('simple', src.name), 'A') || "
+                "setweight(to_tsvector('simple', src.brand), 'B') || "
+                "setweight(to_tsvector('simple', src.category), 'B') || "
+                "setweight(to_tsvector('simple', src.description), 'D') "
+                f"FROM ({source}) AS src (id, name, brand, category, description)"
+            )
+
+
+def drop_index(apps, schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor in ('sqlite', 'postgresql'):
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0058_otptoken_last_resend_at_alter_otptoken_otp_code'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
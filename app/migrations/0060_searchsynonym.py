@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+# Aliases previously hard-coded in api_products_recommend
+DEFAULT_SYNONYMS = {
+    'gpu': ['gpu', 'graphics', 'card'],
+    'graphic': ['gpu', 'graphics', 'card'],
+    'video': ['gpu', 'graphics', 'card'],
+}
+
+
+def seed_synonyms(apps, schema_editor):
+    SearchSynonym = apps.get_model('app', 'SearchSynonym')
+    for term, aliases in DEFAULT_SYNONYMS.items():
+        SearchSynonym.objects.get_or_create(term=term, defaults={'aliases': aliases})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0059_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchSynonym',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(help_text='Matches when the search text contains this word', max_length=50, unique=True)),
+                ('aliases', models.JSONField(default=list, help_text='Extra words matched against category and product names')),
+            ],
+            options={
+                'ordering': ['term'],
+            },
+        ),
+        migrations.RunPython(seed_synonyms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:21
+
+from django.db import migrations, models
+
+
+def backfill_has_image(apps, schema_editor):
+    Product = apps.get_model('app', 'Product')
+    Product.objects.exclude(image='').exclude(image__isnull=True).update(has_image=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0060_searchsynonym'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='has_image',
+            field=models.BooleanField(db_index=True, default=False, editable=False),
+        ),
+        migrations.RunPython(backfill_has_image, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='app_product_price_2aa516_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='app_product_created_532f93_idx'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:23
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Max, Sum
+
+
+def backfill_counters(apps, schema_editor):
+    """Totals of non-cancelled appointment lines per product and per named variation (as rebuild_sales_counters)."""
+    AppointmentProduct = apps.get_model('app', 'AppointmentProduct')
+    Product = apps.get_model('app', 'Product')
+    ProductVariation = apps.get_model('app', 'ProductVariation')
+
+    lines = AppointmentProduct.objects.exclude(appointment__status='Cancelled').filter(product__isnull=False)
+    totals = {
+        'units': Sum('quantity'),
+        'total': Sum(F('quantity') * F('price'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+        'last': Max('appointment__created_at'),
+    }
+
+    products = [
+        Product(pk=row['product_id'], units_sold=row['units'], revenue=row['total'], last_sold_at=row['last'])
+        for row in lines.values('product_id').annotate(**totals).order_by()
+    ]
+    Product.objects.bulk_update(products, ['units_sold', 'revenue', 'last_sold_at'], batch_size=500)
+
+    by_name = {
+        (row['product_id'], row['variation']): row
+        for row in lines.exclude(variation__isnull=True).exclude(variation='')
+        .values('product_id', 'variation').annotate(**totals).order_by()
+    }
+    variations = []
+    for pk, product_id, name in ProductVariation.objects.filter(
+        product_id__in={product_id for product_id, _ in by_name},
+    ).values_list('pk', 'product_id', 'product_variation'):
+        row = by_name.get((product_id, name))
+        if row:
+            variations.append(ProductVariation(pk=pk, units_sold=row['units'], revenue=row['total'], last_sold_at=row['last']))
+    ProductVariation.objects.bulk_update(variations, ['units_sold', 'revenue', 'last_sold_at'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0061_product_has_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='last_sold_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='revenue',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productvariation',
+            name='last_sold_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='productvariation',
+            name='revenue',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='productvariation',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['units_sold', 'id'], name='app_product_units_s_f70113_idx'),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
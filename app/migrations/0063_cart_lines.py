@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def delete_ownerless_lines(apps, schema_editor):
+    # The old Cart model had no owner, so its rows can never belong to anyone's cart
+    Cart = apps.get_model('app', 'Cart')
+    Cart.objects.filter(user__isnull=True, session_token__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0062_sales_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='added_at',
+            field=models.DateTimeField(auto_now_add=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='cart_key',
+            field=models.CharField(default='', max_length=30),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='session_token',
+            field=models.CharField(blank=True, db_index=True, max_length=36, null=True),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='cart_items', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='variation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='app.productvariation'),
+        ),
+        migrations.RunPython(delete_ownerless_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('user', 'cart_key'), name='unique_user_cart_line'),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('session_token', 'cart_key'), name='unique_session_cart_line'),
+        ),
+    ]
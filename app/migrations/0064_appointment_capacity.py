@@ -0,0 +1,73 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:33
+
+import app.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_capacity(apps, schema_editor):
+    """Count existing (not cancelled) appointments into the day and slot counters."""
+    Appointment = apps.get_model('app', 'Appointment')
+    AppointmentDay = apps.get_model('app', 'AppointmentDay')
+    AppointmentSlot = apps.get_model('app', 'AppointmentSlot')
+    booked = Appointment.objects.exclude(status='Cancelled')
+
+    AppointmentDay.objects.bulk_create([
+        AppointmentDay(date=row['date'], booked=row['n'], capacity=max(settings.APPOINTMENT_DAILY_CAPACITY, row['n']))
+        for row in booked.values('date').annotate(n=Count('id')).order_by()
+    ], batch_size=500)
+    AppointmentSlot.objects.bulk_create([
+        AppointmentSlot(date=row['date'], time=row['time'], booked=row['n'], capacity=max(settings.APPOINTMENT_SLOT_CAPACITY, row['n']))
+        for row in booked.values('date', 'time').annotate(n=Count('id')).order_by()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0063_cart_lines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('capacity', models.PositiveIntegerField(default=app.models.default_day_capacity)),
+                ('booked', models.PositiveIntegerField(default=0)),
+                ('closed', models.BooleanField(default=False, help_text='No appointments can be booked on this date')),
+                ('note', models.CharField(blank=True, default='', max_length=200)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AppointmentSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('time', models.TimeField()),
+                ('capacity', models.PositiveIntegerField(default=app.models.default_slot_capacity)),
+                ('booked', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['date', 'time'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='appointment',
+            unique_together=set(),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['date', 'time'], name='app_appoint_date_b6e904_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointmentslot',
+            constraint=models.UniqueConstraint(fields=('date', 'time'), name='unique_appointment_slot'),
+        ),
+        migrations.RunPython(backfill_capacity, migrations.RunPython.noop),
+    ]
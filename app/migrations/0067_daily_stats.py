@@ -0,0 +1,108 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:42
+
+import django.db.models.deletion
+from collections import defaultdict
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDate
+
+COUNTERS = (
+    'appointments_created', 'appointments_finished', 'appointments_cancelled',
+    'trades_created', 'trades_completed', 'trades_cancelled',
+    'units_sold', 'revenue',
+)
+
+
+def backfill_daily_stats(apps, schema_editor):
+    """All of history, computed like app.analytics.rebuild() as of this migration."""
+    Appointment = apps.get_model('app', 'Appointment')
+    AppointmentProduct = apps.get_model('app', 'AppointmentProduct')
+    Selling = apps.get_model('app', 'Selling')
+    DailyStat = apps.get_model('app', 'DailyStat')
+    DailyCategoryStat = apps.get_model('app', 'DailyCategoryStat')
+
+    stats = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    def count(queryset, moment, counter):
+        rows = queryset.annotate(day=TruncDate(moment)).values('day').annotate(n=Count('id')).values_list('day', 'n').order_by()
+        for day, n in rows:
+            stats[day][counter] = n
+
+    count(Appointment.objects.all(), 'created_at', 'appointments_created')
+    count(Selling.objects.all(), 'selling_at', 'trades_created')
+    count(Appointment.objects.filter(status='Finished'), Coalesce('status_changed_at', 'created_at'), 'appointments_finished')
+    count(Appointment.objects.filter(status='Cancelled'), Coalesce('status_changed_at', 'created_at'), 'appointments_cancelled')
+    count(Selling.objects.filter(status='Completed'), Coalesce('status_changed_at', 'selling_at'), 'trades_completed')
+    count(Selling.objects.filter(status='Cancelled'), Coalesce('status_changed_at', 'selling_at'), 'trades_cancelled')
+
+    sales = (
+        AppointmentProduct.objects.filter(appointment__status='Finished')
+        .annotate(day=TruncDate(Coalesce('appointment__status_changed_at', 'appointment__created_at')))
+        .values('day', 'product__category_name')
+        .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('price')))
+        .order_by()
+    )
+    category_rows = []
+    for row in sales:
+        stats[row['day']]['units_sold'] += row['units']
+        stats[row['day']]['revenue'] += row['revenue']
+        category_rows.append(DailyCategoryStat(
+            date=row['day'], category_id=row['product__category_name'],
+            units_sold=row['units'], revenue=row['revenue'],
+        ))
+
+    DailyStat.objects.bulk_create([DailyStat(date=day, **counters) for day, counters in stats.items()], batch_size=500)
+    DailyCategoryStat.objects.bulk_create(category_rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0066_appointment_reminder_sent_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('appointments_created', models.IntegerField(default=0)),
+                ('appointments_finished', models.IntegerField(default=0)),
+                ('appointments_cancelled', models.IntegerField(default=0)),
+                ('trades_created', models.IntegerField(default=0)),
+                ('trades_completed', models.IntegerField(default=0)),
+                ('trades_cancelled', models.IntegerField(default=0)),
+                ('units_sold', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='status_changed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='selling',
+            name='status_changed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='DailyCategoryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units_sold', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='app.category')),
+            ],
+            options={
+                'ordering': ['date'],
+                'indexes': [models.Index(fields=['date', 'category'], name='app_dailyca_date_7bef37_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
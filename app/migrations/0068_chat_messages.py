@@ -0,0 +1,72 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_messages_to_rows(apps, schema_editor):
+    ChatConversation = apps.get_model('app', 'ChatConversation')
+    ChatMessage = apps.get_model('app', 'ChatMessage')
+    for conversation in ChatConversation.objects.only('id', 'messages').iterator(chunk_size=200):
+        rows = []
+        for message in conversation.messages or []:
+            if not isinstance(message, dict):
+                continue
+            content = message.get('content', '')
+            rows.append(ChatMessage(
+                conversation_id=conversation.id,
+                seq=len(rows) + 1,
+                role=str(message.get('role') or 'unknown')[:20],
+                content=content if isinstance(content, str) else str(content),
+                meta={key: value for key, value in message.items() if key not in ('role', 'content', 'seq')},
+            ))
+        ChatMessage.objects.bulk_create(rows, batch_size=500)
+        # update() leaves updated_at alone
+        ChatConversation.objects.filter(pk=conversation.id).update(last_seq=len(rows))
+
+
+def copy_rows_to_messages(apps, schema_editor):
+    ChatConversation = apps.get_model('app', 'ChatConversation')
+    ChatMessage = apps.get_model('app', 'ChatMessage')
+    for conversation in ChatConversation.objects.only('id').iterator(chunk_size=200):
+        messages = [
+            {**message.meta, 'role': message.role, 'content': message.content}
+            for message in ChatMessage.objects.filter(conversation_id=conversation.id).order_by('seq')
+        ]
+        ChatConversation.objects.filter(pk=conversation.id).update(messages=messages)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0067_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatconversation',
+            name='last_seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ChatMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('role', models.CharField(max_length=20)),
+                ('content', models.TextField(blank=True)),
+                ('meta', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_messages', to='app.chatconversation')),
+            ],
+            options={
+                'ordering': ['conversation', 'seq'],
+                'constraints': [models.UniqueConstraint(fields=('conversation', 'seq'), name='unique_chat_message_seq')],
+            },
+        ),
+        migrations.RunPython(copy_messages_to_rows, copy_rows_to_messages),
+        migrations.RemoveField(
+            model_name='chatconversation',
+            name='messages',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0068_chat_messages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatconversation',
+            name='summary',
+            field=models.TextField(blank=True),
+        ),
+    ]
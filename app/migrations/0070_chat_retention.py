@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0069_chat_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatconversation',
+            name='compacted_seq',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='chatconversation',
+            index=models.Index(fields=['updated_at'], name='app_chatcon_updated_e0affd_idx'),
+        ),
+    ]
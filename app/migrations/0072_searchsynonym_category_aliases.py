@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:23
+
+from django.db import migrations, models
+
+
+# 'card' was only ever matched against category names before 0060 seeded it as an alias
+SEEDED_TERMS = ('gpu', 'graphic', 'video')
+
+
+def category_only_card(apps, schema_editor):
+    SearchSynonym = apps.get_model('app', 'SearchSynonym')
+    for synonym in SearchSynonym.objects.filter(term__in=SEEDED_TERMS):
+        if 'card' in synonym.aliases:
+            synonym.aliases = [alias for alias in synonym.aliases if alias != 'card']
+            synonym.category_aliases = synonym.category_aliases + ['card']
+            synonym.save(update_fields=['aliases', 'category_aliases'])
+
+
+def card_back_to_aliases(apps, schema_editor):
+    SearchSynonym = apps.get_model('app', 'SearchSynonym')
+    for synonym in SearchSynonym.objects.filter(term__in=SEEDED_TERMS):
+        if 'card' in synonym.category_aliases:
+            synonym.aliases = synonym.aliases + ['card']
+            synonym.category_aliases = [alias for alias in synonym.category_aliases if alias != 'card']
+            synonym.save(update_fields=['aliases', 'category_aliases'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0071_appointment_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='searchsynonym',
+            name='category_aliases',
+            field=models.JSONField(blank=True, default=list, help_text='Extra words matched against category names only'),
+        ),
+        migrations.RunPython(category_only_card, card_back_to_aliases),
+    ]
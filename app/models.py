@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.utils import timezone
 import secrets
 import logging
 
@@ -62,10 +63,31 @@ class Product(models.Model):
     model_file = models.CharField(max_length=255, blank=True, null=True)
     model_3d = models.FileField(upload_to='3d_models/', null=True, blank=True, help_text="Upload a GLB or GLTF 3D model file")
     created_at = models.DateTimeField(auto_now_add=True, null=True)
+    # Cached has_valid_image() so storefront grids can filter in SQL; kept in sync by save()
+    has_image = models.BooleanField(default=False, db_index=True, editable=False)
+    # Sales counters maintained by app/sales.py (rebuild with `manage.py rebuild_sales_counters`)
+    units_sold = models.PositiveIntegerField(default=0, editable=False)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    last_sold_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination sort keys for the product grid
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['units_sold', 'id']),
+        ]
 
     def __str__(self):
         return self.product_name
 
+    def save(self, *args, **kwargs):
+        self.has_image = self.has_valid_image()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'image' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'has_image'}
+        super().save(*args, **kwargs)
+
     def has_3d_model(self):
         """Check if product has a 3D model file"""
         return bool(self.model_3d and self.model_3d.name)
@@ -95,6 +117,9 @@ class ProductVariation(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to="products/variants", blank=True, null=True)
+    units_sold = models.PositiveIntegerField(default=0, editable=False)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    last_sold_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.product.product_name} - {self.product_variation}"
@@ -112,9 +137,33 @@ class ProductReview(models.Model):
     def __str__(self):
         return f"{self.product.product_name} - {self.rating} Stars"
 
+class SearchSynonym(models.Model):
+    """Words that expand a product search, e.g. 'gpu' also matches 'graphics'"""
+    term = models.CharField(max_length=50, unique=True, help_text="Matches when the search text contains this word")
+    aliases = models.JSONField(default=list, help_text="Extra words matched against category and product names")
+    category_aliases = models.JSONField(default=list, blank=True, help_text="Extra words matched against category names only")
+
+    class Meta:
+        ordering = ['term']
+
+    def __str__(self):
+        return f"{self.term} → {', '.join(self.aliases + self.category_aliases)}"
+
 class Cart(models.Model):
+    """One cart line, owned by a user or (for anonymous visitors) a session cart token. See app/cart.py"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='cart_items')
+    session_token = models.CharField(max_length=36, null=True, blank=True, db_index=True)
     produkto = models.ForeignKey(Product, on_delete=models.CASCADE)
+    variation = models.ForeignKey(ProductVariation, on_delete=models.CASCADE, null=True, blank=True)
+    cart_key = models.CharField(max_length=30, default='')  # "22" for a product, "variant-6" for a variation
     quantity = models.PositiveIntegerField(default=1)
+    added_at = models.DateTimeField(auto_now_add=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'cart_key'], name='unique_user_cart_line'),
+            models.UniqueConstraint(fields=['session_token', 'cart_key'], name='unique_session_cart_line'),
+        ]
 
     def __str__(self):
         return f"{self.quantity} x {self.produkto.product_name}"
@@ -130,6 +179,30 @@ class Favorite(models.Model):
     def __str__(self):
         return f"{self.user} - {self.favorite_product.product_name}" if self.user else self.favorite_product.product_name
 
+def _remember_status(instance):
+    """Note the status as stored, so save() can tell when it changes (see app/analytics.py)"""
+    if 'status' in instance.__dict__:
+        instance._stored_status = instance.status
+        instance._stored_status_changed_at = instance.__dict__.get('status_changed_at')
+
+def _stamp_status_change(instance, save_kwargs):
+    """
+    Before saving: set status_changed_at when the status changed and expose
+    the previous status/timestamp to post_save receivers.
+    """
+    instance._previous_status = getattr(instance, '_stored_status', None)
+    instance._previous_status_changed_at = getattr(instance, '_stored_status_changed_at', None)
+    if instance._previous_status is not None and instance._previous_status != instance.status:
+        instance.status_changed_at = timezone.now()
+        update_fields = save_kwargs.get('update_fields')
+        if update_fields is not None:
+            save_kwargs['update_fields'] = set(update_fields) | {'status_changed_at'}
+
+def _remember_place(instance):
+    """Note the stored date, time and status, so app/booking.py can tell which slot it holds"""
+    if {'date', 'time', 'status'} <= instance.__dict__.keys():
+        instance._stored_place = (instance.date, instance.time, instance.status)
+
 class Appointment(models.Model):
     STATUS_CHOICES = [
         ('Pending', 'Pending'),
@@ -147,10 +220,22 @@ class Appointment(models.Model):
     reference_number = models.CharField(max_length=30, unique=True, blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
     reason = models.TextField(blank=True, null=True)
+    reminder_sent_at = models.DateTimeField(null=True, blank=True, editable=False)  # Set by the reminder task (app/tasks.py)
+    status_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)  # Versions the calendar events endpoint
 
     class Meta:
-        unique_together = ('date', 'time')
         ordering = ['date', 'time']
+        indexes = [
+            models.Index(fields=['date', 'time']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        _remember_status(instance)
+        _remember_place(instance)
+        return instance
     
     def save(self, *args, **kwargs):
         if not self.reference_number:
@@ -159,11 +244,54 @@ class Appointment(models.Model):
             str_today = date.today().strftime('%Y%m%d')
             unique_id = str(uuid.uuid4()).split('-')[0].upper()
             self.reference_number = f"{str_today}-{unique_id}"
-        super().save(*args, **kwargs)
+        _stamp_status_change(self, kwargs)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'updated_at'}
+        # The slot counters are moved by a pre_save receiver; keep them and the row together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        _remember_status(self)
+        _remember_place(self)
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} - {self.date} {self.time}"
 
+def default_day_capacity():
+    return settings.APPOINTMENT_DAILY_CAPACITY
+
+def default_slot_capacity():
+    return settings.APPOINTMENT_SLOT_CAPACITY
+
+class AppointmentDay(models.Model):
+    """Booking capacity for one date; ``closed`` makes it a blackout day. Maintained by app/booking.py"""
+    date = models.DateField(unique=True)
+    capacity = models.PositiveIntegerField(default=default_day_capacity)
+    booked = models.PositiveIntegerField(default=0)
+    closed = models.BooleanField(default=False, help_text="No appointments can be booked on this date")
+    note = models.CharField(max_length=200, blank=True, default='')
+
+    class Meta:
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.date} ({self.booked}/{self.capacity}{', closed' if self.closed else ''})"
+
+class AppointmentSlot(models.Model):
+    """Booking capacity for one hour of one date. Maintained by app/booking.py"""
+    date = models.DateField()
+    time = models.TimeField()
+    capacity = models.PositiveIntegerField(default=default_slot_capacity)
+    booked = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['date', 'time']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'time'], name='unique_appointment_slot'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.time:%H:%M} ({self.booked}/{self.capacity})"
+
 class AppointmentProduct(models.Model):
     appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='products')
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
@@ -196,6 +324,13 @@ class Selling(models.Model):
     selling_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
     reference_number = models.CharField(max_length=30, unique=True, blank=True, null=True)
+    status_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        _remember_status(instance)
+        return instance
 
     def save(self, *args, **kwargs):
         if not self.reference_number:
@@ -204,7 +339,9 @@ class Selling(models.Model):
             str_today = date.today().strftime('%Y%m%d')
             unique_id = str(uuid.uuid4()).split('-')[0].upper()
             self.reference_number = f"{str_today}-{unique_id}"
+        _stamp_status_change(self, kwargs)
         super().save(*args, **kwargs)
+        _remember_status(self)
         
     def __str__(self):
         return f"{self.first_name} {self.last_name} - {self.product_name}"
@@ -214,7 +351,9 @@ class ChatConversation(models.Model):
     """Store AI chat conversations per user (logged-in or anonymous)"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_conversations', null=True, blank=True)
     session_id = models.CharField(max_length=100, unique=True, db_index=True)  # For non-logged-in users or alternative lookup
-    messages = models.JSONField(default=list)  # List of message objects
+    last_seq = models.PositiveIntegerField(default=0, editable=False)  # Sequence number of the newest ChatMessage
+    summary = models.TextField(blank=True)  # Rolling summary of messages no longer kept in full
+    compacted_seq = models.PositiveIntegerField(default=0, editable=False)  # Messages up to this seq live only in the summary
     build_state = models.JSONField(default=dict, blank=True)  # Store PC build state (selected components, etc)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -224,9 +363,97 @@ class ChatConversation(models.Model):
         indexes = [
             models.Index(fields=['user', '-updated_at']),
             models.Index(fields=['session_id']),
+            models.Index(fields=['updated_at']),
         ]
 
     def __str__(self):
         if self.user:
             return f"Chat - {self.user.email}"
-        return f"Chat - Anonymous ({self.session_id[:8]})"
\ No newline at end of file
+        return f"Chat - Anonymous ({self.session_id[:8]})"
+
+
+class ChatMessage(models.Model):
+    """One message of a ChatConversation, appended with the next sequence number (see app/chat.py)"""
+    conversation = models.ForeignKey(ChatConversation, on_delete=models.CASCADE, related_name='chat_messages')
+    seq = models.PositiveIntegerField()
+    role = models.CharField(max_length=20)
+    content = models.TextField(blank=True)
+    meta = models.JSONField(default=dict, blank=True)  # Any other keys the client sent (e.g. timestamp)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['conversation', 'seq']
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'seq'], name='unique_chat_message_seq'),
+        ]
+
+    def __str__(self):
+        return f"{self.role} #{self.seq} in {self.conversation}"
+
+
+class OutboxEmail(models.Model):
+    """A transactional email queued for delivery by the Celery outbox worker. See app/outbox.py"""
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Sending', 'Sending'),
+        ('Sent', 'Sent'),
+        ('Dead', 'Dead'),
+    ]
+
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    recipients = models.JSONField(default=list)
+    subject = models.CharField(max_length=255)
+    text = models.TextField(blank=True, default='')
+    html = models.TextField(blank=True, default='')
+    from_email = models.CharField(max_length=254, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)  # When a worker claimed it for sending
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} → {', '.join(self.recipients)} ({self.status})"
+
+
+class DailyStat(models.Model):
+    """Appointment and trade activity for one day, maintained by app/analytics.py"""
+    date = models.DateField(unique=True)
+    appointments_created = models.IntegerField(default=0)
+    appointments_finished = models.IntegerField(default=0)
+    appointments_cancelled = models.IntegerField(default=0)
+    trades_created = models.IntegerField(default=0)
+    trades_completed = models.IntegerField(default=0)
+    trades_cancelled = models.IntegerField(default=0)
+    units_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['date']
+
+    def __str__(self):
+        return f"Stats for {self.date}"
+
+class DailyCategoryStat(models.Model):
+    """Units and revenue of finished appointments per category for one day. See app/analytics.py"""
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
+    units_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['date']
+        indexes = [
+            models.Index(fields=['date', 'category']),
+        ]
+
+    def __str__(self):
+        return f"{self.category or 'Uncategorized'} on {self.date}"
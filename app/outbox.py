@@ -0,0 +1,161 @@
+"""
+Transactional email outbox.
+
+Views call queue_email() inside the same transaction as the change the email
+is about (a new appointment, a cancellation, an OTP). That only writes an
+OutboxEmail row; once the transaction commits, a Celery task delivers it
+through email_utils.send_email, so requests never wait on the mail provider
+and a rolled-back change never sends mail. With EMAIL_OUTBOX_DELIVERY set to
+'sync' (the default when no shared broker is configured) the request sends
+it itself after the commit instead.
+
+Failed deliveries are retried with exponential backoff (plus jitter) until
+EMAIL_OUTBOX_MAX_ATTEMPTS, after which the email is marked Dead and left for
+the admin to inspect or retry. The drain_email_outbox beat task sends
+anything due that was not delivered straight away (no worker, unreachable
+broker, scheduled retries) and frees emails whose worker died mid-send;
+those may be sent twice, delivery is at-least-once.
+
+Passing an idempotency_key makes queueing the same email again (a double
+submit, a repeated cancel) a no-op.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .email_utils import send_email
+from .models import OutboxEmail
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A Sending email whose worker has not finished after this long is retried
+STALE_SENDING_AFTER = timedelta(minutes=10)
+
+# Emails sent per drain_email_outbox run
+DRAIN_BATCH_SIZE = 100
+
+
+def queue_email(subject, recipient_list, text='', html=None, from_email=None, idempotency_key=None):
+    """
+    Queue an email for delivery once the current transaction commits.
+    Returns the OutboxEmail (the existing one when ``idempotency_key`` was
+    already used).
+    """
+    if not recipient_list:
+        raise ValueError("recipient_list must be provided and non-empty")
+
+    fields = {
+        'subject': subject[:255],
+        'recipients': list(recipient_list),
+        'text': text or '',
+        'html': html or '',
+        'from_email': from_email or '',
+    }
+    if idempotency_key:
+        email, created = OutboxEmail.objects.get_or_create(idempotency_key=idempotency_key, defaults=fields)
+        if not created:
+            logger.info(f"Outbox email {idempotency_key!r} already queued, skipping")
+            return email
+    else:
+        email = OutboxEmail.objects.create(**fields)
+
+    transaction.on_commit(lambda: _enqueue(email.pk))
+    return email
+
+
+def _enqueue(email_id, eta=None):
+    if settings.EMAIL_OUTBOX_DELIVERY == 'sync':
+        if eta is None:
+            try:
+                deliver(email_id)
+            except Exception as e:
+                # Left Pending (or Sending, released later) for the drain task
+                logger.error(f"Could not deliver outbox email {email_id}: {e}")
+        return
+
+    from .tasks import deliver_outbox_email
+    try:
+        deliver_outbox_email.apply_async((email_id,), eta=eta)
+    except Exception as e:
+        # The drain task will pick it up
+        logger.warning(f"Could not enqueue outbox email {email_id}: {e}")
+
+
+def retry_delay(attempts):
+    """Backoff before the next attempt after ``attempts`` failed ones."""
+    delay = min(
+        settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0),
+        settings.EMAIL_OUTBOX_RETRY_MAX_SECONDS,
+    )
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def deliver(email_id):
+    """
+    Send one email if it is due and no other worker has claimed it.
+    Returns True when sent, False when the attempt failed, None when skipped.
+    """
+    now = timezone.now()
+    claimed = OutboxEmail.objects.filter(
+        pk=email_id, status='Pending', next_attempt_at__lte=now,
+    ).update(status='Sending', locked_at=now, attempts=F('attempts') + 1)
+    if not claimed:
+        return None
+
+    email = OutboxEmail.objects.get(pk=email_id)
+    try:
+        send_email(
+            subject=email.subject,
+            text=email.text,
+            html=email.html or None,
+            from_email=email.from_email or None,
+            recipient_list=email.recipients,
+        )
+    except Exception as e:
+        if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            OutboxEmail.objects.filter(pk=email_id).update(status='Dead', locked_at=None, last_error=str(e))
+            logger.error(f"Outbox email {email_id} is dead after {email.attempts} attempts: {e}")
+        else:
+            next_attempt_at = timezone.now() + retry_delay(email.attempts)
+            OutboxEmail.objects.filter(pk=email_id).update(
+                status='Pending', locked_at=None, last_error=str(e), next_attempt_at=next_attempt_at,
+            )
+            logger.warning(f"Outbox email {email_id} attempt {email.attempts} failed, retrying at {next_attempt_at}: {e}")
+            _enqueue(email_id, eta=next_attempt_at)
+        return False
+
+    OutboxEmail.objects.filter(pk=email_id).update(status='Sent', sent_at=timezone.now(), locked_at=None, last_error='')
+    return True
+
+
+def release_stale():
+    """Put emails stuck in Sending (their worker died) back in the queue."""
+    return OutboxEmail.objects.filter(
+        status='Sending', locked_at__lt=timezone.now() - STALE_SENDING_AFTER,
+    ).update(status='Pending', locked_at=None, next_attempt_at=timezone.now())
+
+
+def drain(limit=DRAIN_BATCH_SIZE):
+    """Send up to ``limit`` due emails, oldest due first. Returns (due, sent)."""
+    release_stale()
+    due = list(
+        OutboxEmail.objects.filter(status='Pending', next_attempt_at__lte=timezone.now())
+        .order_by('next_attempt_at')
+        .values_list('pk', flat=True)[:limit]
+    )
+    sent = sum(1 for email_id in due if deliver(email_id))
+    return len(due), sent
+
+
+def retry(queryset):
+    """Requeue emails (e.g. Dead ones) for immediate delivery with a fresh attempt budget."""
+    ids = list(queryset.exclude(status='Sent').values_list('pk', flat=True))
+    OutboxEmail.objects.filter(pk__in=ids).update(
+        status='Pending', attempts=0, locked_at=None, next_attempt_at=timezone.now(),
+    )
+    for email_id in ids:
+        transaction.on_commit(lambda email_id=email_id: _enqueue(email_id))
+    return len(ids)
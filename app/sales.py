@@ -0,0 +1,167 @@
+"""
+Denormalized sales counters on Product and ProductVariation.
+
+units_sold, revenue and last_sold_at are bumped with F() updates when an
+appointment's lines are created at checkout, so storefront pages can sort
+and tag best sellers without aggregating AppointmentProduct on every
+request. Receivers in app/signals.py take an appointment's lines off again
+when its status changes to Cancelled (and put them back if it is
+un-cancelled) and take off any line of a live appointment that is deleted.
+rebuild_sales_counters() recomputes everything from scratch (see the
+rebuild_sales_counters command).
+"""
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import F, Max, Sum, Value, DecimalField
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import Appointment, AppointmentProduct, Product, ProductVariation
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Share of selling products that counts as "most purchased" / best seller
+TOP_SELLER_FRACTION = 0.2
+
+
+def _line_totals(lines):
+    """
+    Group (product_id, variation_name, quantity, price) lines into
+    {product_id: [units, revenue]} and {(product_id, variation_name): [units, revenue]}.
+    """
+    products = defaultdict(lambda: [0, Decimal('0')])
+    variations = defaultdict(lambda: [0, Decimal('0')])
+    for product_id, variation_name, quantity, price in lines:
+        if product_id is None:
+            continue
+        revenue = Decimal(str(price)) * quantity
+        products[product_id][0] += quantity
+        products[product_id][1] += revenue
+        if variation_name:
+            variations[(product_id, variation_name)][0] += quantity
+            variations[(product_id, variation_name)][1] += revenue
+    return products, variations
+
+
+def _variation_ids(keys):
+    """Map (product_id, variation_name) pairs to ProductVariation ids in one query."""
+    if not keys:
+        return {}
+    rows = ProductVariation.objects.filter(
+        product_id__in={product_id for product_id, _ in keys},
+        product_variation__in={name for _, name in keys},
+    ).values_list('id', 'product_id', 'product_variation')
+    return {(product_id, name): pk for pk, product_id, name in rows if (product_id, name) in keys}
+
+
+def _apply(lines, sign, sold_at=None):
+    products, variations = _line_totals(lines)
+    variation_ids = _variation_ids(set(variations))
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+    targets = [(Product, pk, totals) for pk, totals in products.items()]
+    targets += [(ProductVariation, variation_ids[key], totals) for key, totals in variations.items() if key in variation_ids]
+
+    with transaction.atomic():
+        for model, pk, (units, revenue) in targets:
+            if sign > 0:
+                changes = {
+                    'units_sold': F('units_sold') + units,
+                    'revenue': F('revenue') + revenue,
+                    'last_sold_at': sold_at or timezone.now(),
+                }
+            else:
+                # last_sold_at is left alone; rebuild_sales_counters() recomputes it
+                changes = {
+                    'units_sold': Greatest(F('units_sold') - units, Value(0)),
+                    'revenue': Greatest(F('revenue') - revenue, zero),
+                }
+            model.objects.filter(pk=pk).update(**changes)
+
+
+def _appointment_lines(appointment):
+    return appointment.products.values_list('product_id', 'variation', 'quantity', 'price')
+
+
+def record_appointment_sales(appointment):
+    """Add an appointment's lines to the sales counters."""
+    _apply(_appointment_lines(appointment), 1, appointment.created_at)
+
+
+def reverse_appointment_sales(appointment):
+    """Remove a cancelled appointment's lines from the sales counters."""
+    _apply(_appointment_lines(appointment), -1)
+
+
+def record_status_change(appointment):
+    """After an appointment was saved: reverse or restore its sales when it was (un-)cancelled."""
+    previous = getattr(appointment, '_previous_status', None)
+    if previous is None or (previous == 'Cancelled') == (appointment.status == 'Cancelled'):
+        return
+    if appointment.status == 'Cancelled':
+        reverse_appointment_sales(appointment)
+    else:
+        record_appointment_sales(appointment)
+
+
+def reverse_line_sales(line):
+    """Remove a deleted line of an appointment that is not cancelled from the counters."""
+    status = Appointment.objects.filter(pk=line.appointment_id).values_list('status', flat=True).first()
+    if status is not None and status != 'Cancelled':
+        _apply([(line.product_id, line.variation, line.quantity, line.price)], -1)
+
+
+def rebuild_sales_counters():
+    """
+    Recompute every counter from non-cancelled appointments.
+    Returns (products_with_sales, variations_with_sales).
+    """
+    lines = AppointmentProduct.objects.exclude(appointment__status='Cancelled').filter(product__isnull=False)
+    revenue_expr = F('quantity') * F('price')
+
+    product_totals = lines.values('product_id').annotate(
+        units=Sum('quantity'),
+        total=Sum(revenue_expr, output_field=DecimalField(max_digits=12, decimal_places=2)),
+        last=Max('appointment__created_at'),
+    )
+    variation_totals = lines.exclude(variation__isnull=True).exclude(variation='').values('product_id', 'variation').annotate(
+        units=Sum('quantity'),
+        total=Sum(revenue_expr, output_field=DecimalField(max_digits=12, decimal_places=2)),
+        last=Max('appointment__created_at'),
+    )
+
+    product_rows = [
+        Product(pk=row['product_id'], units_sold=row['units'], revenue=row['total'], last_sold_at=row['last'])
+        for row in product_totals
+    ]
+    variation_rows = list(variation_totals)
+    variation_ids = _variation_ids({(row['product_id'], row['variation']) for row in variation_rows})
+    variation_objs = [
+        ProductVariation(
+            pk=variation_ids[(row['product_id'], row['variation'])],
+            units_sold=row['units'], revenue=row['total'], last_sold_at=row['last'],
+        )
+        for row in variation_rows if (row['product_id'], row['variation']) in variation_ids
+    ]
+
+    fields = ['units_sold', 'revenue', 'last_sold_at']
+    with transaction.atomic():
+        Product.objects.update(units_sold=0, revenue=0, last_sold_at=None)
+        ProductVariation.objects.update(units_sold=0, revenue=0, last_sold_at=None)
+        Product.objects.bulk_update(product_rows, fields, batch_size=500)
+        ProductVariation.objects.bulk_update(variation_objs, fields, batch_size=500)
+    return len(product_rows), len(variation_objs)
+
+
+def top_seller_threshold(fraction=TOP_SELLER_FRACTION):
+    """
+    Minimum units_sold for a product to be in the top ``fraction`` of products
+    that have sold at all, or None when nothing has sold yet.
+    """
+    selling = Product.objects.filter(units_sold__gt=0)
+    count = selling.count()
+    if not count:
+        return None
+    position = max(int(count * fraction), 1) - 1
+    return selling.order_by('-units_sold').values_list('units_sold', flat=True)[position]
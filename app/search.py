@@ -0,0 +1,306 @@
+"""
+Full-text product search index.
+
+SQLite uses an FTS5 virtual table ranked with bm25(); PostgreSQL uses a
+side table holding a weighted tsvector with a GIN index, ranked with
+ts_rank(). Both index product name, brand, category and description and
+are kept in sync by the Product/Brand/Category signals in signals.py.
+Other databases fall back to the old icontains search.
+
+Also home to the chatbot's ranked product recommendations, which expand
+search text through the SearchSynonym table.
+
+The migration (0059) creates the table; create_search_index() is kept for
+the rebuild_search_index command.
+"""
+from django.db import connection, DatabaseError
+from django.db.models import Q, Case, When, Value, IntegerField, FloatField
+from django.db.models.expressions import RawSQL
+from .models import Product, Brand, Category, SearchSynonym
+import re
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = 'app_product_search'
+
+# bm25 column weights (SQLite): product_name, brand, category, description
+FTS5_WEIGHTS = (10.0, 5.0, 5.0, 1.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Databases (by NAME) already known to have the search table
+_available_in = set()
+
+
+def _vendor(conn=None):
+    return (conn or connection).vendor
+
+
+def create_search_index(conn):
+    """Create the search table for the connection's database (used by the rebuild_search_index command)."""
+    vendor = _vendor(conn)
+    with conn.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                "product_name, brand, category, description, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+            # Make the hidden rank column use the weighted bm25; unlike calling
+            # bm25() directly it can be selected in grouped (annotated) queries
+            weights = ', '.join(str(w) for w in FTS5_WEIGHTS)
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', %s)",
+                [f"bm25({weights})"],
+            )
+        elif vendor == 'postgresql':
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                f"product_id bigint PRIMARY KEY REFERENCES {Product._meta.db_table}(id) "
+                "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "document tsvector NOT NULL)"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_gin "
+                f"ON {SEARCH_TABLE} USING GIN (document)"
+            )
+
+
+def search_index_available():
+    """True when the current database has a usable search table."""
+    if _vendor() not in ('sqlite', 'postgresql'):
+        return False
+    db_name = str(connection.settings_dict.get('NAME'))
+    if db_name in _available_in:
+        return True
+    if SEARCH_TABLE in connection.introspection.table_names(include_views=False):
+        _available_in.add(db_name)
+        return True
+    return False
+
+
+def _source_select():
+    """SELECT producing (id, name, brand, category, description) for indexing."""
+    return (
+        "SELECT p.id, p.product_name, COALESCE(b.brand, ''), "
+        "COALESCE(c.category_name, ''), COALESCE(p.description, '') "
+        f"FROM {Product._meta.db_table} p "
+        f"LEFT JOIN {Brand._meta.db_table} b ON b.id = p.brand_id "
+        f"LEFT JOIN {Category._meta.db_table} c ON c.id = p.category_name_id"
+    )
+
+
+def _id_filter(product_ids):
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    return f"p.id IN ({placeholders})"
+
+
+def index_products(product_ids=None):
+    """
+    (Re)index the given products, or every product when ``product_ids`` is None.
+    """
+    if not search_index_available():
+        return
+    if product_ids is not None:
+        product_ids = [int(pk) for pk in product_ids]
+        if not product_ids:
+            return
+
+    select = _source_select()
+    params = []
+    if product_ids is not None:
+        select += f" WHERE {_id_filter(product_ids)}"
+        params = product_ids
+
+    with connection.cursor() as cursor:
+        if _vendor() == 'sqlite':
+            if product_ids is None:
+                cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            else:
+                placeholders = ', '.join(['%s'] * len(product_ids))
+                cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", product_ids)
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, product_name, brand, category, description) {select}",
+                params,
+            )
+        else:
+            if product_ids is None:
+                cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (product_id, document) "
+                "SELECT src.id, "
+                "setweight(to_tsvector('simple', src.name), 'A') || "
+                "setweight(to_tsvector('simple', src.brand), 'B') || "
+                "setweight(to_tsvector('simple', src.category), 'B') || "
+                "setweight(to_tsvector('simple', src.description), 'D') "
+                f"FROM ({select}) AS src (id, name, brand, category, description) "
+                "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                params,
+            )
+
+
+def remove_products(product_ids):
+    """Drop products from the index."""
+    product_ids = [int(pk) for pk in product_ids]
+    if not product_ids or not search_index_available():
+        return
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    key = 'rowid' if _vendor() == 'sqlite' else 'product_id'
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE {key} IN ({placeholders})", product_ids)
+
+
+def rebuild_index():
+    """Rebuild the whole index from the product table. Returns the product count."""
+    index_products(None)
+    return Product.objects.count()
+
+
+def _match_expression(query):
+    """
+    Turn free text into a backend query string where every word must match
+    as a prefix. Returns None when the text has no searchable words.
+    """
+    tokens = _TOKEN_RE.findall(query.lower())
+    if not tokens:
+        return None
+    if _vendor() == 'sqlite':
+        return ' '.join(f'"{token}"*' for token in tokens)
+    return ' & '.join(f"{token}:*" for token in tokens)
+
+
+def search_products(queryset, query):
+    """
+    Filter ``queryset`` to products matching ``query`` and annotate each with
+    ``search_rank`` (higher is better). Falls back to icontains matching
+    (with a constant rank) when no search index is available.
+    """
+    match = _match_expression(query) if search_index_available() else None
+    if match is None:
+        return queryset.filter(
+            Q(category_name__category_name__icontains=query) |
+            Q(brand__brand__icontains=query) |
+            Q(product_name__icontains=query) |
+            Q(description__icontains=query)
+        ).annotate(search_rank=RawSQL('0', [], output_field=FloatField()))
+
+    # Join the search table once rather than ranking through a correlated
+    # subquery, which would re-run the full-text query for every row. The
+    # rank is an annotation (not an extra select) so it can be filtered on
+    # by keyset pagination.
+    product_table = Product._meta.db_table
+    if _vendor() == 'sqlite':
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[f"{SEARCH_TABLE}.rowid = {product_table}.id", f"{SEARCH_TABLE} MATCH %s"],
+            params=[match],
+        ).annotate(search_rank=RawSQL(f"-{SEARCH_TABLE}.rank", [], output_field=FloatField()))
+    return queryset.extra(
+        tables=[SEARCH_TABLE],
+        where=[
+            f"{SEARCH_TABLE}.product_id = {product_table}.id",
+            f"{SEARCH_TABLE}.document @@ to_tsquery('simple', %s)",
+        ],
+        params=[match],
+    ).annotate(search_rank=RawSQL(
+        f"ts_rank({SEARCH_TABLE}.document, to_tsquery('simple', %s))", [match], output_field=FloatField()
+    ))
+
+
+# --- Chatbot recommendations ---
+
+# How long the synonym table is cached per process
+SYNONYM_CACHE_SECONDS = 60
+
+# Score for each kind of match; the best-scoring products are recommended first
+RECOMMEND_WEIGHTS = {
+    'category': 8,
+    'category_alias': 6,
+    'name': 4,
+    'name_alias': 3,
+    'brand': 2,
+}
+
+_synonyms = {'table': {}, 'loaded_at': None}
+
+
+def get_synonyms():
+    """Return {term: ([aliases], [category aliases])} from the SearchSynonym table, cached briefly."""
+    loaded_at = _synonyms['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > SYNONYM_CACHE_SECONDS:
+        try:
+            table = {
+                term.lower(): (
+                    [alias.lower() for alias in aliases if alias],
+                    [alias.lower() for alias in category_aliases if alias],
+                )
+                for term, aliases, category_aliases in SearchSynonym.objects.values_list('term', 'aliases', 'category_aliases')
+            }
+        except DatabaseError as e:
+            logger.error(f"Could not load search synonyms: {e}")
+            table = {}
+        _synonyms['table'] = table
+        _synonyms['loaded_at'] = time.monotonic()
+    return _synonyms['table']
+
+
+def invalidate_synonyms():
+    _synonyms['loaded_at'] = None
+
+
+def expand_aliases(phrases):
+    """
+    (aliases, category aliases) for every synonym term contained in any of
+    ``phrases``; category aliases are only matched against category names.
+    """
+    aliases, category_aliases = [], []
+    for term, (term_aliases, term_category_aliases) in get_synonyms().items():
+        if any(term in phrase for phrase in phrases):
+            aliases.extend(alias for alias in term_aliases if alias not in aliases)
+            category_aliases.extend(alias for alias in term_category_aliases if alias not in category_aliases)
+    return aliases, [alias for alias in category_aliases if alias not in aliases]
+
+
+def recommend_products(query='', category='', max_price=None, limit=6):
+    """
+    Rank in-stock products against the chatbot's ``query``/``category`` text
+    in a single query. Category, alias, name and brand matches are scored
+    together; stock and price are filtered in the database before limiting,
+    and ties are broken by id so the same request gives the same products.
+    """
+    phrases = []
+    for text in (category, query):
+        text = (text or '').strip().lower()
+        if text and text not in phrases:
+            phrases.append(text)
+    if not phrases or limit <= 0:
+        return []
+
+    matches = []
+    for phrase in phrases:
+        matches.append((Q(category_name__category_name__icontains=phrase), RECOMMEND_WEIGHTS['category']))
+        matches.append((Q(product_name__icontains=phrase), RECOMMEND_WEIGHTS['name']))
+        matches.append((Q(brand__brand__icontains=phrase), RECOMMEND_WEIGHTS['brand']))
+    aliases, category_aliases = expand_aliases(phrases)
+    for alias in aliases + category_aliases:
+        matches.append((Q(category_name__category_name__icontains=alias), RECOMMEND_WEIGHTS['category_alias']))
+    for alias in aliases:
+        matches.append((Q(product_name__icontains=alias), RECOMMEND_WEIGHTS['name_alias']))
+
+    any_match = Q()
+    score = None
+    for condition, weight in matches:
+        any_match |= condition
+        term = Case(When(condition, then=Value(weight)), default=Value(0), output_field=IntegerField())
+        score = term if score is None else score + term
+
+    products = Product.objects.filter(any_match, stock__gt=0)
+    if max_price is not None:
+        products = products.filter(price__lte=max_price)
+    return list(
+        products.annotate(match_score=score)
+        .select_related('brand', 'category_name')
+        .order_by('-match_score', 'id')[:limit]
+    )
@@ -1,12 +1,19 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.contrib.auth.signals import user_logged_in
 from django.conf import settings
 import os
 import requests
 from django.dispatch import receiver
+from django.db import transaction
 from django.core.mail import send_mail
 from django.utils import timezone
 import threading
-from .models import OtpToken, ProductImage, Product
+from .models import OtpToken, ProductImage, Product, ProductVariation, ProductReview, Brand, Category, SearchSynonym, Appointment, AppointmentDay, AppointmentProduct, Selling
+from . import search
+from .catalog import catalog_changed
+from .cart import merge_session_cart
+from .booking import ensure_day, held_place, hold_slot, release_slot
+from . import analytics, sales
 import logging
 import cloudinary
 import cloudinary.uploader
@@ -102,4 +109,136 @@ def upload_3d_model_to_b2(sender, instance, created, **kwargs):
         else:
             logger.info(f"ℹ Product {instance.id} 3D model location: {model_url}")
     except Exception as e:
-        logger.error(f"Error checking 3D model storage location: {e}")
\ No newline at end of file
+        logger.error(f"Error checking 3D model storage location: {e}")
+
+
+# Keep the full-text search index (app/search.py) in sync with the catalog
+SEARCH_INDEXED_FIELDS = {'product_name', 'description', 'brand', 'category_name'}
+
+
+def _update_search_index(update, product_ids, description):
+    """
+    Run a search index update in its own savepoint: a failed statement is
+    rolled back and logged without aborting the caller's transaction (which
+    PostgreSQL would otherwise refuse to continue).
+    """
+    try:
+        with transaction.atomic():
+            update(product_ids)
+    except Exception as e:
+        logger.error(f"Error {description}: {e}")
+
+
+@receiver(post_save, sender=Product)
+def index_product_for_search(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_INDEXED_FIELDS.intersection(update_fields):
+        return
+    _update_search_index(search.index_products, [instance.id], f"indexing product {instance.id} for search")
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    _update_search_index(search.remove_products, [instance.id], f"removing product {instance.id} from search index")
+
+
+@receiver(post_save, sender=Brand)
+def reindex_brand_products(sender, instance, created, **kwargs):
+    if created:
+        return
+    _update_search_index(
+        search.index_products, Product.objects.filter(brand=instance).values_list('id', flat=True),
+        f"reindexing products for brand {instance.id}",
+    )
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if created:
+        return
+    _update_search_index(
+        search.index_products, Product.objects.filter(category_name=instance).values_list('id', flat=True),
+        f"reindexing products for category {instance.id}",
+    )
+
+
+@receiver(post_save, sender=SearchSynonym)
+@receiver(post_delete, sender=SearchSynonym)
+def reload_search_synonyms(sender, instance, **kwargs):
+    search.invalidate_synonyms()
+
+
+# Catalog changes invalidate everything cached in app/catalog.py
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductVariation)
+@receiver(post_delete, sender=ProductVariation)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_catalog_facets(sender, instance, **kwargs):
+    catalog_changed()
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Carry the cart built before logging in over to the user's cart"""
+    if request is None:
+        return
+    try:
+        merge_session_cart(request, user)
+    except Exception as e:
+        logger.error(f"Error merging anonymous cart for {user}: {e}")
+
+
+@receiver(pre_save, sender=Appointment)
+def hold_appointment_slot(sender, instance, raw=False, **kwargs):
+    """Book, move or release the appointment's slot as it is created, rescheduled or (un)cancelled"""
+    if not raw:
+        hold_slot(instance)
+
+
+@receiver(post_delete, sender=Appointment)
+def release_deleted_appointment_slot(sender, instance, **kwargs):
+    """Deleting a booked appointment frees its slot (cancelled ones already did)"""
+    place = held_place(*getattr(instance, '_stored_place', (instance.date, instance.time, instance.status)))
+    if place:
+        release_slot(*place)
+
+
+@receiver(post_save, sender=AppointmentDay)
+def create_appointment_day_slots(sender, instance, created, **kwargs):
+    """A day added by hand (e.g. a blackout day in the admin) gets its slot rows too"""
+    if created:
+        ensure_day(instance.date)
+
+
+@receiver(post_save, sender=Appointment)
+def roll_up_appointment(sender, instance, created, raw=False, **kwargs):
+    """Count new appointments and status changes in the daily analytics rollup"""
+    if not raw:
+        analytics.record_appointment(instance, created)
+
+
+@receiver(post_save, sender=Appointment)
+def adjust_sales_for_status(sender, instance, created, raw=False, **kwargs):
+    """Take a cancelled appointment's lines off the sales counters, and back on if it is un-cancelled"""
+    if not raw and not created:
+        sales.record_status_change(instance)
+
+
+@receiver(post_delete, sender=AppointmentProduct)
+def adjust_sales_for_deleted_line(sender, instance, **kwargs):
+    """Deleting a line (or its appointment) takes it off the sales counters unless it was cancelled"""
+    sales.reverse_line_sales(instance)
+
+
+@receiver(post_save, sender=Selling)
+def roll_up_trade(sender, instance, created, raw=False, **kwargs):
+    """Count new trades and status changes in the daily analytics rollup"""
+    if not raw:
+        analytics.record_trade(instance, created)
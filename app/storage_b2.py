@@ -5,14 +5,509 @@ Used for storing 3D model files.
 from django.conf import settings
 from django.core.files.storage import Storage
 from django.core.files.base import File
+from django.utils import timezone
 from b2sdk.v2 import InMemoryAccountInfo, B2Api
+from b2sdk.v2.exception import InvalidAuthToken, FileNotPresent
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
 import os
 import io
+import hashlib
 import logging
+import tempfile
+import threading
+import time
+import uuid
 
 logger = logging.getLogger(__name__)
 
 
+class B2RangeReader(io.RawIOBase):
+    """
+    Seekable, read-only stream over a B2 file.
+    Bytes are pulled from a ranged download as they are read, so memory use
+    stays flat no matter how large the file is. Seeking drops the current
+    download and the next read resumes from the new offset. ``call`` runs a
+    bucket operation (B2Storage._call, which re-authorizes once if needed).
+    """
+
+    def __init__(self, call, file_id, size):
+        super().__init__()
+        self._call = call
+        self._file_id = file_id
+        self._pos = 0
+        self._response = None
+        self.size = size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._pos + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        if position != self._pos:
+            self._close_response()
+            self._pos = position
+        return self._pos
+
+    def readinto(self, buffer):
+        if self._pos >= self.size:
+            return 0
+        if self._response is None:
+            start = self._pos
+            downloaded = self._call(lambda bucket: bucket.download_file_by_id(self._file_id, range_=(start, self.size - 1)))
+            self._response = downloaded.response
+        data = self._response.raw.read(len(buffer))
+        read = len(data)
+        buffer[:read] = data
+        self._pos += read
+        return read
+
+    def _close_response(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def close(self):
+        self._close_response()
+        super().close()
+
+
+class B2DiskCache:
+    """
+    Size-bounded on-disk cache for B2 file contents with LRU eviction.
+    Entries are keyed by the file's SHA1 (or its B2 file id when no SHA1 is
+    available) and served as plain local file handles, so the OS page cache
+    and sendfile-style file wrappers can do the heavy lifting.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def key_for(file_version):
+        sha1 = getattr(file_version, 'content_sha1', None)
+        if sha1 and sha1 != 'none':
+            return sha1
+        return file_version.id_.replace('/', '_')
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Return an open local file for ``key`` or None on a cache miss."""
+        path = self._path(key)
+        try:
+            handle = open(path, 'rb')
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        # Bump the mtime so eviction treats this entry as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return handle
+
+    def put(self, key, downloaded_file, size):
+        """
+        Store a B2 download under ``key`` and return an open handle to it.
+        Returns None when the file is larger than the whole cache budget.
+        """
+        if size > self.max_bytes:
+            return None
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            downloaded_file.save_to(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=key)
+        return open(path, 'rb')
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the cache fits its byte budget."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith('.part'):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path, entry.name))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path, name in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+            logger.info(f"B2 cache evicted {name} ({size} bytes)")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'directory': self.directory,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache():
+    """
+    Return the process-wide B2 disk cache, or None when caching is disabled
+    (``B2_CACHE_MAX_BYTES`` set to 0).
+    """
+    global _disk_cache
+    max_bytes = getattr(settings, 'B2_CACHE_MAX_BYTES', 0)
+    if not max_bytes:
+        return None
+    if _disk_cache is None:
+        with _disk_cache_lock:
+            if _disk_cache is None:
+                directory = getattr(settings, 'B2_CACHE_DIR', '') or os.path.join(tempfile.gettempdir(), 'b2cache')
+                _disk_cache = B2DiskCache(directory, max_bytes)
+    return _disk_cache
+
+
+class B2Client:
+    """
+    Process-wide, lazily authorized handle on the B2 API and bucket.
+    Nothing touches the network until the bucket is first needed; the
+    authorization is then shared by every B2Storage instance and refreshed
+    before the auth token is due to expire (or after B2 rejects it).
+    """
+
+    def __init__(self, application_key_id, application_key, bucket_id, refresh_after=None):
+        self.application_key_id = application_key_id
+        self.application_key = application_key
+        self.bucket_id = bucket_id
+        # B2 auth tokens are valid for 24 hours
+        self.refresh_after = refresh_after or 23 * 60 * 60
+        self._api = None
+        self._bucket = None
+        self._authorized_at = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if not all([self.application_key_id, self.application_key, self.bucket_id]):
+            raise ValueError("Missing B2 credentials in settings")
+        logger.info("Authorizing B2 API...")
+        api = B2Api(InMemoryAccountInfo())
+        api.authorize_account('production', self.application_key_id, self.application_key)
+        self._bucket = api.get_bucket_by_id(self.bucket_id)
+        self._api = api
+        self._authorized_at = time.monotonic()
+        logger.info(f"✓ B2 connection established. Bucket: {self._bucket.name}")
+
+    def _ensure_connected(self):
+        if self._bucket is None or time.monotonic() - self._authorized_at > self.refresh_after:
+            with self._lock:
+                if self._bucket is None or time.monotonic() - self._authorized_at > self.refresh_after:
+                    try:
+                        self._connect()
+                    except Exception as e:
+                        logger.error(f"✗ Failed to authorize B2: {e}")
+                        raise
+
+    @property
+    def bucket(self):
+        self._ensure_connected()
+        return self._bucket
+
+    @property
+    def session(self):
+        """Low-level B2 session, used for the large-file upload calls."""
+        self._ensure_connected()
+        return self._api.session
+
+    def invalidate(self):
+        """Force a fresh authorization on the next access."""
+        with self._lock:
+            self._bucket = None
+            self._api = None
+
+
+class _LocalFileVersion:
+    def __init__(self, path, name):
+        stat = os.stat(path)
+        self.id_ = name
+        self.file_name = name
+        self.size = stat.st_size
+        self.content_sha1 = 'none'
+        self.upload_timestamp = int(stat.st_mtime * 1000)
+
+
+class _LocalDownload:
+    def __init__(self, path, range_):
+        handle = open(path, 'rb')
+        start, end = range_ if range_ else (0, os.path.getsize(path) - 1)
+        handle.seek(start)
+        # Mimic requests.Response just enough for B2RangeReader
+        self.response = self
+        self.raw = io.BufferedReader(_BoundedReader(handle, end - start + 1))
+
+    def close(self):
+        self.raw.close()
+
+    def save_to(self, path):
+        with open(path, 'wb') as out:
+            while True:
+                chunk = self.raw.read(64 * 1024)
+                if not chunk:
+                    break
+                out.write(chunk)
+        self.close()
+
+
+class _BoundedReader(io.RawIOBase):
+    def __init__(self, handle, remaining):
+        super().__init__()
+        self._handle = handle
+        self._remaining = remaining
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._remaining <= 0:
+            return 0
+        data = self._handle.read(min(len(buffer), self._remaining))
+        buffer[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self._handle.close()
+        super().close()
+
+
+class LocalB2Bucket:
+    """
+    Filesystem stand-in for a B2 bucket (and the large-file session calls)
+    covering the subset of the b2sdk API that B2Storage uses.
+    File ids are simply the file names.
+    """
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        self.id_ = 'local'
+        self.name = 'local'
+        self._large_files = {}
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, *name.split('/'))
+
+    def get_file_info_by_name(self, name):
+        path = self._path(name)
+        if not os.path.isfile(path):
+            raise FileNotPresent(file_id_or_name=name)
+        return _LocalFileVersion(path, name)
+
+    def download_file_by_id(self, file_id, range_=None):
+        self.get_file_info_by_name(file_id)
+        return _LocalDownload(self._path(file_id), range_)
+
+    def upload_bytes(self, data, file_name, file_info=None):
+        path = self._path(file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return _LocalFileVersion(path, file_name)
+
+    def delete_file_version(self, file_id, file_name):
+        os.remove(self._path(file_name))
+
+    def ls(self, folder_to_list='', recursive=False, fetch_count=None, **kwargs):
+        base = self._path(folder_to_list) if folder_to_list else self.directory
+        if not os.path.isdir(base):
+            return
+        for entry in sorted(os.listdir(base)):
+            name = f"{folder_to_list.rstrip('/')}/{entry}".lstrip('/')
+            if os.path.isfile(self._path(name)):
+                yield _LocalFileVersion(self._path(name), name), None
+
+    # Large-file session calls
+    def start_large_file(self, bucket_id, file_name, content_type, file_info):
+        file_id = uuid.uuid4().hex
+        self._large_files[file_id] = (file_name, {})
+        return {'fileId': file_id, 'fileName': file_name}
+
+    def upload_part(self, file_id, part_number, content_length, sha1_sum, input_stream):
+        self._large_files[file_id][1][part_number] = input_stream.read()
+        return {'partNumber': part_number, 'contentSha1': sha1_sum}
+
+    def finish_large_file(self, file_id, part_sha1_array):
+        file_name, parts = self._large_files.pop(file_id)
+        version = self.upload_bytes(b''.join(parts[n] for n in sorted(parts)), file_name)
+        return {'fileId': version.id_, 'fileName': file_name, 'uploadTimestamp': version.upload_timestamp}
+
+    def cancel_large_file(self, file_id):
+        self._large_files.pop(file_id, None)
+
+
+class LocalB2Client:
+    """Drop-in replacement for B2Client backed by a local directory (for tests)."""
+
+    def __init__(self, directory):
+        self.bucket = LocalB2Bucket(directory)
+        self.session = self.bucket
+
+    def invalidate(self):
+        pass
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_b2_client():
+    """Return the shared B2 client, creating it (without authorizing) on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = B2Client(
+                    getattr(settings, 'B2_APPLICATION_KEY_ID', ''),
+                    getattr(settings, 'B2_APPLICATION_KEY', ''),
+                    getattr(settings, 'B2_BUCKET_ID', ''),
+                    refresh_after=getattr(settings, 'B2_AUTH_REFRESH_SECONDS', None),
+                )
+    return _client
+
+
+def set_b2_client(client):
+    """
+    Replace the shared B2 client, e.g. with a LocalB2Client in tests.
+    Returns the previous client so it can be restored afterwards.
+    """
+    global _client
+    with _client_lock:
+        previous, _client = _client, client
+    return previous
+
+
+B2FileMeta = namedtuple('B2FileMeta', ['id_', 'file_name', 'size', 'content_sha1', 'upload_timestamp'])
+B2FileMeta.__doc__ = "Cached subset of a B2 file version (attribute names match b2sdk's FileVersion)."
+
+
+class B2MetadataCache:
+    """
+    Bounded TTL cache of B2 file metadata keyed by file name.
+    Misses (file not present) are remembered for a shorter time so repeated
+    exists() checks for fresh upload names stay cheap without hiding files
+    uploaded by other processes for long; B2Storage.get_available_name()
+    does not trust them, so a save never overwrites such a file. B2Storage
+    keeps entries current on save/delete; invalidate() drops them explicitly.
+    """
+
+    MISSING = object()
+
+    def __init__(self, ttl, missing_ttl, max_entries=10000):
+        self.ttl = ttl
+        self.missing_ttl = missing_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """Return B2FileMeta, MISSING, or None when nothing fresh is cached."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[name]
+                return None
+            self._entries.move_to_end(name)
+            return value
+
+    def set(self, name, meta):
+        self._store(name, meta, self.ttl)
+
+    def set_missing(self, name):
+        self._store(name, self.MISSING, self.missing_ttl)
+
+    def _store(self, name, value, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[name] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, name=None):
+        """Forget ``name``, or every entry when no name is given."""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+
+_metadata_cache = None
+
+
+def get_metadata_cache():
+    """Return the process-wide B2 metadata cache."""
+    global _metadata_cache
+    if _metadata_cache is None:
+        with _client_lock:
+            if _metadata_cache is None:
+                _metadata_cache = B2MetadataCache(
+                    getattr(settings, 'B2_METADATA_CACHE_TTL', 300),
+                    getattr(settings, 'B2_METADATA_MISSING_TTL', 30),
+                )
+    return _metadata_cache
+
+
+# Set while get_available_name() checks candidate names, which must not trust cached misses
+_name_checks = threading.local()
+
+
 class B2Storage(Storage):
     """
     Backblaze B2 storage backend for Django.
@@ -20,77 +515,252 @@ class B2Storage(Storage):
     """
     
     def __init__(self):
-        """Initialize B2 connection with credentials from settings."""
+        """
+        Read B2 settings. The connection itself is made lazily by the shared
+        B2 client the first time the bucket is used.
+        """
+        self.bucket_name = getattr(settings, 'B2_BUCKET_NAME', '')
+        self.endpoint = getattr(settings, 'B2_ENDPOINT', '')
+
+    @property
+    def bucket(self):
+        return get_b2_client().bucket
+
+    def _call(self, operation, *args, **kwargs):
+        """
+        Run a bucket operation, re-authorizing once if B2 rejects the token.
+        """
+        return self._call_client(lambda client: operation(client.bucket, *args, **kwargs))
+
+    def _call_session(self, operation):
+        """Run a large-file session call, re-authorizing once if B2 rejects the token."""
+        return self._call_client(lambda client: operation(client.session))
+
+    @staticmethod
+    def _call_client(operation):
         try:
-            self.account_info = InMemoryAccountInfo()
-            self.api = B2Api(self.account_info)
-            
-            # Get B2 credentials from Django settings
-            self.application_key_id = getattr(settings, 'B2_APPLICATION_KEY_ID', '')
-            self.application_key = getattr(settings, 'B2_APPLICATION_KEY', '')
-            self.bucket_name = getattr(settings, 'B2_BUCKET_NAME', '')
-            self.bucket_id = getattr(settings, 'B2_BUCKET_ID', '')
-            self.endpoint = getattr(settings, 'B2_ENDPOINT', '')
-            
-            if not all([self.application_key_id, self.application_key, self.bucket_id]):
-                raise ValueError("Missing B2 credentials in settings")
-            
-            # Authorize B2 API
-            logger.info("Authorizing B2 API...")
-            self.api.authorize_account('production', self.application_key_id, self.application_key)
-            self.bucket = self.api.get_bucket_by_id(self.bucket_id)
-            logger.info(f"✓ B2 connection established. Bucket: {self.bucket_name}")
-        except Exception as e:
-            logger.error(f"✗ Failed to initialize B2Storage: {e}")
+            return operation(get_b2_client())
+        except InvalidAuthToken:
+            logger.info("B2 auth token rejected, re-authorizing")
+            get_b2_client().invalidate()
+            return operation(get_b2_client())
+
+    def _file_info(self, name):
+        """
+        Return B2FileMeta for ``name``, from the metadata cache when possible.
+        Raises FileNotPresent when the file does not exist.
+        """
+        cache = get_metadata_cache()
+        meta = cache.get(name)
+        if meta is B2MetadataCache.MISSING:
+            if not getattr(_name_checks, 'active', False):
+                raise FileNotPresent(file_id_or_name=name)
+        elif meta is not None:
+            return meta
+        try:
+            file_version = self._call(lambda bucket: bucket.get_file_info_by_name(name))
+        except FileNotPresent:
+            cache.set_missing(name)
             raise
+        meta = B2FileMeta(
+            file_version.id_,
+            file_version.file_name,
+            file_version.size,
+            file_version.content_sha1,
+            file_version.upload_timestamp,
+        )
+        cache.set(name, meta)
+        return meta
     
     def _open(self, name, mode='rb'):
         """
         Open and return the file from B2.
+        The returned file streams its content on demand instead of
+        downloading the whole object up front.
         """
         try:
-            file_version = self.bucket.get_file_info_by_name(name)
-            response = self.bucket.download_file_by_id(file_version.id_)
-            return File(io.BytesIO(response.read()), name)
+            file_version = self._file_info(name)
+            cached = self._open_cached(file_version)
+            if cached is not None:
+                return File(cached, name)
+            return File(B2RangeReader(self._call, file_version.id_, file_version.size), name)
         except Exception as e:
             raise FileNotFoundError(f"File {name} not found in B2: {str(e)}")
     
+    def _open_cached(self, file_version):
+        """
+        Return a local file handle for ``file_version`` from the disk cache,
+        downloading it into the cache on a miss. Returns None when caching
+        is disabled or the file does not fit in the cache.
+        """
+        cache = get_disk_cache()
+        if cache is None:
+            return None
+        key = B2DiskCache.key_for(file_version)
+        handle = cache.get(key)
+        if handle is None:
+            if file_version.size > cache.max_bytes:
+                return None
+            logger.info(f"B2 cache miss, downloading {file_version.file_name} ({file_version.size} bytes)")
+            downloaded = self._call(lambda bucket: bucket.download_file_by_id(file_version.id_))
+            handle = cache.put(key, downloaded, file_version.size)
+        return handle
+
+    def warm_cache(self, name):
+        """
+        Make sure ``name`` is present in the local disk cache.
+        Returns True when the file is cached afterwards.
+        """
+        file_version = self._file_info(name)
+        handle = self._open_cached(file_version)
+        if handle is None:
+            return False
+        handle.close()
+        return True
+
+    def get_available_name(self, name, max_length=None):
+        """
+        Pick a free name, asking B2 about names cached as missing: another
+        process may have uploaded one since, and saving over it would add a
+        second version of that file.
+        """
+        _name_checks.active = True
+        try:
+            return super().get_available_name(name, max_length=max_length)
+        finally:
+            _name_checks.active = False
+
     def _save(self, name, content):
         """
         Save the file to B2.
+        Files above B2_LARGE_FILE_THRESHOLD are streamed through B2's
+        large-file API part by part; smaller ones go up in a single request.
         """
         try:
             # Normalize path separators - B2 requires forward slashes
             name = name.replace('\\', '/')
-            
-            # Read the content
-            if hasattr(content, 'read'):
-                file_data = content.read()
+            started = time.monotonic()
+
+            size = getattr(content, 'size', None)
+            part_size = getattr(settings, 'B2_UPLOAD_PART_SIZE', 10 * 1024 * 1024)
+            threshold = max(getattr(settings, 'B2_LARGE_FILE_THRESHOLD', 20 * 1024 * 1024), part_size)
+
+            try:
+                content.seek(0)
+            except (AttributeError, io.UnsupportedOperation):
+                pass
+
+            if size is not None and size > threshold and hasattr(content, 'read'):
+                logger.info(f"Uploading to B2 in parts: {name} ({size} bytes)")
+                meta = self._upload_large_file(name, content, part_size)
             else:
-                file_data = content
-            
-            # Upload to B2
-            logger.info(f"Uploading to B2: {name} ({len(file_data)} bytes)")
-            file_version = self.bucket.upload_bytes(
-                file_data,
-                file_name=name,
-                file_info={}
+                # Read the content
+                if hasattr(content, 'read'):
+                    file_data = content.read()
+                else:
+                    file_data = content
+
+                # Upload to B2
+                logger.info(f"Uploading to B2: {name} ({len(file_data)} bytes)")
+                file_version = self._call(lambda bucket: bucket.upload_bytes(
+                    file_data,
+                    file_name=name,
+                    file_info={}
+                ))
+                meta = B2FileMeta(
+                    file_version.id_,
+                    file_version.file_name,
+                    len(file_data),
+                    file_version.content_sha1,
+                    file_version.upload_timestamp,
+                )
+
+            get_metadata_cache().set(meta.file_name, meta)
+
+            elapsed = max(time.monotonic() - started, 1e-6)
+            logger.info(
+                f"✓ Successfully uploaded to B2: {name} "
+                f"({meta.size} bytes in {elapsed:.2f}s, {meta.size / elapsed / (1024 * 1024):.2f} MB/s)"
             )
-            
-            logger.info(f"✓ Successfully uploaded to B2: {name}")
-            return file_version.file_name
+            return meta.file_name
         except Exception as e:
             logger.error(f"✗ Error uploading file to B2: {str(e)}")
             raise Exception(f"Error uploading file to B2: {str(e)}")
+
+    def _upload_large_file(self, name, content, part_size):
+        """
+        Stream ``content`` to B2 as a large file.
+        Parts are read one at a time and uploaded by a small thread pool; a
+        part is only read once a worker slot is free, so at most
+        part_size x B2_UPLOAD_CONCURRENCY bytes are held in memory. Like
+        bucket operations, every session call re-authorizes once if B2
+        rejects the token. Returns the B2FileMeta of the finished file.
+        """
+        concurrency = max(1, getattr(settings, 'B2_UPLOAD_CONCURRENCY', 2))
+        large_file = self._call_client(
+            lambda client: client.session.start_large_file(client.bucket.id_, name, 'b2/x-auto', {})
+        )
+        file_id = large_file['fileId']
+
+        slots = threading.BoundedSemaphore(concurrency)
+        failed = threading.Event()
+        futures = []
+        uploaded = 0
+
+        def upload_part(part_number, data):
+            try:
+                sha1 = hashlib.sha1(data).hexdigest()
+                self._call_session(
+                    lambda session: session.upload_part(file_id, part_number, len(data), sha1, io.BytesIO(data))
+                )
+                return sha1
+            except Exception:
+                failed.set()
+                raise
+            finally:
+                slots.release()
+
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='b2-upload') as pool:
+                part_number = 1
+                while not failed.is_set():
+                    slots.acquire()
+                    data = content.read(part_size)
+                    if not data:
+                        slots.release()
+                        break
+                    uploaded += len(data)
+                    futures.append(pool.submit(upload_part, part_number, data))
+                    part_number += 1
+                    del data
+            part_sha1s = [future.result() for future in futures]
+            response = self._call_session(lambda session: session.finish_large_file(file_id, part_sha1s))
+        except Exception:
+            try:
+                self._call_session(lambda session: session.cancel_large_file(file_id))
+            except Exception:
+                logger.exception(f"Failed to cancel B2 large file {file_id}")
+            raise
+
+        logger.info(f"B2 large file {name}: {len(futures)} parts of up to {part_size} bytes, concurrency {concurrency}")
+        return B2FileMeta(
+            response.get('fileId', file_id),
+            response.get('fileName', name),
+            uploaded,
+            response.get('contentSha1', 'none'),
+            response.get('uploadTimestamp'),
+        )
     
     def delete(self, name):
         """
         Delete the file from B2.
         """
         try:
-            file_version = self.bucket.get_file_info_by_name(name)
-            self.bucket.delete_file_version(file_version.id_, name)
+            file_version = self._file_info(name)
+            self._call(lambda bucket: bucket.delete_file_version(file_version.id_, name))
+            get_metadata_cache().invalidate(name)
         except Exception as e:
+            get_metadata_cache().invalidate(name)
             raise Exception(f"Error deleting file from B2: {str(e)}")
     
     def exists(self, name):
@@ -98,7 +768,7 @@ class B2Storage(Storage):
         Check if the file exists in B2.
         """
         try:
-            self.bucket.get_file_info_by_name(name)
+            self._file_info(name)
             return True
         except:
             return False
@@ -128,8 +798,7 @@ class B2Storage(Storage):
         Return the total size, in bytes, of the file.
         """
         try:
-            file_version = self.bucket.get_file_info_by_name(name)
-            return file_version.size
+            return self._file_info(name).size
         except Exception as e:
             raise Exception(f"Error getting file size from B2: {str(e)}")
     
@@ -154,6 +823,12 @@ class B2Storage(Storage):
     
     def get_modified_time(self, name):
         """
-        Return the last modified time.
+        Return the last modified (upload) time, taken from cached metadata.
         """
-        raise NotImplementedError("B2 storage does not support modified time.")
+        upload_timestamp = self._file_info(name).upload_timestamp
+        if upload_timestamp is None:
+            raise NotImplementedError("B2 did not report an upload time for this file.")
+        modified = datetime.fromtimestamp(upload_timestamp / 1000, tz=dt_timezone.utc)
+        if settings.USE_TZ:
+            return modified
+        return timezone.make_naive(modified)
@@ -1,29 +1,130 @@
-from celery import shared_task
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from celery import shared_task, group
+from django.template.loader import get_template
 from django.conf import settings
+from django.utils import timezone
 from datetime import date, timedelta
 from .models import Appointment
+from .email_utils import send_bulk_email
+from . import analytics, cart, chat, outbox
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Reminders go out this many days before the appointment
+REMINDER_DAYS_AHEAD = 3
+
+# Appointments per reminder subtask (one mail connection / bulk request each)
+REMINDER_BATCH_SIZE = 200
+
 
 @shared_task
 def send_appointment_reminders():
-    target_date = date.today() + timedelta(days=3)
-    appointments = Appointment.objects.filter(date=target_date)
-
-    for appt in appointments:
-        html = render_to_string('emails/appointment_reminder.html', {
-            'first_name': appt.first_name,
-            'reference_number': appt.reference_number,
-            'date': appt.date,
-            'time': appt.time,
-        })
-
-        send_mail(
-            subject=f"Reminder: Your Appointment in 3 Days (Ref #{appt.reference_number})",
-            message="",
-            from_email=settings.EMAIL_HOST_USER,
-            recipient_list=[appt.email],
-            html_message=html,
-        )
-
-    return f"Sent reminders for {appointments.count()} appointments"
+    """
+    Beat task: fan the day's due reminders out to send_reminder_batch
+    subtasks. Appointments that already have reminder_sent_at are skipped,
+    so running it again does not send duplicates.
+    """
+    target_date = date.today() + timedelta(days=REMINDER_DAYS_AHEAD)
+    due = (
+        Appointment.objects.filter(date=target_date, reminder_sent_at__isnull=True)
+        .exclude(status='Cancelled')
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+
+    batches = []
+    batch = []
+    for appointment_id in due.iterator(chunk_size=REMINDER_BATCH_SIZE):
+        batch.append(appointment_id)
+        if len(batch) == REMINDER_BATCH_SIZE:
+            batches.append(batch)
+            batch = []
+    if batch:
+        batches.append(batch)
+
+    if batches:
+        group(send_reminder_batch.s(ids) for ids in batches).apply_async()
+    total = sum(len(ids) for ids in batches)
+    return f"Queued reminders for {total} appointments in {len(batches)} batches"
+
+
+@shared_task
+def send_reminder_batch(appointment_ids):
+    """
+    Send one batch of reminders over a single mail connection (or MailerSend
+    bulk request). Each appointment is claimed by setting reminder_sent_at
+    before sending and released again if its email (or the whole batch)
+    fails, so overlapping runs never send the same reminder twice and
+    failed ones are retried.
+    """
+    claimed_at = timezone.now()
+    Appointment.objects.filter(pk__in=appointment_ids, reminder_sent_at__isnull=True).update(reminder_sent_at=claimed_at)
+    appointments = list(
+        Appointment.objects.filter(pk__in=appointment_ids, reminder_sent_at=claimed_at)
+        .only('id', 'first_name', 'email', 'reference_number', 'date', 'time')
+    )
+    if not appointments:
+        return "No reminders to send"
+
+    try:
+        template = get_template('app/buying/appointment_reminder.html')
+        messages = [{
+            'subject': f"Reminder: Your Appointment in {REMINDER_DAYS_AHEAD} Days (Ref #{appt.reference_number})",
+            'recipient_list': [appt.email],
+            'html': template.render({
+                'first_name': appt.first_name,
+                'reference_number': appt.reference_number,
+                'date': appt.date,
+                'time': appt.time,
+            }),
+        } for appt in appointments]
+
+        results = send_bulk_email(messages, from_email=settings.EMAIL_HOST_USER)
+    except Exception:
+        # Nothing was sent: release the whole batch for the next run
+        Appointment.objects.filter(pk__in=appointment_ids, reminder_sent_at=claimed_at).update(reminder_sent_at=None)
+        raise
+    failed = [appt.pk for appt, ok in zip(appointments, results) if not ok]
+    if failed:
+        # Let the next run try these again
+        Appointment.objects.filter(pk__in=failed, reminder_sent_at=claimed_at).update(reminder_sent_at=None)
+        logger.warning(f"{len(failed)} appointment reminder(s) failed and will be retried: {failed}")
+
+    return f"Sent {len(appointments) - len(failed)} of {len(appointments)} reminders"
+
+
+@shared_task
+def deliver_outbox_email(email_id):
+    """Send one queued outbox email (see app/outbox.py)."""
+    return outbox.deliver(email_id)
+
+
+@shared_task
+def drain_email_outbox():
+    """Beat task: send due and retrying outbox emails that were not delivered straight away."""
+    due, sent = outbox.drain()
+    return f"Sent {sent} of {due} due outbox emails"
+
+
+@shared_task
+def reconcile_daily_stats():
+    """Beat task: recompute the last few days of the analytics rollup from the raw tables."""
+    days = analytics.reconcile()
+    return f"Reconciled daily stats ({days} active day(s))"
+
+
+@shared_task
+def enforce_chat_retention():
+    """Beat task: delete idle chat conversations and compact long ones (see app/chat.py)."""
+    report = chat.enforce_retention()
+    return (
+        f"Deleted {report['deleted_conversations']} idle conversation(s), compacted "
+        f"{report['compacted_conversations']}; reclaimed {report['reclaimed_rows']} row(s), "
+        f"~{report['reclaimed_chars']} characters of text"
+    )
+
+
+@shared_task
+def purge_abandoned_carts():
+    """Beat task: delete anonymous carts whose session has expired (see app/cart.py)."""
+    return f"Purged {cart.purge_abandoned()} abandoned cart line(s)"
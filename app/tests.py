@@ -1,3 +1,965 @@
-from django.test import TestCase
+from datetime import date, time, timedelta
+import base64
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from threading import Barrier, Lock, Thread
+from time import sleep
+from unittest import mock
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from . import analytics, caching, chat, llm, outbox, search, storage_b2, tasks
+from .cart import ShoppingCart
+from .catalog import latest_products
+from .booking import SlotUnavailable
+from .inventory import reserve_stock, StockShortfall
+from .sales import rebuild_sales_counters, record_appointment_sales
+from .models import Appointment, AppointmentDay, AppointmentProduct, AppointmentSlot, Category, ChatConversation, CustomUser, DailyCategoryStat, DailyStat, OutboxEmail, Product, Cart, ProductVariation, Selling
+from .views import AdminDashboard, ProductPage
 
-# Create your tests here.
+
+# Appointments hold a place in the booking calendar; these tests book more than a real day allows
+ROOMY_CALENDAR = override_settings(APPOINTMENT_SLOT_CAPACITY=1000, APPOINTMENT_DAILY_CAPACITY=1000, APPOINTMENT_CLOSED_WEEKDAYS=[])
+
+
+@ROOMY_CALENDAR
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """
+    Many checkouts racing for the same stock must never oversell.
+
+    Runs against whatever database the suite is configured with: SQLite by
+    default, PostgreSQL when DATABASE_URL is set.
+    """
+
+    THREADS = 12
+
+    def setUp(self):
+        self.product = Product.objects.create(product_name='RTX 4060', price=100, stock=7)
+        self.other = Product.objects.create(product_name='Ryzen 5 7600', price=200, stock=50)
+        self.variation = ProductVariation.objects.create(
+            product=self.other, product_variation='Boxed', price=210, stock=5,
+        )
+
+    def _checkout(self, index, lines, results, barrier, lock):
+        outcome = 'error'
+        try:
+            barrier.wait()
+            with transaction.atomic():
+                appointment = Appointment.objects.create(
+                    first_name='Load', last_name=f'Test {index}', contact='0', email='load@example.com',
+                    date=date(2030, 1, 1), time=time(10 + index % 8),
+                )
+                reserve_stock(appointment, lines)
+            outcome = 'reserved'
+        except StockShortfall:
+            outcome = 'short'
+        finally:
+            with lock:
+                results.append(outcome)
+            connection.close()
+
+    def _race(self, orders):
+        results, lock = [], Lock()
+        barrier = Barrier(len(orders))
+        threads = [
+            Thread(target=self._checkout, args=(i, lines, results, barrier, lock))
+            for i, lines in enumerate(orders)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertNotIn('error', results)
+        return results
+
+    def test_concurrent_checkouts_never_oversell(self):
+        lines = [(self.product, None, 1, 100), (self.other, self.variation, 1, 210)]
+        results = self._race([lines] * self.THREADS)
+
+        self.product.refresh_from_db()
+        self.variation.refresh_from_db()
+        self.other.refresh_from_db()
+        reserved = results.count('reserved')
+        # The variation (5 in stock) is the bottleneck
+        self.assertEqual(reserved, 5)
+        self.assertEqual(self.variation.stock, 0)
+        self.assertEqual(self.product.stock, 7 - reserved)
+        self.assertEqual(self.other.stock, 50)
+        self.assertEqual(AppointmentProduct.objects.count(), reserved * 2)
+        # Rejected checkouts leave no appointment behind
+        self.assertEqual(Appointment.objects.count(), reserved)
+
+    def test_opposite_line_order_does_not_deadlock(self):
+        forward = [(self.product, None, 1, 100), (self.other, None, 1, 200)]
+        backward = list(reversed(forward))
+        results = self._race([forward, backward] * (self.THREADS // 2))
+
+        self.product.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(results.count('reserved'), 7)
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(self.other.stock, 43)
+
+    def test_shortfall_reports_every_short_line(self):
+        appointment = Appointment.objects.create(
+            first_name='A', last_name='B', contact='0', email='a@example.com',
+            date=date(2030, 1, 2), time=time(10),
+        )
+        with self.assertRaises(StockShortfall) as raised:
+            reserve_stock(appointment, [
+                (self.product, None, 8, 100),
+                (self.other, None, 1, 200),
+                (self.other, self.variation, 6, 210),
+            ])
+        short = {(line['product_id'], line['variant_id']): line for line in raised.exception.shortfalls}
+        self.assertEqual(set(short), {(self.product.pk, None), (self.other.pk, self.variation.pk)})
+        self.assertEqual(short[(self.product.pk, None)]['available'], 7)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+        self.assertFalse(AppointmentProduct.objects.exists())
+
+
+@ROOMY_CALENDAR
+class AdminDashboardQueryBudgetTests(TestCase):
+    """The dashboard's query count must not grow with the number of orders, categories or days."""
+
+    QUERY_BUDGET = 9
+
+    def _add_orders(self, count, start):
+        categories = [Category.objects.create(category_name=f'Category {start + i}') for i in range(3)]
+        products = [
+            Product.objects.create(product_name=f'Part {start + i}', price=50 + i, stock=10, category_name=categories[i % 3])
+            for i in range(6)
+        ]
+        for i in range(count):
+            appointment = Appointment.objects.create(
+                first_name='Dash', last_name=str(start + i), contact='0', email='dash@example.com',
+                date=date(2030, 2, 1), time=time(10), status='Pending' if i % 3 else 'Finished',
+            )
+            AppointmentProduct.objects.bulk_create([
+                AppointmentProduct(appointment=appointment, product=products[(i + n) % 6], quantity=n + 1, price=products[(i + n) % 6].price)
+                for n in range(3)
+            ])
+            Selling.objects.create(
+                product_name='Old GPU', price=1000, first_name='Dash', last_name=str(start + i), contact='0',
+                email='dash@example.com', selling_date=date(2030, 2, 1), selling_time=time(11),
+            )
+
+    def _context(self):
+        view = AdminDashboard()
+        view.setup(RequestFactory().get('/admin_dashboard/'))
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            return view.get_context_data()
+
+    def test_query_count_is_constant(self):
+        self._add_orders(2, start=0)
+        small = self._context()
+        self._add_orders(30, start=100)
+        large = self._context()
+
+        pending = Appointment.objects.filter(status='Pending').count() + Selling.objects.filter(status='Pending').count()
+        self.assertEqual(len(small['all_orders']), 3)
+        self.assertEqual(len(large['all_orders']), pending)
+        self.assertEqual(len(large['category_list']), 6)
+        self.assertEqual(large['appointment_chart_data'][-1], 32)
+
+    def test_pending_order_totals(self):
+        self._add_orders(2, start=0)
+        orders = {o['product_id']: o for o in self._context()['all_orders'] if o['type'] == 'Appointment'}
+        appointment = Appointment.objects.get(last_name='1')
+        expected = sum(line.quantity * line.price for line in appointment.products.all())
+        self.assertEqual(orders[appointment.reference_number]['amount'], expected)
+        self.assertEqual(orders[appointment.reference_number]['product'].count(' x '), 3)
+
+
+class DailyStatsTests(TestCase):
+    """The rollup kept by the status-change signals must match a rebuild from the raw tables."""
+
+    def _snapshot(self):
+        days = {
+            row.pop('date'): row
+            for row in DailyStat.objects.values('date', *analytics.COUNTERS)
+            if any(row[counter] for counter in analytics.COUNTERS)
+        }
+        categories = {pk: totals for pk, totals in analytics.category_totals().items() if any(totals)}
+        return days, categories
+
+    def test_incremental_rollup_matches_rebuild(self):
+        gpus = Category.objects.create(category_name='GPU')
+        gpu = Product.objects.create(product_name='RTX 4070', price=600, stock=10, category_name=gpus)
+        loose = Product.objects.create(product_name='Cable', price=5, stock=10)
+        appointments = []
+        for i in range(4):
+            appointment = Appointment.objects.create(
+                first_name='Roll', last_name=str(i), contact='0', email='roll@example.com',
+                date=date(2030, 3, 1), time=time(10 + i),
+            )
+            AppointmentProduct.objects.create(appointment=appointment, product=gpu, quantity=i + 1, price=600)
+            AppointmentProduct.objects.create(appointment=appointment, product=loose, quantity=2, price=5)
+            appointments.append(appointment)
+        trade = Selling.objects.create(
+            product_name='Old GPU', price=1000, first_name='Roll', last_name='T', contact='0',
+            email='roll@example.com', selling_date=date(2030, 3, 1), selling_time=time(11),
+        )
+
+        for appointment in appointments[:3]:
+            appointment.status = 'Finished'
+            appointment.save()
+        # Re-saving without a change and cancelling a finished appointment
+        appointments[0].save()
+        finished = Appointment.objects.get(pk=appointments[1].pk)
+        finished.status = 'Cancelled'
+        finished.save(update_fields=['status'])
+        appointments[3].status = 'Cancelled'
+        appointments[3].save()
+        trade.status = 'Completed'
+        trade.save()
+
+        stats = DailyStat.objects.get()
+        self.assertEqual(stats.appointments_created, 4)
+        self.assertEqual(stats.appointments_finished, 2)
+        self.assertEqual(stats.appointments_cancelled, 2)
+        self.assertEqual((stats.trades_created, stats.trades_completed), (1, 1))
+        self.assertEqual(stats.units_sold, (1 + 2) + (3 + 2))
+        self.assertEqual(stats.revenue, 600 * 4 + 5 * 4)
+        self.assertEqual(analytics.category_totals()[gpus.pk], (4, 2400))
+        self.assertIsNotNone(Appointment.objects.get(pk=finished.pk).status_changed_at)
+
+        incremental = self._snapshot()
+        analytics.rebuild()
+        self.assertEqual(self._snapshot(), incremental)
+        self.assertEqual(DailyCategoryStat.objects.filter(category__isnull=True).get().units_sold, 4)
+
+
+class CatalogCacheTests(TestCase):
+    """Catalog reads are served from the cache until a catalog change bumps the version."""
+
+    def setUp(self):
+        cache.clear()
+        caching.reset_stats()
+
+    def _product(self, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(product_name=name, price=10, stock=1, image='product_images/cached.jpg')
+
+    def test_latest_products_cached_until_catalog_changes(self):
+        product = self._product('Cached GPU')
+        self.assertEqual([p.product_name for p in latest_products(5)], ['Cached GPU'])
+        with self.assertNumQueries(0):
+            latest_products(5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.product_name = 'Renamed GPU'
+            product.save()
+        self.assertEqual([p.product_name for p in latest_products(5)], ['Renamed GPU'])
+
+        stats = caching.stats()['latest_products']
+        self.assertEqual((stats['hits'], stats['misses'], stats['builds']), (1, 2, 2))
+
+    def test_concurrent_misses_build_once(self):
+        builds, lock = [], Lock()
+        barrier = Barrier(8)
+
+        def build():
+            with lock:
+                builds.append(1)
+            sleep(0.2)
+            return 'value'
+
+        results = []
+
+        def read():
+            barrier.wait()
+            results.append(caching.get_or_build('test:single-flight', build, 60))
+
+        threads = [Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(caching.stats()['test']['waits'], 7)
+
+
+class ChatAppendTests(TestCase):
+    """Chat saves append only new messages and stay consistent across retries and old clients."""
+
+    SESSION = 'anon-append-test'
+
+    def _post(self, url, **data):
+        return self.client.post(url, data=json.dumps({'session_id': self.SESSION, **data}), content_type='application/json', secure=True)
+
+    def _turn(self, n):
+        return [{'role': 'user', 'content': f'question {n}', 'timestamp': n}, {'role': 'assistant', 'content': f'answer {n}'}]
+
+    def test_append_retry_conflict_and_cursor(self):
+        self.assertEqual(self._post('/api/chat/append/', after_seq=0, messages=self._turn(1)).json()['last_seq'], 2)
+        # A retried request is not stored twice
+        retried = self._post('/api/chat/append/', after_seq=0, messages=self._turn(1)).json()
+        self.assertEqual((retried['last_seq'], retried['appended']), (2, 0))
+        self.assertEqual(self._post('/api/chat/append/', after_seq=2, messages=self._turn(2)).json()['last_seq'], 4)
+
+        ahead = self._post('/api/chat/append/', after_seq=9, messages=self._turn(3))
+        self.assertEqual(ahead.status_code, 409)
+        self.assertEqual(ahead.json()['last_seq'], 4)
+
+        loaded = self.client.get(f'/api/chat/load/?session_id={self.SESSION}&after=2', secure=True).json()
+        self.assertEqual([m['content'] for m in loaded['messages']], ['question 2', 'answer 2'])
+        self.assertEqual(loaded['messages'][0]['timestamp'], 2)
+        self.assertEqual(loaded['last_seq'], 4)
+
+    def test_full_history_save_writes_only_the_tail(self):
+        history = self._turn(1) + self._turn(2)
+        self._post('/api/chat/save/', messages=history[:2])
+        self._post('/api/chat/save/', messages=history)
+        conversation = ChatConversation.objects.get(session_id=self.SESSION)
+        self.assertEqual(list(conversation.chat_messages.values_list('seq', 'content')), [
+            (1, 'question 1'), (2, 'answer 1'), (3, 'question 2'), (4, 'answer 2'),
+        ])
+        # A shorter history (chat cleared and restarted) replaces the stored one
+        self._post('/api/chat/save/', messages=self._turn(3))
+        self.assertEqual(list(conversation.chat_messages.values_list('content', flat=True)), ['question 3', 'answer 3'])
+
+    def test_tail_first_pages_and_etag(self):
+        self._post('/api/chat/append/', after_seq=0, messages=sum((self._turn(n) for n in range(1, 6)), []))
+        url = f'/api/chat/load/?session_id={self.SESSION}&limit=4'
+
+        newest = self.client.get(url, secure=True)
+        data = newest.json()
+        self.assertEqual([m['seq'] for m in data['messages']], [7, 8, 9, 10])
+        self.assertTrue(data['has_more'])
+        older = self.client.get(f"{url}&before={data['next_before']}", secure=True).json()
+        self.assertEqual([m['seq'] for m in older['messages']], [3, 4, 5, 6])
+        oldest = self.client.get(f"{url}&before={older['next_before']}", secure=True).json()
+        self.assertEqual(([m['seq'] for m in oldest['messages']], oldest['has_more']), ([1, 2], False))
+
+        # Unchanged history: 304 from one query; a new message changes the ETag
+        with self.assertNumQueries(1):
+            cached = self.client.get(url, secure=True, HTTP_IF_NONE_MATCH=newest['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self._post('/api/chat/append/', after_seq=10, messages=self._turn(6))
+        self.assertEqual(self.client.get(url, secure=True, HTTP_IF_NONE_MATCH=newest['ETag']).status_code, 200)
+
+
+@override_settings(CHAT_ANONYMOUS_RETENTION_DAYS=30, CHAT_USER_RETENTION_DAYS=0, CHAT_COMPACT_AFTER=6, CHAT_KEEP_MESSAGES=4)
+class ChatRetentionTests(TestCase):
+    """The retention job deletes idle anonymous chats and compacts long ones into a summary."""
+
+    def _conversation(self, session_id, turns, idle_days=0, **fields):
+        conversation = ChatConversation.objects.create(session_id=session_id, **fields)
+        chat.append_messages(conversation, 0, sum((
+            [{'role': 'user', 'content': f'question {n}'}, {'role': 'assistant', 'content': f'answer {n}'}]
+            for n in range(1, turns + 1)
+        ), []))
+        ChatConversation.objects.filter(pk=conversation.pk).update(updated_at=timezone.now() - timedelta(days=idle_days))
+        return conversation
+
+    def test_purges_idle_and_compacts_long_conversations(self):
+        user = CustomUser.objects.create_user(username='chatter', email='chatter@example.com', password='pw')
+        self._conversation('anon-idle', 2, idle_days=31)
+        self._conversation('anon-recent', 2, idle_days=3)
+        self._conversation(f'user-{user.pk}', 2, idle_days=400, user=user)
+        long = self._conversation('anon-long', 5)
+
+        report = chat.enforce_retention()
+        self.assertEqual((report['deleted_conversations'], report['deleted_messages']), (1, 4))
+        self.assertEqual((report['compacted_conversations'], report['compacted_messages']), (1, 6))
+        self.assertEqual(report['reclaimed_rows'], 11)
+        self.assertGreater(report['reclaimed_chars'], 0)
+        self.assertEqual(
+            set(ChatConversation.objects.values_list('session_id', flat=True)),
+            {'anon-recent', f'user-{user.pk}', 'anon-long'},
+        )
+
+        long.refresh_from_db()
+        self.assertEqual((long.last_seq, long.compacted_seq), (10, 6))
+        self.assertEqual(long.summary, 'question 1; question 2; question 3')
+        self.assertEqual(list(long.chat_messages.values_list('seq', flat=True)), [7, 8, 9, 10])
+        self.assertEqual(chat.page_before(long, None, 10)[1], False)
+
+        # Nothing left to do, and appending continues from the kept tail
+        self.assertEqual(chat.enforce_retention()['reclaimed_rows'], 0)
+        self.assertEqual(chat.append_messages(long, 10, [{'role': 'user', 'content': 'question 6'}]), (11, 1))
+
+    def test_full_history_save_after_compaction(self):
+        conversation = self._conversation('anon-legacy', 5)
+        chat.compact(conversation.pk)
+        history = [
+            {'role': 'user' if n % 2 else 'assistant', 'content': f"{'question' if n % 2 else 'answer'} {(n + 1) // 2}"}
+            for n in range(1, 11)
+        ]
+
+        # A client that kept every message, and one that reloaded only the kept tail
+        self.assertEqual(chat.save_history(conversation, history + [{'role': 'user', 'content': 'question 6'}]), (11, 1))
+        self.assertEqual(chat.save_history(conversation, history[6:] + [
+            {'role': 'user', 'content': 'question 6'}, {'role': 'assistant', 'content': 'answer 6'},
+        ]), (12, 1))
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.last_seq, conversation.compacted_seq), (12, 6))
+        self.assertEqual(conversation.summary, 'question 1; question 2; question 3')
+        self.assertEqual(list(conversation.chat_messages.values_list('seq', flat=True)), list(range(7, 13)))
+
+        # A shorter history is a restarted chat
+        self.assertEqual(chat.save_history(conversation, [{'role': 'user', 'content': 'hello'}]), (1, 1))
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.last_seq, conversation.compacted_seq, conversation.summary), (1, 0, ''))
+        self.assertEqual(list(conversation.chat_messages.values_list('content', flat=True)), ['hello'])
+
+
+class FailingUpstream:
+    def stream(self, system, contents):
+        yield 'Half a '
+        raise llm.UpstreamError('connection reset')
+
+
+@override_settings(CHAT_LLM_BACKEND='stub')
+class ChatStreamTests(TestCase):
+    """Replies are generated server-side, streamed as SSE and stored when the stream ends."""
+
+    SESSION = 'anon-stream-test'
+
+    def setUp(self):
+        llm.reset_stats()
+
+    def _ask(self, after_seq, *messages):
+        response = self.client.post('/api/chat/stream/', data=json.dumps({
+            'session_id': self.SESSION, 'after_seq': after_seq, 'messages': list(messages),
+        }), content_type='application/json', secure=True)
+        if not response.streaming:
+            return response, []
+        body = b''.join(response.streaming_content).decode()
+        events = []
+        for raw in filter(None, body.split('\n\n')):
+            event, data = raw.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return response, events
+
+    def test_streams_and_stores_the_turn(self):
+        chat.append_messages(ChatConversation.objects.create(session_id=self.SESSION), 0, [
+            {'role': 'user', 'content': 'hello'}, {'role': 'assistant', 'content': 'hi'},
+        ])
+        response, events = self._ask(2, {'role': 'user', 'content': 'build me a pc', 'timestamp': 5}, {'role': 'user', 'content': 'Any GPUs?'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        tokens = [data['text'] for event, data in events if event == 'token']
+        self.assertGreater(len(tokens), 1)
+        event, done = events[-1]
+        self.assertEqual(event, 'done')
+        # Stored history plus the posted messages reached the model
+        self.assertEqual(done['text'], ''.join(tokens).strip())
+        self.assertIn('(stub reply to 4 message(s)) You asked: Any GPUs?', done['text'])
+        self.assertEqual(done['last_seq'], 5)
+
+        conversation = ChatConversation.objects.get(session_id=self.SESSION)
+        self.assertEqual(list(conversation.chat_messages.values_list('role', flat=True)), ['user', 'assistant', 'user', 'user', 'assistant'])
+        self.assertEqual(conversation.chat_messages.get(seq=3).meta, {'timestamp': 5})
+        stats = llm.stats()
+        self.assertEqual((stats['replies'], stats['errors'], stats['ttft_samples']), (1, 0, 1))
+
+    def test_rejects_before_streaming_and_stores_nothing_on_failure(self):
+        response, _ = self._ask(3, {'role': 'user', 'content': 'hi'})
+        self.assertEqual((response.status_code, response.json()['last_seq']), (409, 0))
+        self.assertEqual(self._ask(0, {'role': 'assistant', 'content': 'hi'})[0].status_code, 400)
+
+        with override_settings(CHAT_LLM_BACKEND='app.tests.FailingUpstream'):
+            _, events = self._ask(0, {'role': 'user', 'content': 'hi'})
+        self.assertEqual([event for event, data in events], ['token', 'error'])
+        self.assertEqual(ChatConversation.objects.get(session_id=self.SESSION).last_seq, 0)
+        self.assertEqual(llm.stats()['errors'], 1)
+
+    @override_settings(CHAT_LLM_BACKEND='gemini')
+    @mock.patch.dict(os.environ, {'GEMINI_API_KEY': ''})
+    def test_missing_api_key_is_an_error_not_a_stub_reply(self):
+        _, events = self._ask(0, {'role': 'user', 'content': 'hi'})
+        self.assertEqual([event for event, data in events], ['error'])
+        self.assertEqual(ChatConversation.objects.get(session_id=self.SESSION).last_seq, 0)
+
+
+class SystemPromptTests(TestCase):
+    """The system prompt is served from memory with ETags and re-rendered when the file or catalog changes."""
+
+    def setUp(self):
+        cache.clear()
+        self.path = os.path.join(tempfile.mkdtemp(), 'prompt.txt')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+        shutil.copy(llm.SYSTEM_PROMPT_PATH, self.path)
+        patcher = mock.patch.object(llm, 'SYSTEM_PROMPT_PATH', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _get(self, **headers):
+        return self.client.get('/api/gemini/system-prompt/', secure=True, **headers)
+
+    def test_etag_gzip_and_invalidation(self):
+        Product.objects.create(product_name='Mouse', price=500, stock=3, category_name=Category.objects.create(category_name='Peripherals'))
+        first = self._get()
+        prompt = first.json()['prompt']
+        self.assertIn('Categories in stock: Peripherals', prompt)
+        self.assertIn('You are a friendly and helpful AI assistant for Koyanardzshop', prompt)
+        self.assertNotIn('{{', prompt)
+
+        # A repeat fetch is a 304 without reading the file again
+        with mock.patch('builtins.open', side_effect=AssertionError('prompt file re-read')):
+            self.assertEqual(self._get(HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        zipped = self._get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertNotEqual(zipped['ETag'], first['ETag'])
+        self.assertEqual(json.loads(gzip.decompress(zipped.content))['prompt'], prompt)
+
+        # Catalog changes and edits to the file both change the prompt
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(category_name='Storage')
+            Product.objects.create(product_name='SSD', price=2500, stock=1, category_name=Category.objects.get(category_name='Storage'))
+        restocked = self._get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(restocked.status_code, 200)
+        self.assertIn('Categories in stock: Peripherals, Storage', restocked.json()['prompt'])
+
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('\nClosed on holidays.')
+        self.assertTrue(self._get(HTTP_IF_NONE_MATCH=restocked['ETag']).json()['prompt'].endswith('Closed on holidays.'))
+
+
+@override_settings(EMAIL_OUTBOX_DELIVERY='sync', EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+@mock.patch.dict(os.environ, {'MAILERSEND_API_KEY': ''})
+class EmailOutboxTests(TestCase):
+    """Outbox emails are sent once after commit, retried with backoff and given up on after the attempt budget."""
+
+    def _queue(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return outbox.queue_email('Your OTP', ['buyer@example.com'], text='123456', **kwargs)
+
+    def test_sync_delivery_after_commit_is_idempotent(self):
+        email = self._queue(idempotency_key='otp-1')
+        self._queue(idempotency_key='otp-1')
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('Sent', 1))
+        self.assertEqual([m.subject for m in mail.outbox], ['Your OTP'])
+        # Already sent: a second claim does nothing
+        self.assertIsNone(outbox.deliver(email.pk))
+
+    def test_failed_attempts_back_off_then_die_and_can_be_retried(self):
+        with mock.patch('app.outbox.send_email', side_effect=RuntimeError('smtp down')):
+            email = self._queue()
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts, email.last_error), ('Pending', 1, 'smtp down'))
+            self.assertGreater(email.next_attempt_at, timezone.now())
+            # Not due yet: neither a direct delivery nor the drain picks it up
+            self.assertIsNone(outbox.deliver(email.pk))
+            self.assertEqual(outbox.drain(), (0, 0))
+
+            OutboxEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(outbox.drain(), (1, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('Dead', 2))
+        self.assertEqual(outbox.drain(), (0, 0))
+
+        self.assertEqual(outbox.retry(OutboxEmail.objects.all()), 1)
+        self.assertEqual(outbox.drain(), (1, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, len(mail.outbox)), ('Sent', 1, 1))
+
+    def test_drain_releases_emails_whose_worker_died(self):
+        stuck = OutboxEmail.objects.create(
+            subject='Cancelled', recipients=['buyer@example.com'], status='Sending', attempts=1,
+            locked_at=timezone.now() - outbox.STALE_SENDING_AFTER - timedelta(minutes=1),
+        )
+        busy = OutboxEmail.objects.create(subject='Booked', recipients=['buyer@example.com'], status='Sending', attempts=1, locked_at=timezone.now())
+        self.assertEqual(outbox.drain(), (1, 1))
+        stuck.refresh_from_db()
+        busy.refresh_from_db()
+        self.assertEqual((stuck.status, stuck.attempts, busy.status), ('Sent', 2, 'Sending'))
+
+
+@ROOMY_CALENDAR
+@mock.patch.dict(os.environ, {'MAILERSEND_API_KEY': ''})
+class ReminderBatchTests(TestCase):
+    """A reminder batch that could not be sent is released for the next run."""
+
+    def setUp(self):
+        self.ids = [
+            Appointment.objects.create(
+                first_name='Remind', last_name=str(i), contact='0', email=f'remind{i}@example.com',
+                date=date.today() + timedelta(days=tasks.REMINDER_DAYS_AHEAD), time=time(10 + i),
+            ).pk
+            for i in range(3)
+        ]
+
+    def test_connection_failure_releases_the_claim(self):
+        with mock.patch('django.core.mail.get_connection', side_effect=OSError('SMTP auth failed')):
+            self.assertEqual(tasks.send_reminder_batch(self.ids), 'Sent 0 of 3 reminders')
+        self.assertFalse(Appointment.objects.filter(reminder_sent_at__isnull=False).exists())
+
+        with mock.patch('app.tasks.send_bulk_email', side_effect=RuntimeError('provider down')):
+            with self.assertRaises(RuntimeError):
+                tasks.send_reminder_batch(self.ids)
+        self.assertFalse(Appointment.objects.filter(reminder_sent_at__isnull=False).exists())
+
+        self.assertEqual(tasks.send_reminder_batch(self.ids), 'Sent 3 of 3 reminders')
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(Appointment.objects.filter(reminder_sent_at__isnull=False).count(), 3)
+
+
+class CartConcurrentAddTests(TestCase):
+    """Adding a line another request created in the meantime adds to it instead of failing."""
+
+    def test_add_after_concurrent_first_add(self):
+        product = Product.objects.create(product_name='Keyboard', price=1500, stock=5)
+        request = RequestFactory().get('/')
+        request.session = {'cart_token': 'racing-token'}
+        cart = ShoppingCart(request)
+        # The other request inserts its line after our locked read found nothing
+        Cart.objects.create(produkto=product, cart_key=str(product.pk), quantity=2, session_token='racing-token')
+        real_select_for_update = Cart.objects.select_for_update
+        reads = []
+
+        def select_for_update(*args, **kwargs):
+            reads.append(1)
+            return Cart.objects.none() if len(reads) == 1 else real_select_for_update(*args, **kwargs)
+
+        with mock.patch.object(Cart.objects, 'select_for_update', side_effect=select_for_update):
+            self.assertEqual(cart.add(product, 2), 4)
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(list(Cart.objects.values_list('quantity', flat=True)), [4])
+        # Clamped to stock as usual afterwards
+        ok, report = cart.add_many([{'id': product.pk, 'quantity': 3}])
+        self.assertEqual((ok, report[0]['status'], report[0]['quantity']), (True, 'clamped', 5))
+
+
+@override_settings(SESSION_COOKIE_AGE=60 * 60 * 24 * 14)
+class CartCleanupTests(TestCase):
+    """Anonymous carts nobody can reach any more are purged; user carts and live ones are kept."""
+
+    def test_purges_carts_of_expired_sessions(self):
+        products = [Product.objects.create(product_name=f'Part {n}', price=100, stock=5) for n in range(3)]
+        user = CustomUser.objects.create_user(username='keeper', email='keeper@example.com', password='pw')
+        old = timezone.now() - timedelta(days=15)
+        Cart.objects.create(produkto=products[0], cart_key='1', session_token='abandoned')
+        Cart.objects.create(produkto=products[1], cart_key='2', session_token='abandoned')
+        # A cart with one recent line is still in use
+        Cart.objects.create(produkto=products[0], cart_key='1', session_token='returning')
+        Cart.objects.create(produkto=products[1], cart_key='2', session_token='returning')
+        Cart.objects.create(produkto=products[2], cart_key='1', user=user)
+        Cart.objects.filter(session_token='abandoned').update(added_at=old)
+        Cart.objects.filter(session_token='returning', cart_key='1').update(added_at=old)
+        Cart.objects.filter(user=user).update(added_at=old)
+
+        self.assertEqual(tasks.purge_abandoned_carts(), 'Purged 2 abandoned cart line(s)')
+        self.assertCountEqual(
+            Cart.objects.values_list('session_token', 'cart_key'),
+            [('returning', '1'), ('returning', '2'), (None, '1')],
+        )
+
+
+@override_settings(B2_CACHE_MAX_BYTES=0)
+class B2StorageTests(TestCase):
+    """3D models stored through B2Storage, against a LocalB2Client bucket in a temporary directory."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.client_b2 = storage_b2.LocalB2Client(os.path.join(directory, 'bucket'))
+        self.addCleanup(storage_b2.set_b2_client, storage_b2.set_b2_client(self.client_b2))
+        self.cache_dir = os.path.join(directory, 'cache')
+        for name, value in (('_metadata_cache', None), ('_disk_cache', None)):
+            patcher = mock.patch.object(storage_b2, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.storage = storage_b2.B2Storage()
+        self.data = bytes(range(256)) * 4
+
+    def test_range_requests(self):
+        name = self.storage.save('3d_models/case.glb', ContentFile(self.data))
+        product = Product.objects.create(product_name='Case', price=3000, stock=1, model_3d=name)
+        url = f'/api/product/{product.pk}/model-3d/'
+
+        with mock.patch.object(Product._meta.get_field('model_3d'), 'storage', self.storage):
+            full = self.client.get(url, secure=True)
+            self.assertEqual((full.status_code, full['Content-Length']), (200, '1024'))
+            self.assertEqual(b''.join(full.streaming_content), self.data)
+
+            partial = self.client.get(url, secure=True, HTTP_RANGE='bytes=1000-')
+            self.assertEqual((partial.status_code, partial['Content-Range']), (206, 'bytes 1000-1023/1024'))
+            self.assertEqual(b''.join(partial.streaming_content), self.data[1000:])
+            suffix = self.client.get(url, secure=True, HTTP_RANGE='bytes=-16', HTTP_IF_RANGE=full['ETag'])
+            self.assertEqual((suffix.status_code, b''.join(suffix.streaming_content)), (206, self.data[-16:]))
+
+            unsatisfiable = self.client.get(url, secure=True, HTTP_RANGE='bytes=2048-')
+            self.assertEqual((unsatisfiable.status_code, unsatisfiable['Content-Range']), (416, 'bytes */1024'))
+            # A stale If-Range gets the whole file
+            stale = self.client.get(url, secure=True, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+            self.assertEqual((stale.status_code, len(b''.join(stale.streaming_content))), (200, 1024))
+            self.assertEqual(self.client.get(url, secure=True, HTTP_IF_NONE_MATCH=full['ETag']).status_code, 304)
+
+    def test_disk_cache_evicts_least_recently_used(self):
+        names = [self.storage.save(f'3d_models/{n}.glb', ContentFile(self.data[:100] + bytes([n]))) for n in range(3)]
+        with override_settings(B2_CACHE_MAX_BYTES=250, B2_CACHE_DIR=self.cache_dir):
+            disk = storage_b2.get_disk_cache()
+            self.assertTrue(self.storage.warm_cache(names[0]))
+            self.assertTrue(self.storage.warm_cache(names[1]))
+            now = timezone.now().timestamp()
+            os.utime(os.path.join(self.cache_dir, names[0].replace('/', '_')), (now - 100, now - 100))
+            os.utime(os.path.join(self.cache_dir, names[1].replace('/', '_')), (now - 50, now - 50))
+
+            # Reading the older entry makes the other one least recently used
+            with self.storage.open(names[0]) as f:
+                self.assertEqual(f.read(), self.data[:100] + bytes([0]))
+            self.assertTrue(self.storage.warm_cache(names[2]))
+
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted(n.replace('/', '_') for n in (names[0], names[2])))
+        stats = disk.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']), (1, 3, 1))
+
+    def test_new_name_is_checked_past_a_cached_miss(self):
+        self.assertFalse(self.storage.exists('3d_models/gpu.glb'))
+        # Another process uploads the name while this one still has it cached as missing
+        self.client_b2.bucket.upload_bytes(b'theirs', '3d_models/gpu.glb')
+        self.assertFalse(self.storage.exists('3d_models/gpu.glb'))
+
+        name = self.storage.save('3d_models/gpu.glb', ContentFile(b'ours'))
+        self.assertNotEqual(name, '3d_models/gpu.glb')
+        self.assertTrue(self.storage.exists('3d_models/gpu.glb'))
+        with self.storage.open('3d_models/gpu.glb') as f:
+            self.assertEqual(f.read(), b'theirs')
+
+    def _reject_token_once(self, method):
+        real = getattr(self.client_b2.bucket, method)
+        calls = []
+
+        def call(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 1:
+                raise storage_b2.InvalidAuthToken('expired', 'bad_auth_token')
+            return real(*args, **kwargs)
+
+        patcher = mock.patch.object(self.client_b2.bucket, method, side_effect=call)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return calls
+
+    @override_settings(B2_LARGE_FILE_THRESHOLD=100, B2_UPLOAD_PART_SIZE=100)
+    def test_large_uploads_and_ranged_reads_reauthorize(self):
+        parts = self._reject_token_once('upload_part')
+        name = self.storage.save('3d_models/tower.glb', ContentFile(self.data))
+        self.assertEqual(len(parts), 12)
+
+        downloads = self._reject_token_once('download_file_by_id')
+        with self.storage.open(name) as f:
+            f.seek(1000)
+            self.assertEqual(f.read(), self.data[1000:])
+        self.assertEqual(len(downloads), 2)
+
+    def test_reauthorizes_once_when_the_token_is_rejected(self):
+        name = self.storage.save('3d_models/fan.glb', ContentFile(self.data))
+        storage_b2.get_metadata_cache().invalidate()
+        real = self.client_b2.bucket.get_file_info_by_name
+        calls = []
+
+        def get_file_info_by_name(file_name):
+            calls.append(file_name)
+            if len(calls) == 1:
+                raise storage_b2.InvalidAuthToken('expired', 'bad_auth_token')
+            return real(file_name)
+
+        with mock.patch.object(self.client_b2.bucket, 'get_file_info_by_name', side_effect=get_file_info_by_name), \
+                mock.patch.object(self.client_b2, 'invalidate') as invalidate:
+            self.assertEqual(self.storage.size(name), 1024)
+        self.assertEqual((len(calls), invalidate.call_count), (2, 1))
+
+
+@mock.patch.object(ProductPage, 'paginate_by', 2)
+class ProductPagingTests(TestCase):
+    """The product list pages by keyset cursor and ignores cursors and sorts it cannot use."""
+
+    def setUp(self):
+        for n, name in enumerate(['RTX 4060', 'RTX 4070', 'Ryzen 5', 'Ryzen 7', 'Case fan'], start=1):
+            Product.objects.create(product_name=name, price=n * 1000, stock=1, image='product_images/paged.jpg')
+
+    def _names(self, **params):
+        response = self.client.get('/product', params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return [p.product_name for p in response.context['products']], response.context.get('next_page_query')
+
+    def test_keyset_pages(self):
+        seen, query = [], 'price_order=low'
+        while query:
+            names, query = self._names(**QueryDict(query).dict())
+            seen += names
+        self.assertEqual(seen, ['RTX 4060', 'RTX 4070', 'Ryzen 5', 'Ryzen 7', 'Case fan'])
+
+    def test_tampered_cursor_serves_the_first_page(self):
+        first = self._names(price_order='low')[0]
+        for values in (['abc', 1], [[1], {'a': 1}], ['1000', 'x']):
+            cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+            self.assertEqual(self._names(price_order='low', cursor=cursor)[0], first)
+
+    def test_relevance_needs_a_search_term(self):
+        self.assertEqual(self._names(price_order='relevance')[0], self._names()[0])
+        self.assertCountEqual(self._names(price_order='relevance', search='ryzen')[0], ['Ryzen 5', 'Ryzen 7'])
+
+
+class AppointmentSlotTests(TestCase):
+    """Every appointment that is not cancelled holds one place in the day and slot counters."""
+
+    DAY = date(2030, 1, 7)
+
+    def _counts(self):
+        day = AppointmentDay.objects.get(date=self.DAY)
+        slots = dict(AppointmentSlot.objects.filter(date=self.DAY, booked__gt=0).values_list('time', 'booked'))
+        return day.booked, slots
+
+    def _book(self, at, **fields):
+        return Appointment.objects.create(
+            first_name='Slot', last_name='Test', contact='0', email='slot@example.com', date=self.DAY, time=at, **fields,
+        )
+
+    def test_counters_follow_create_reschedule_cancel_and_delete(self):
+        appointment = self._book(time(10))
+        self.assertEqual(self._counts(), (1, {time(10): 1}))
+        with self.assertRaises(SlotUnavailable):
+            self._book(time(10))
+        self.assertEqual(Appointment.objects.count(), 1)
+
+        appointment = Appointment.objects.get(pk=appointment.pk)
+        appointment.time = time(11)
+        appointment.save()
+        self.assertEqual(self._counts(), (1, {time(11): 1}))
+
+        appointment.status = 'Cancelled'
+        appointment.save(update_fields=['status'])
+        self.assertEqual(self._counts(), (0, {}))
+        appointment.delete()
+        self.assertEqual(self._counts(), (0, {}))
+
+        # Un-cancelling takes the place again, and deleting gives it back
+        other = self._book(time(12), status='Cancelled')
+        self.assertEqual(self._counts(), (0, {}))
+        other.status = 'Pending'
+        other.save()
+        self.assertEqual(self._counts(), (1, {time(12): 1}))
+        Appointment.objects.filter(pk=other.pk).delete()
+        self.assertEqual(self._counts(), (0, {}))
+
+    def test_moving_into_a_taken_slot_is_refused(self):
+        self._book(time(10))
+        appointment = self._book(time(11))
+        appointment.time = time(10)
+        with self.assertRaises(SlotUnavailable):
+            appointment.save()
+        self.assertEqual(Appointment.objects.get(pk=appointment.pk).time, time(11))
+        self.assertEqual(self._counts(), (2, {time(10): 1, time(11): 1}))
+
+
+class SalesCounterTests(TestCase):
+    """Cancelling, un-cancelling and deleting orders keep units_sold in step with a rebuild."""
+
+    def setUp(self):
+        self.gpu = Product.objects.create(product_name='RTX 4070', price=600, stock=10)
+        self.fan = Product.objects.create(product_name='Case fan', price=10, stock=10)
+        self.appointment = Appointment.objects.create(
+            first_name='Sales', last_name='Test', contact='0', email='sales@example.com', date=date(2030, 1, 7), time=time(10),
+        )
+        self.gpu_line = AppointmentProduct.objects.create(appointment=self.appointment, product=self.gpu, quantity=2, price=600)
+        AppointmentProduct.objects.create(appointment=self.appointment, product=self.fan, quantity=3, price=10)
+        record_appointment_sales(self.appointment)
+
+    def _counters(self):
+        return list(Product.objects.order_by('pk').values_list('units_sold', 'revenue'))
+
+    def _assert_sold(self, gpu, fan):
+        incremental = self._counters()
+        self.assertEqual([units for units, _ in incremental], [gpu, fan])
+        rebuild_sales_counters()
+        self.assertEqual(self._counters(), incremental)
+
+    def test_status_changes_and_deletes(self):
+        self._assert_sold(2, 3)
+        for status, sold in (('Finished', (2, 3)), ('Cancelled', (0, 0)), ('Cancelled', (0, 0)), ('Finished', (2, 3))):
+            appointment = Appointment.objects.get(pk=self.appointment.pk)
+            appointment.status = status
+            appointment.save()
+            self._assert_sold(*sold)
+
+        self.gpu_line.delete()
+        self._assert_sold(0, 3)
+        Appointment.objects.filter(pk=self.appointment.pk).delete()
+        self._assert_sold(0, 0)
+
+    def test_deleting_a_cancelled_order_changes_nothing(self):
+        self.appointment.status = 'Cancelled'
+        self.appointment.save()
+        self._assert_sold(0, 0)
+        Product.objects.filter(pk=self.gpu.pk).update(units_sold=5)
+        self.appointment.delete()
+        self.assertEqual(Product.objects.get(pk=self.gpu.pk).units_sold, 5)
+
+
+class AppointmentEventsTests(TestCase):
+    """Calendar events revalidate from a cheap window version; the old URL keeps its list shape."""
+
+    def setUp(self):
+        self.appointment = Appointment.objects.create(
+            first_name='Cal', last_name='Endar', contact='0', email='cal@example.com', date=date(2030, 1, 7), time=time(10),
+        )
+
+    def _get(self, url='/api/appointments/events/', **headers):
+        return self.client.get(url, {'from': '2030-01-01', 'to': '2030-01-31', 'group': 'day'}, secure=True, **headers)
+
+    def test_revalidation_skips_the_body(self):
+        first = self._get()
+        self.assertEqual(first.json()['events'], [{'date': '2030-01-07', 'count': 1}])
+        with self.assertNumQueries(1):
+            self.assertEqual(self._get(HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        self.appointment.time = time(11)
+        self.appointment.save()
+        self.assertNotEqual(self._get(HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        Appointment.objects.create(
+            first_name='Other', last_name='Day', contact='0', email='other@example.com', date=date(2030, 1, 8), time=time(10),
+        )
+        self.assertEqual(self._get().json()['events'], [{'date': '2030-01-07', 'count': 1}, {'date': '2030-01-08', 'count': 1}])
+
+    def test_old_url_keeps_the_list_shape(self):
+        events = self._get('/appointing/json/').json()
+        self.assertEqual(events, [{'product_name': 'Booked', 'start': '2030-01-07T10:00:00'}])
+
+
+class SearchTests(TestCase):
+    """Product search ranks through the full-text index; recommendations expand synonyms."""
+
+    def setUp(self):
+        search.invalidate_synonyms()
+        self.addCleanup(search.invalidate_synonyms)
+
+    def test_name_matches_rank_above_description_matches(self):
+        described = Product.objects.create(product_name='B650 board', description='Pairs well with a Ryzen CPU', price=9000, stock=1)
+        named = Product.objects.create(product_name='Ryzen 5 7600', price=12000, stock=1)
+        Product.objects.create(product_name='Case fan', price=500, stock=1)
+        ranked = search.search_products(Product.objects.all(), 'ryzen').order_by('-search_rank')
+        self.assertEqual([p.pk for p in ranked], [named.pk, described.pk])
+
+    def test_card_alias_only_matches_categories(self):
+        gpu = Product.objects.create(product_name='RTX 4060', price=18000, stock=2, category_name=Category.objects.create(category_name='Video Card'))
+        storage = Category.objects.create(category_name='Storage')
+        tablet = Product.objects.create(product_name='Graphics tablet', price=3000, stock=2, category_name=storage)
+        Product.objects.create(product_name='SD card reader', price=400, stock=2, category_name=storage)
+        self.assertEqual(search.recommend_products(query='gpu'), [gpu, tablet])
+
+    def test_index_failure_does_not_break_the_save(self):
+        def broken_index(product_ids):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT * FROM missing_search_table')
+
+        with mock.patch.object(search, 'index_products', side_effect=broken_index):
+            with transaction.atomic():
+                product = Product.objects.create(product_name='Unindexed', price=1, stock=1)
+                self.assertEqual(Product.objects.filter(pk=product.pk).count(), 1)
+        self.assertTrue(Product.objects.filter(pk=product.pk).exists())
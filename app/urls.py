@@ -1,7 +1,7 @@
 from django.urls import path
 from .views import HomePage, ProductPage, ProductItemPage, AIBotPage, CheckoutPage, AppointmentCompletePage, SellingPage, SellingCompletePage, SellingInfoPage, MyAppointmentPage, MySellingAppointmentPage, MyCancelledAppointmentPage, MyHistoryAppointmentPage, CartPage, FavoritePage, add_to_cart, AdminDashboard, AdminInventory, AdminProduct, AdminAppointment, AdminSellingAppointment
 from . import views
-from .api_views import api_product_3d_model, api_search_products_with_3d, api_gemini_system_prompt, api_products_recommend, api_available_categories, api_store_info, api_save_chat_conversation, api_load_chat_conversation, api_delete_chat_conversation, firebase_signup_verify, api_serve_3d_model
+from .api_views import api_product_3d_model, api_search_products_with_3d, api_gemini_system_prompt, api_products_recommend, api_available_categories, api_store_info, api_save_chat_conversation, api_append_chat_messages, api_stream_chat, api_load_chat_conversation, api_delete_chat_conversation, firebase_signup_verify, api_serve_3d_model
 from django.contrib.auth import views as auth_views
 
 urlpatterns = [
@@ -15,6 +15,7 @@ urlpatterns = [
     path('get-available-times/', views.get_available_times, name='get_available_times'),
     path('get-booked-dates/', views.get_booked_dates, name='get_booked_dates'),
     path('appointing/json/', views.appointing, name='appointing'),
+    path('api/appointments/events/', views.appointment_events, name='appointment_events'),
     path('checkout', CheckoutPage.as_view(), name='checkout'),
     path('appointment_complete', AppointmentCompletePage.as_view(), name='appointment_complete'),
     path('selling', SellingPage.as_view(), name='selling'),
@@ -33,6 +34,9 @@ urlpatterns = [
     path('favorite', FavoritePage.as_view(), name='favorite'),
     path('toggle_favorite/<int:product_id>/', views.toggle_favorite, name='toggle_favorite'),
     path('admin_dashboard/', AdminDashboard.as_view(), name='admin_dashboard'),
+    path('api/admin/analytics/', views.admin_analytics, name='admin_analytics'),
+    path('api/admin/cache-stats/', views.admin_cache_stats, name='admin_cache_stats'),
+    path('api/admin/chat-stats/', views.admin_chat_stats, name='admin_chat_stats'),
     path('admin_inventory/', AdminInventory.as_view(), name='admin_inventory'),
     path('admin_product/', AdminProduct.as_view(), name='admin_product'),
     path('add_product/', views.add_product_ajax, name='add_product'),
@@ -64,6 +68,8 @@ urlpatterns = [
     path('api/categories/', api_available_categories, name='api_available_categories'),
     path('api/store-info/', api_store_info, name='api_store_info'),
     path('api/chat/save/', api_save_chat_conversation, name='api_save_chat'),
+    path('api/chat/append/', api_append_chat_messages, name='api_append_chat'),
+    path('api/chat/stream/', api_stream_chat, name='api_stream_chat'),
     path('api/chat/load/', api_load_chat_conversation, name='api_load_chat'),
     path('api/chat/delete/', api_delete_chat_conversation, name='api_delete_chat'),
     path('api/products/<component>/', views.product_list, name='product_list'),
@@ -1,5 +1,11 @@
 from django.core.exceptions import ValidationError
 from django.conf import settings
+from django.db.models import F, Q
+from datetime import datetime, date
+from decimal import Decimal
+import base64
+import binascii
+import json
 
 COMPONENT_TO_GLB = {
     "cpu": "cpu.glb",
@@ -81,3 +87,83 @@ def validate_image_file(file, max_size_mb=10):
         )
     
     return True
+
+
+def _cursor_default(value):
+    # Full precision so the cursor compares equal to the stored value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot encode {type(value).__name__} in a page cursor")
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=_cursor_default, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Return the list of sort values in ``cursor``, or None when it is missing or invalid."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def _after_cursor(ordering, values):
+    """
+    Q matching rows that sort after ``values`` in ``ordering`` (NULLs sorting last).
+    """
+    condition = Q()
+    equal_so_far = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        if value is None:
+            # Only other NULLs can follow a NULL
+            beyond = Q(pk__in=[])
+            equal = Q(**{f'{name}__isnull': True})
+        else:
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            beyond = Q(**{f'{name}__{lookup}': value}) | Q(**{f'{name}__isnull': True})
+            equal = Q(**{name: value})
+        condition |= equal_so_far & beyond
+        equal_so_far &= equal
+    return condition
+
+
+def keyset_paginate(queryset, ordering, cursor=None, per_page=48):
+    """
+    Return (items, next_cursor) for one page of ``queryset``.
+
+    ``ordering`` lists field or annotation names ('-' prefix for descending);
+    its last entry must be unique, normally 'id'. ``cursor`` is the value
+    returned for the previous page; a missing or tampered one gives the
+    first page. Each page is a plain indexed range scan,
+    so it costs the same no matter how deep into the results it is.
+    """
+    order_by = [
+        F(field[1:]).desc(nulls_last=True) if field.startswith('-') else F(field).asc(nulls_last=True)
+        for field in ordering
+    ]
+    queryset = queryset.order_by(*order_by)
+    values = decode_cursor(cursor, len(ordering))
+    if values is not None:
+        try:
+            queryset = queryset.filter(_after_cursor(ordering, values))
+        except (ValidationError, ValueError, TypeError):
+            # Values that do not fit the sort fields: serve the first page
+            pass
+
+    items = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+    return items, next_cursor
@@ -18,8 +18,16 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.sites.shortcuts import get_current_site
 from django.template.loader import render_to_string
-from django.core.mail import send_mail
-from .email_utils import send_email
+from .outbox import queue_email
+from .search import search_products
+from .utils import keyset_paginate
+from .sales import record_appointment_sales, top_seller_threshold
+from .catalog import get_facets, brands_for_category, all_categories, latest_products
+from .cart import ShoppingCart, product_cart_key, variation_cart_key
+from .inventory import reserve_stock, StockShortfall
+from . import analytics, llm
+from .caching import stats as cache_stats
+from .booking import available_times, is_available, unavailable_dates, SlotUnavailable, MAX_WINDOW_DAYS
 from django.core.exceptions import ValidationError
 import logging
 
@@ -27,25 +35,24 @@ logger = logging.getLogger(__name__)
 
 from django.utils import timezone
 from django.utils.http import urlsafe_base64_decode
+from django.utils.cache import get_conditional_response
 from django.utils.encoding import force_str
 from django.utils.decorators import method_decorator
-from django.db.models import Q, Count, Sum, F
-from django.db import models
+from django.db.models import Q, Count, Sum, F, Max, Prefetch
+from django.db import models, transaction
 from django.conf import settings
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 import json
-import os, json
+import json
 import random
 import urllib.parse
+import hashlib
+from decimal import Decimal, InvalidOperation
 
 def filter_products_with_valid_images(products_queryset):
-    """Filter products to only include those with valid image files"""
-    valid_products = []
-    for p in products_queryset:
-        if p.has_valid_image():
-            valid_products.append(p)
-    return valid_products
+    """Filter products to only include those with valid image files (must be applied before slicing)"""
+    return products_queryset.filter(has_image=True)
 
 def product_list(request):
     component = request.GET.get('component')
@@ -710,26 +717,28 @@ def register(request):
                     messages.error(request, "❌ Email already registered.")
                     return redirect("register")
                 
-                # Create user but mark as INACTIVE until OTP is verified
-                user = form.save(commit=False)
-                user.is_active = False  # NOT ACTIVE UNTIL OTP VERIFIED
-                user.set_password(password)
-                user.save()
-                logger.info(f"User created: {username}")
-                
-                # Delete any old OTP tokens for this user (in case of retries)
-                OtpToken.objects.filter(user=user).delete()
-                
-                # Generate and send OTP (only one)
-                otp = OtpToken.objects.create(
-                    user=user,
-                    otp_expires_at=timezone.now() + timezone.timedelta(minutes=5)
-                )
-                logger.info(f"OTP created: {otp.otp_code}")
-                
-                # Send OTP email
-                subject = "Email Verification Code - Koya Nardz Shop"
-                message = f"""
+                # Create the inactive user, its OTP and the OTP email together
+                with transaction.atomic():
+                    # Create user but mark as INACTIVE until OTP is verified
+                    user = form.save(commit=False)
+                    user.is_active = False  # NOT ACTIVE UNTIL OTP VERIFIED
+                    user.set_password(password)
+                    user.save()
+                    logger.info(f"User created: {username}")
+
+                    # Delete any old OTP tokens for this user (in case of retries)
+                    OtpToken.objects.filter(user=user).delete()
+
+                    # Generate and send OTP (only one)
+                    otp = OtpToken.objects.create(
+                        user=user,
+                        otp_expires_at=timezone.now() + timezone.timedelta(minutes=5)
+                    )
+                    logger.info(f"OTP created: {otp.otp_code}")
+
+                    # Send OTP email
+                    subject = "Email Verification Code - Koya Nardz Shop"
+                    message = f"""
 Dear {username},
 
 Your OTP verification code is:
@@ -741,30 +750,21 @@ If you didn't create this account, please ignore this email.
 
 Best regards,
 Koya Nardz Shop Team
-                """
-                
-                try:
-                    logger.info(f"Attempting to send OTP email to {email}")
-                    send_mail(
+                    """
+                    queue_email(
                         subject,
-                        message,
-                        settings.DEFAULT_FROM_EMAIL,
                         [email],
-                        fail_silently=False,
+                        text=message,
+                        from_email=settings.DEFAULT_FROM_EMAIL,
+                        idempotency_key=f"otp:{otp.pk}",
                     )
-                    logger.info(f"OTP email sent successfully to {email}")
-                    otp_code = otp.otp_code
-                    # Set session flag to indicate fresh OTP was just sent
-                    request.session['fresh_otp_timestamp'] = timezone.now().timestamp()
-                    request.session['fresh_otp_user'] = username
-                    messages.success(request, "✉ Verification code sent! Check your email.")
-                except Exception as e:
-                    logger.exception(f"Failed to send OTP email to {email}: {str(e)}")
-                    # Delete the user if email fails
-                    user.delete()
-                    # Don't expose technical error details to user
-                    messages.error(request, "❌ Failed to send verification email. Please try again later or contact support.")
-                    return redirect("register")
+
+                logger.info(f"OTP email queued for {email}")
+                otp_code = otp.otp_code
+                # Set session flag to indicate fresh OTP was just sent
+                request.session['fresh_otp_timestamp'] = timezone.now().timestamp()
+                request.session['fresh_otp_user'] = username
+                messages.success(request, "✉ Verification code sent! Check your email.")
 
     context = {
         "form": form,
@@ -860,15 +860,16 @@ def resend_otp(request):
         
         # Create new OTP
         logger.info(f"Creating new OTP for user: {user.username}")
-        otp = OtpToken.objects.create(
-            user=user, 
-            otp_expires_at=timezone.now() + timezone.timedelta(minutes=5),
-            last_resend_at=timezone.now()
-        )
-        logger.info(f"New OTP created: {otp.otp_code}")
+        with transaction.atomic():
+            otp = OtpToken.objects.create(
+                user=user, 
+                otp_expires_at=timezone.now() + timezone.timedelta(minutes=5),
+                last_resend_at=timezone.now()
+            )
+            logger.info(f"New OTP created: {otp.otp_code}")
 
-        subject = "Email Verification Code - Koya Nardz Shop"
-        message = f"""
+            subject = "Email Verification Code - Koya Nardz Shop"
+            message = f"""
 Dear {user.username},
 
 Your OTP verification code is:
@@ -880,21 +881,16 @@ If you didn't request this, please ignore this email.
 
 Best regards,
 Koya Nardz Shop Team
-        """
-        
-        try:
-            send_mail(
+            """
+            queue_email(
                 subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
                 [user.email],
-                fail_silently=False,
+                text=message,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                idempotency_key=f"otp:{otp.pk}",
             )
-            logger.info(f"OTP email sent successfully to {user.email}")
-            messages.success(request, "✉ New code sent! Check your email.")
-        except Exception as e:
-            logger.exception(f"Failed to send OTP email to {user.email}: {str(e)}")
-            messages.error(request, "❌ Failed to send email. Please try again.")
+        logger.info(f"OTP email queued for {user.email}")
+        messages.success(request, "✉ New code sent! Check your email.")
         
         # After resending, go back to the OTP verification view with the new code
         form = RegisterForm(instance=user)
@@ -1002,13 +998,13 @@ def forgot_password(request):
                     </html>
                     """
                     
-                    send_mail(
+                    queue_email(
                         subject,
-                        f"Click the link to reset your password: {reset_url}",
-                        settings.DEFAULT_FROM_EMAIL,
                         [email],
-                        html_message=html_message,
-                        fail_silently=True,
+                        text=f"Click the link to reset your password: {reset_url}",
+                        html=html_message,
+                        from_email=settings.DEFAULT_FROM_EMAIL,
+                        idempotency_key=f"password-reset:{uid}:{token}",
                     )
                 messages.success(request, "Password reset link has been sent to your email. Please check your inbox and spam folder.")
                 return redirect('login')
@@ -1148,35 +1144,29 @@ def logout_view(request):
 @csrf_exempt
 @require_POST
 def add_pc_build_to_cart(request):
+    """
+    Add a whole build to the cart in one batch. Body: {"parts": [{"id": 5, "quantity": 1,
+    "variant_id": 2 (optional)}, ...]}. Unknown or malformed parts reject the whole
+    build (400) without touching the cart; quantities are clamped to stock per line.
+    """
     try:
         data = json.loads(request.body)
         parts = data.get('parts', [])
+        if not isinstance(parts, list):
+            return JsonResponse({'error': 'parts must be a list'}, status=400)
 
-        cart = request.session.get('cart', {})
-
-        for part in parts:
-            product_id = str(part['id'])
-            quantity = part.get('quantity', 1)
-
-            produkto = Product.objects.get(pk=product_id)
-
-            if product_id in cart:
-                cart[product_id]['quantity'] += quantity
-                if cart[product_id]['quantity'] > produkto.stock:
-                    cart[product_id]['quantity'] = produkto.stock
-            else:
-                cart[product_id] = {
-                    'image': produkto.image.url if produkto.image else None,
-                    'product_name': produkto.product_name,
-                    'price': float(produkto.price),
-                    'quantity': min(quantity, produkto.stock),
-                }
-
-        request.session['cart'] = cart
+        cart = ShoppingCart(request)
+        ok, report = cart.add_many(parts)
+        if not ok:
+            return JsonResponse({
+                'error': 'Some parts could not be added; nothing was added to the cart.',
+                'lines': report,
+            }, status=400)
 
         return JsonResponse({
             'message': 'PC Build added to cart!',
-            'cart_count': sum(item['quantity'] for item in cart.values())
+            'cart_count': cart.count(),
+            'lines': report,
         })
 
     except Exception as e:
@@ -1194,44 +1184,16 @@ def add_to_cart(request, product_id):
             quantity = int(request.POST.get('quantity', 1))
             variant_id = request.POST.get("variant_id")
 
-        cart = request.session.get('cart', {})
+        cart = ShoppingCart(request)
         if variant_id:
-            variant = get_object_or_404(ProductVariation, pk=variant_id)
-            cart_key = f"variant-{variant_id}"
-
-            if cart_key in cart:
-                cart[cart_key]["quantity"] += quantity
-                if cart[cart_key]["quantity"] > variant.stock:
-                    cart[cart_key]["quantity"] = variant.stock
-            else:
-                cart[cart_key] = {
-                    "image": variant.image.url if variant.image else None,
-                    "product_name": f"{variant.product.product_name} ({variant.product_variation})",
-                    "price": float(variant.price),
-                    "quantity": min(quantity, variant.stock),
-                    "variant_id": variant_id,
-                    "product_id": product_id,
-                }
+            variant = get_object_or_404(ProductVariation.objects.select_related('product'), pk=variant_id)
+            cart.add(variant.product, quantity, variant)
         else:
             produkto = get_object_or_404(Product, pk=product_id)
-
-            if str(product_id) in cart:
-                cart[str(product_id)]['quantity'] += quantity
-                if cart[str(product_id)]['quantity'] > produkto.stock:
-                    cart[str(product_id)]['quantity'] = produkto.stock
-            else:
-                cart[str(product_id)] = {
-                    'image': produkto.image.url if produkto.image else None,
-                    'product_name': produkto.product_name,
-                    'price': float(produkto.price),
-                    'quantity': min(quantity, produkto.stock),
-                    "product_id": product_id,
-                }
-
-        request.session['cart'] = cart
+            cart.add(produkto, quantity)
 
         if request.content_type == 'application/json':
-            return JsonResponse({'message': 'Product added successfully!', 'cart_count': sum(item['quantity'] for item in cart.values())})
+            return JsonResponse({'message': 'Product added successfully!', 'cart_count': cart.count()})
         return redirect('cart')
 
     except Exception as e:
@@ -1239,81 +1201,40 @@ def add_to_cart(request, product_id):
 
 def update_cart(request, product_id):
     if request.method == 'POST':
-        cart = request.session.get('cart', {})
-        # Prefer an explicit cart_key sent by the form (this will be the
-        # session dict key, e.g. 'variant-6' or '6'). Fall back to using
-        # the numeric product_id from the URL.
+        cart = ShoppingCart(request)
+        # Prefer an explicit cart_key sent by the form (e.g. 'variant-6' or '6').
+        # Fall back to the numeric id from the URL, as a product or a variation.
         posted_cart_key = request.POST.get('cart_key')
-
         if posted_cart_key:
-            # Use posted key directly
             cart_key = str(posted_cart_key)
-            if cart_key in cart:
-                item = cart[cart_key]
-                # Determine stock depending on whether this is a variant
-                if cart_key.startswith('variant-'):
-                    variant = get_object_or_404(ProductVariation, pk=item.get('variant_id'))
-                    stock = variant.stock
-                else:
-                    stock = get_object_or_404(Product, pk=item.get('product_id')).stock
-            else:
-                return redirect(request.META.get('HTTP_REFERER', 'cart'))
+        elif cart.get_line(product_cart_key(product_id)):
+            cart_key = product_cart_key(product_id)
         else:
-            cart_key = str(product_id)
-            variant_key = f"variant-{product_id}"
-
-            if cart_key in cart:
-                item = cart[cart_key]
-                stock = get_object_or_404(Product, pk=product_id).stock
-            elif variant_key in cart:
-                item = cart[variant_key]
-                variant = get_object_or_404(ProductVariation, pk=item["variant_id"])
-                stock = variant.stock
-                cart_key = variant_key
-            else:
-                return redirect(request.META.get('HTTP_REFERER', 'cart'))
+            cart_key = variation_cart_key(product_id)
 
         action = request.POST.get('action')
-        current_quantity = item['quantity']
-
-        if action == 'increase':
-            if current_quantity < stock:
-                item['quantity'] += 1
-        elif action == 'decrease':
-            if current_quantity > 1:
-                item['quantity'] -= 1
-        else:
-            quantity = int(request.POST.get('quantity', 1))
-            item['quantity'] = max(1, min(quantity, stock))
-        
-        cart[cart_key] = item
-        request.session['cart'] = cart
+        try:
+            cart.update(cart_key, action=action, quantity=request.POST.get('quantity', 1))
+        except (TypeError, ValueError):
+            pass
     return redirect(request.META.get('HTTP_REFERER', 'cart'))
 
 def remove_from_cart(request, product_id):
     if request.method == 'POST':
-        cart = request.session.get('cart', {})
+        cart = ShoppingCart(request)
         # Allow an explicit cart_key to be sent (handles keys like 'variant-6')
         posted_cart_key = request.POST.get('cart_key')
         if posted_cart_key:
-            key = str(posted_cart_key)
-            if key in cart:
-                del cart[key]
+            cart.remove(posted_cart_key)
+        elif cart.get_line(product_cart_key(product_id)):
+            cart.remove(product_cart_key(product_id))
         else:
-            cart_key = str(product_id)
-            variant_key = f"variant-{product_id}"
-
-            if cart_key in cart:
-                del cart[cart_key]
-            elif variant_key in cart:
-                del cart[variant_key]
-
-        request.session['cart'] = cart
+            cart.remove(variation_cart_key(product_id))
     return redirect(request.META.get('HTTP_REFERER', 'cart'))
 
 def get_cart_data(request):
-    cart = request.session.get('cart', {})
-    return JsonResponse({'cart_products': list(cart.values())})
+    cart = ShoppingCart(request)
+    return JsonResponse({'cart_products': [line.as_dict() for line in cart.lines()]})
 
 def direct_checkout(request):
     if request.method == "POST":
@@ -1499,10 +1420,10 @@ def appoint(request):
         form = AppointmentForm(request.POST)
         if form.is_valid():
             selected_date = form.cleaned_data['date']
-            count = Appointment.objects.filter(date=selected_date).count()
+            selected_time = time.fromisoformat(form.cleaned_data['time'])
 
-            if count >= 10:
-                form.add_error('date', 'Maximum appointments reached for this date.')
+            if not is_available(selected_date, selected_time):
+                form.add_error('date', 'This date and time is no longer available.')
             else:
                 request.session['appointment_data'] = {
                     'first_name': form.cleaned_data['first_name'],
@@ -1523,13 +1444,6 @@ def appoint(request):
         }
         form = AppointmentForm(initial=initial_data)
 
-    appointments = Appointment.objects.all()
-    events = [{
-            'title': f"{appoint.first_name} {appoint.last_name}",  
-            'start': appoint.date.strftime('%Y-%m-%d'),
-            'color': 'green'
-        }for appoint in appointments]
-
     # Get product information from direct_checkout session if available
     direct_checkout = request.session.get('direct_checkout')
     product_info = None
@@ -1549,43 +1463,136 @@ def appoint(request):
 
     return render(request, 'app/buying/appointment.html', {
         'form': form,
-        'events': json.dumps(events),
         'product_info': product_info,
         'direct_checkout': direct_checkout
     })
 
-def appointing(request):
-    appointments = Appointment.objects.all()
-    events = [{
-        'product_name': f"{a.first_name} {a.last_name}",
-        'start': f"{a.date}T{a.time}",
-    } for a in appointments]
-    return JsonResponse(events, safe=False)
-
 def get_available_times(request):
-    selected_date = request.GET.get('date')
-    
-    all_slots = [
-        "10:00", "11:00", "12:00", "13:00",
-        "14:00", "15:00", "16:00", "17:00"
-    ]
-
-    booked = Appointment.objects.filter(date=selected_date).values_list('time', flat=True)
-    booked_times = [t.strftime("%H:%M") for t in booked]
-    free_slots = [t for t in all_slots if t not in booked_times]
+    try:
+        selected_date = date.fromisoformat(request.GET.get('date', ''))
+    except ValueError:
+        return JsonResponse({'error': 'date must be YYYY-MM-DD'}, status=400)
 
+    free_slots = [t.strftime("%H:%M") for t in available_times(selected_date)]
     return JsonResponse({'available_times': free_slots})
 
+def _date_window(request, default_days):
+    """
+    (start, end) from ?from=YYYY-MM-DD&to=YYYY-MM-DD, defaulting to the start
+    of this month plus ``default_days`` and capped at MAX_WINDOW_DAYS.
+    Raises ValueError with a message for the client.
+    """
+    try:
+        start = date.fromisoformat(request.GET['from']) if request.GET.get('from') else timezone.localdate().replace(day=1)
+        end = date.fromisoformat(request.GET['to']) if request.GET.get('to') else start + timedelta(days=default_days)
+    except ValueError:
+        raise ValueError('from and to must be YYYY-MM-DD')
+    if end < start:
+        raise ValueError('to must not be before from')
+    return start, min(end, start + timedelta(days=MAX_WINDOW_DAYS))
+
 def get_booked_dates(request):
-    appointments = Appointment.objects.values('date').annotate(count=models.Count('id'))
+    """
+    Unbookable dates in ?from=YYYY-MM-DD&to=YYYY-MM-DD (default: this month
+    and the next two). blocked_dates are fully booked, closed_dates are
+    blackout days and closed weekdays.
+    """
+    try:
+        start, end = _date_window(request, default_days=92)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-    fully_booked = [
-        a['date'].strftime('%Y-%m-%d')
-        for a in appointments
-        if a['count'] >= 10
-    ]
+    full, closed = unavailable_dates(start, end)
+    return JsonResponse({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'blocked_dates': [d.isoformat() for d in full],
+        'closed_dates': [d.isoformat() for d in closed],
+    })
 
-    return JsonResponse({'blocked_dates': fully_booked})
+def _events_version(window, *parts):
+    """
+    ETag for a window of appointments from its row count and newest
+    updated_at, so an unchanged window revalidates without building the body.
+    """
+    version = window.aggregate(count=Count('id'), changed=Max('updated_at'))
+    fingerprint = repr((parts, version['count'], version['changed']))
+    return '"%s"' % hashlib.md5(fingerprint.encode('utf-8')).hexdigest()
+
+def _events_response(request, etag, build):
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(json.dumps(build()), content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Cookie'
+    return response
+
+@require_http_methods(["GET"])
+def appointment_events(request):
+    """
+    Booked appointments between ?from and ?to (default: this month) for calendars.
+
+    ?group=day gives per-day counts (month views), the default ?group=slot
+    per-slot counts (week/day views). Staff can ask for ?group=appointment
+    to get individual appointments with names; nobody else sees who booked.
+    Cancelled appointments are left out of the counts. Responses carry an
+    ETag taken from the window's count and last change, so an unchanged
+    window revalidates with a 304 without reading the appointments.
+    """
+    try:
+        start, end = _date_window(request, default_days=31)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    group = request.GET.get('group', 'slot')
+    if group not in ('day', 'slot') and not (group == 'appointment' and request.user.is_staff):
+        return JsonResponse({'error': 'group must be day or slot'}, status=400)
+    window = Appointment.objects.filter(date__range=(start, end))
+
+    def build():
+        if group == 'day':
+            rows = window.exclude(status='Cancelled').values('date').annotate(count=Count('id')).order_by('date')
+            events = [{'date': row['date'].isoformat(), 'count': row['count']} for row in rows]
+        elif group == 'slot':
+            rows = window.exclude(status='Cancelled').values('date', 'time').annotate(count=Count('id')).order_by('date', 'time')
+            events = [{'start': f"{row['date']:%Y-%m-%d}T{row['time']:%H:%M}", 'count': row['count']} for row in rows]
+        else:
+            rows = window.order_by('date', 'time').values(
+                'id', 'first_name', 'last_name', 'date', 'time', 'status', 'reference_number',
+            )
+            events = [{
+                'id': row['id'],
+                'title': f"{row['first_name']} {row['last_name']}",
+                'start': f"{row['date']:%Y-%m-%d}T{row['time']:%H:%M}",
+                'status': row['status'],
+                'reference_number': row['reference_number'],
+            } for row in rows]
+        return {'from': start.isoformat(), 'to': end.isoformat(), 'group': group, 'events': events}
+
+    return _events_response(request, _events_version(window, 'events', group, start, end), build)
+
+@require_http_methods(["GET"])
+def appointing(request):
+    """
+    The original appointing/json/ list of {'product_name', 'start'}, limited
+    to ?from and ?to (default: this month). Only staff see who booked.
+    """
+    try:
+        start, end = _date_window(request, default_days=31)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    window = Appointment.objects.filter(date__range=(start, end))
+    staff = request.user.is_staff
+
+    def build():
+        return [{
+            'product_name': f"{row['first_name']} {row['last_name']}" if staff else 'Booked',
+            'start': f"{row['date']}T{row['time']}",
+        } for row in window.order_by('date', 'time').values('first_name', 'last_name', 'date', 'time')]
+
+    return _events_response(request, _events_version(window, 'appointing', staff, start, end), build)
 
 def get_appointment_counts(user):
     if not user.is_authenticated:
@@ -1616,7 +1623,12 @@ def get_appointment_counts(user):
 def finished_appointment(request, appointment_id):
     appointment = get_object_or_404(Appointment, id=appointment_id)
     appointment.status = 'Finished'
-    appointment.save()
+    try:
+        # A cancelled appointment takes its slot back when it is finished
+        appointment.save()
+    except SlotUnavailable as e:
+        messages.error(request, f"Could not mark as Finished: {e}")
+        return redirect('admin_appointment')
     messages.success(request, "Marked as Finished")
     return redirect('admin_appointment')
 
@@ -1626,21 +1638,21 @@ def cancel_appointment(request, appointment_id):
 
     if request.method == "POST":
         reason = request.POST.get("cancel_reason", "")
-        appointment.status = "Cancelled"
-        appointment.cancel_reason = reason
-        appointment.save()
-
-        try:
-            send_mail(
-                subject='Your Appointment Has Been Cancelled',
-                message=f"Hello {appointment.first_name},\n\nYour appointment (Ref: {appointment.reference_number}) has been cancelled.\n\nReason: {reason}\n\nThank you.",
-                from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[appointment.email],
-                fail_silently=False,
-            )
-        except Exception as e:
-            logger = logging.getLogger(__name__)
-            logger.exception(f"Failed to send cancellation email for appointment {appointment.id}")
+        with transaction.atomic():
+            appointment = Appointment.objects.select_for_update().get(pk=appointment.pk)
+            was_cancelled = appointment.status == "Cancelled"
+            appointment.status = "Cancelled"
+            appointment.cancel_reason = reason
+            appointment.save()
+            # Saving the status took the sale off the counters; only email the first time
+            if not was_cancelled:
+                queue_email(
+                    'Your Appointment Has Been Cancelled',
+                    [appointment.email],
+                    text=f"Hello {appointment.first_name},\n\nYour appointment (Ref: {appointment.reference_number}) has been cancelled.\n\nReason: {reason}\n\nThank you.",
+                    from_email=settings.EMAIL_HOST_USER,
+                    idempotency_key=f"appointment-cancelled:{appointment.pk}",
+                )
 
         return JsonResponse({"success": True})
     return JsonResponse({"success": False}, status=400)
@@ -1651,21 +1663,17 @@ def cancel_trade(request, selling_id):
 
     if request.method == "POST":
         reason = request.POST.get("cancel_reason", "")
-        selling.status = "Cancelled"
-        selling.cancel_reason = reason
-        selling.save()
-
-        try:
-            send_mail(
-                subject='Your Trade Has Been Cancelled',
-                message=f"Hello {selling.first_name},\n\nYour appointment for trade (Ref: {selling.reference_number}) has been cancelled.\n\nReason: {reason}\n\nThank you.",
+        with transaction.atomic():
+            selling.status = "Cancelled"
+            selling.cancel_reason = reason
+            selling.save()
+            queue_email(
+                'Your Trade Has Been Cancelled',
+                [selling.email],
+                text=f"Hello {selling.first_name},\n\nYour appointment for trade (Ref: {selling.reference_number}) has been cancelled.\n\nReason: {reason}\n\nThank you.",
                 from_email=settings.EMAIL_HOST_USER,
-                recipient_list=[selling.email],
-                fail_silently=False,
+                idempotency_key=f"trade-cancelled:{selling.pk}",
             )
-        except Exception as e:
-            logger = logging.getLogger(__name__)
-            logger.exception(f"Failed to send trade cancellation email for selling {selling.id}")
 
         return JsonResponse({"success": True})
     return JsonResponse({"success": False}, status=400)
@@ -1687,20 +1695,9 @@ class HomePage(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
-        # Only get products with valid image files
-        products = Product.objects.exclude(image='').exclude(image__isnull=True).order_by('-created_at')[:5]
-        # Filter to only include products where the image file actually exists
-        valid_products = []
-        for p in products:
-            try:
-                # Try to access the image URL to ensure file exists
-                if p.image and p.image.url:
-                    valid_products.append(p)
-            except (ValueError, AttributeError):
-                # Skip products where image file doesn't exist
-                pass
-        context['products'] = valid_products
+        context['categories'] = all_categories()
+        # Only products with valid image files, cached until the catalog changes
+        context['products'] = latest_products(5)
         return context
 
 class ProductPage(TemplateView):
@@ -1723,11 +1720,25 @@ class ProductPage(TemplateView):
     "monitor": "monitor.gbl",
     "storage": "storage.gbl",
 }
+
+    paginate_by = 48
+
+    # Keyset sort key for each price_order option; the trailing id keeps it unique
+    SORT_KEYS = {
+        'high': ('-price', '-id'),
+        'low': ('price', 'id'),
+        'newest': ('-created_at', '-id'),
+        'oldest': ('created_at', 'id'),
+        'most_buy': ('-units_sold', '-id'),
+    }
+    # Best matches first; search_rank only exists when there is a search term
+    RELEVANCE_SORT_KEY = ('-search_rank', '-id')
     
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
+        facets = get_facets()
+        context['categories'] = facets['categories']
     
         search_query = self.request.GET.get('search', '').strip()
         category_filter = self.request.GET.get('category', '').strip()
@@ -1739,37 +1750,17 @@ class ProductPage(TemplateView):
         products = Product.objects.all()
 
         if search_query:
-            products = products.filter(
-                Q(category_name__category_name__icontains=search_query) |
-                Q(brand__brand__icontains=search_query) |
-                Q(product_name__icontains=search_query) 
-            )
+            products = search_products(products, search_query)
 
-        # Convert category_filter to integer if it exists
+        # Brands come from the cached facets, already sorted with "Others" at the end
+        brands = facets['brands']
         if category_filter:
             try:
                 category_id = int(category_filter)
                 products = products.filter(category_name__id=category_id)
-                brands = Brand.objects.filter(product__category_name__id=category_id).distinct().order_by('brand')
+                brands = brands_for_category(facets, category_id)
             except (ValueError, TypeError):
-                brands = Brand.objects.annotate(product_count=Count('product')).order_by('brand')
-        else:
-            brands = Brand.objects.annotate(product_count=Count('product')).order_by('brand')
-        
-        # Sort brands alphabetically with "Others" at the end
-        brands_list = list(brands)
-        others_brand = None
-        regular_brands = []
-        for brand in brands_list:
-            if brand.brand.lower() == 'others':
-                others_brand = brand
-            else:
-                regular_brands.append(brand)
-        
-        if others_brand:
-            brands = regular_brands + [others_brand]
-        else:
-            brands = regular_brands
+                pass
         
         # Convert brand_filter to integer if it exists
         if brand_filter:
@@ -1792,36 +1783,41 @@ class ProductPage(TemplateView):
             if condition_q:
                 products = products.filter(condition_q)
 
-        # Always annotate total_bought for all products to show best seller tag
-        products = products.annotate(
-            total_bought=Sum('appointmentproduct__quantity')
-        )
+        # Best seller tag and "most purchased" both mean the top 20% by units sold
+        best_seller_threshold = top_seller_threshold()
+        context['best_seller_threshold'] = best_seller_threshold
 
         # Filter by popularity (most purchased)
         if 'most_purchased' in popularity_filters:
-            # Get top 20% best-selling products
-            from django.db.models import Q as DjangoQ
-            products = products.filter(total_bought__gt=0).order_by('-total_bought')[:int(len(products) * 0.2) or 1]
-            products = Product.objects.filter(pk__in=[p.pk for p in products]).annotate(
-                total_bought=Sum('appointmentproduct__quantity')
-            )
+            if best_seller_threshold is None:
+                products = products.none()
+            else:
+                products = products.filter(units_sold__gte=best_seller_threshold)
 
-        if price_order == 'high':
-            products = products.order_by('-price')
-        elif price_order == 'low':
-            products = products.order_by('price')
-        elif price_order == 'newest':
-            products = products.order_by('-created_at')
-        elif price_order == 'oldest':
-            products = products.order_by('created_at')
-        elif price_order == 'most_buy':
-            products = products.order_by('-total_bought')
+        if price_order in self.SORT_KEYS:
+            ordering = self.SORT_KEYS[price_order]
+        elif search_query and 'most_purchased' not in popularity_filters:
+            # Best matches first when searching without an explicit sort
+            ordering = self.RELEVANCE_SORT_KEY
         else:
-            products = products.order_by('-created_at')
-        
-        # Filter to only include products with valid images
-        valid_products = filter_products_with_valid_images(products)
-        
+            ordering = self.SORT_KEYS['newest']
+
+        # Filter to only include products with valid images, one page at a time
+        cursor = self.request.GET.get('cursor', '').strip()
+        valid_products, next_cursor = keyset_paginate(
+            filter_products_with_valid_images(products).select_related('category_name').prefetch_related('reviews'),
+            ordering, cursor, self.paginate_by
+        )
+
+        if next_cursor:
+            next_params = self.request.GET.copy()
+            next_params['cursor'] = next_cursor
+            context['next_page_query'] = next_params.urlencode()
+        if cursor:
+            first_params = self.request.GET.copy()
+            first_params.pop('cursor', None)
+            context['first_page_query'] = first_params.urlencode()
+
         context.update({
             'products': valid_products,
             'brands': brands,
@@ -1830,8 +1826,6 @@ class ProductPage(TemplateView):
             'brand_filter': brand_filter,
         })
         context['price_order'] = price_order
-        # Add Gemini API key to context
-        context['gemini_api_key'] = os.getenv('GEMINI_API_KEY', '')
         return context
 
 class ProductItemPage(TemplateView):
@@ -1866,8 +1860,8 @@ class ProductItemPage(TemplateView):
             context["images"] = [img.product_image.url for img in produkto.images.all()]
         
         # Filter to only include products with valid images
-        related_products = Product.objects.exclude(id=produkto.id).order_by('-created_at')[:30]
-        context["products"] = filter_products_with_valid_images(related_products)
+        # The latest products (cached for every product page) minus this one
+        context["products"] = [p for p in latest_products(31) if p.pk != produkto.pk][:30]
 
         reviews = produkto.reviews.all().order_by("-created_at")
         context["reviews"] = reviews
@@ -1976,18 +1970,9 @@ class CheckoutPage(TemplateView):
             context['is_direct'] = True
             return context
         
-        cart = self.request.session.get('cart', {})
-            
-        for product_id, produkto in cart.items():
-            produkto['sub_total'] = float(produkto['price']) * int(produkto['quantity'])
-            # Preserve numeric product_id stored when item was added to cart
-            # (don't overwrite it with the session key which may be 'variant-6')
-            if 'product_id' not in produkto:
-                produkto['product_id'] = product_id
-            produkto['cart_key'] = product_id
-
-        context['cart_products'] = cart.values()
-        context['total_price'] = sum(item['sub_total'] for item in cart.values())
+        cart = ShoppingCart(self.request)
+        context['cart_products'] = cart.lines()
+        context['total_price'] = cart.total_price()
         context['is_direct'] = False
         return context
 
@@ -1996,9 +1981,8 @@ class AppointmentCompletePage(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
-        all_products = Product.objects.all().order_by('-created_at')[:30]
-        context['products'] = filter_products_with_valid_images(all_products)
+        context['categories'] = all_categories()
+        context['products'] = latest_products(30)
         return context
 
     def get(self, request, *args, **kwargs):
@@ -2011,7 +1995,7 @@ class AppointmentCompletePage(TemplateView):
 
     def post(self, request, *args, **kwargs):
         appointment_data = request.session.get('appointment_data')
-        cart = request.session.get('cart', {})
+        cart = ShoppingCart(request)
         direct = request.session.get('direct_checkout')
 
         # Ensure we have appointment data (date/time). If it's missing
@@ -2021,163 +2005,84 @@ class AppointmentCompletePage(TemplateView):
         if not appointment_data:
             return redirect('appointment')
 
-        if Appointment.objects.filter(
-            date=appointment_data['date'], 
-            time=appointment_data['time']).exists():
-            return redirect('checkout')
-
-        appointment = Appointment.objects.create(
-            first_name=appointment_data['first_name'],
-            last_name=appointment_data['last_name'],
-            contact=appointment_data['contact'],
-            email=appointment_data['email'],
-            date=date.fromisoformat(appointment_data['date']),
-            time=time.fromisoformat(appointment_data['time']), 
-        )
-
-        product_list = [] 
-        total_price = 0
-        
+        # Resolve the order lines as (product, variation, quantity, price)
         if direct:
-            # Support variant-aware direct checkout. If a variant_id was stored
-            # use the variant's price and decrement variant stock; otherwise
-            # use the base product price and decrement product stock.
             variant_id = direct.get('variant_id')
             if variant_id:
-                variant = get_object_or_404(ProductVariation, pk=variant_id)
-                product = variant.product
-                price_used = float(variant.price)
+                variant = get_object_or_404(ProductVariation.objects.select_related('product'), pk=variant_id)
+                order = [(variant.product, variant, int(direct['quantity']), variant.price)]
             else:
-                product = Product.objects.get(id=direct['product_id'])
-                variant = None
-                price_used = float(product.price)
+                product = get_object_or_404(Product, pk=direct['product_id'])
+                order = [(product, None, int(direct['quantity']), product.price)]
+        else:
+            # Every line is resolved (with live prices) by one query
+            order = [(line.product, line.variation, line.quantity, line.price) for line in cart.lines()]
 
-            quantity = int(direct['quantity'])
-            subtotal = price_used * quantity
+        product_list = []
+        total_price = 0
+        for product, variant, quantity, price in order:
+            price = float(price)
+            subtotal = price * quantity
             total_price += subtotal
-
-            AppointmentProduct.objects.create(
-                appointment=appointment,
-                product=product,
-                quantity=quantity,
-                price=price_used,
-                variation=(variant.product_variation if variant else None),
-            )
-
-            # Decrement stock safely (don't let it go negative)
-            if variant:
-                variant.stock = max(0, variant.stock - quantity)
-                variant.save()
-            else:
-                product.stock = max(0, product.stock - quantity)
-                product.save()
-
             name = product.product_name
             if variant:
                 name = f"{name} ({variant.product_variation})"
-
             product_list.append({
                 "name": name,
                 "quantity": quantity,
-                "price": price_used,
+                "price": price,
                 "subtotal": subtotal,
             })
 
-            del request.session['direct_checkout']
-        
-
-        else:
-            for cart_key, produkto in cart.items():
-                # cart_key may be a numeric product id string (e.g. '22')
-                # or a variant key like 'variant-6'. Resolve the actual
-                # Product instance accordingly.
-                if str(cart_key).startswith('variant-'):
-                    variant_id = produkto.get('variant_id')
-                    if variant_id:
-                        variant = get_object_or_404(ProductVariation, pk=variant_id)
-                        product = variant.product
-                    else:
-                        # fallback: try to use stored product_id inside the item
-                        pid = produkto.get('product_id')
-                        product = get_object_or_404(Product, pk=pid)
-                else:
-                    # numeric key
-                    product = get_object_or_404(Product, pk=int(cart_key))
-
-                quantity = int(produkto.get('quantity', 1))
-                price = float(produkto.get('price', product.price))
-                subtotal = quantity * price
-                total_price += subtotal
-
-                # If this cart entry was for a variant, record the variation
-                # name on the AppointmentProduct and include it in emails.
-                variation_name = None
-                if str(cart_key).startswith('variant-'):
-                    variation_name = produkto.get('product_name')
-                    # `product_name` for variant entries is like "Base Name (Variation)"; try
-                    # to extract the parenthetical variation if present.
-                    if variation_name and '(' in variation_name and variation_name.endswith(')'):
-                        # extract text inside final parentheses
-                        variation_name = variation_name.split('(')[-1].rstrip(')')
-
-                AppointmentProduct.objects.create(
-                    appointment=appointment,
-                    product=product,
-                    quantity=quantity,
-                    price=price,
-                    variation=variation_name,
+        # Create the appointment (which books its slot), reserve its stock,
+        # update the sales counters and queue the confirmation email
+        # together; a full slot or a stock shortfall rolls all of it back
+        appointment_date = date.fromisoformat(appointment_data['date'])
+        appointment_time = time.fromisoformat(appointment_data['time'])
+        try:
+            with transaction.atomic():
+                appointment = Appointment.objects.create(
+                    first_name=appointment_data['first_name'],
+                    last_name=appointment_data['last_name'],
+                    contact=appointment_data['contact'],
+                    email=appointment_data['email'],
+                    date=appointment_date,
+                    time=appointment_time,
                 )
+                reserve_stock(appointment, order)
+                record_appointment_sales(appointment)
+
+                email_html = render_to_string( 
+                    'app/buying/appointment_confirmation.html', 
+                    { 
+                        "first_name": appointment.first_name, 
+                        "reference_number": appointment.reference_number, 
+                        "date": appointment.date, 
+                        "time": appointment.time, 
+                        "products": product_list, 
+                        "total_price": total_price, 
+                    }
+                ) 
+                queue_email(
+                    f"Appointment Confirmation – Ref #{appointment.reference_number}",
+                    [appointment.email],
+                    html=email_html,
+                    from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', settings.EMAIL_HOST_USER),
+                    idempotency_key=f"appointment-confirmation:{appointment.pk}",
+                )
+        except SlotUnavailable:
+            messages.error(request, "Sorry, that appointment time was just taken. Please pick another.")
+            return redirect('appointment')
+        except StockShortfall as e:
+            for line in e.shortfalls:
+                messages.error(request, f"Only {line['available']} left of {line['name']} (you ordered {line['requested']}).")
+            return redirect('checkout')
 
-                # Decrement stock safely for variant or base product
-                try:
-                    if str(cart_key).startswith('variant-') and 'variant' in locals() and variant:
-                        variant.stock = max(0, variant.stock - quantity)
-                        variant.save()
-                    else:
-                        product.stock = max(0, product.stock - quantity)
-                        product.save()
-                except Exception:
-                    # If stock decrement fails for any reason, log and continue
-                    logger.exception(f"Failed to decrement stock for product in appointment {appointment.id}")
-
-                display_name = product.product_name
-                if variation_name:
-                    display_name = f"{display_name} ({variation_name})"
-
-                product_list.append({
-                    "name": display_name,
-                    "quantity": quantity,
-                    "price": price,
-                    "subtotal": subtotal,
-                })
+        if direct:
+            del request.session['direct_checkout']
+        else:
+            cart.clear()
 
-            if "cart" in request.session:
-                del request.session['cart']
-
-        email_html = render_to_string( 
-            'app/buying/appointment_confirmation.html', 
-            { 
-                "first_name": appointment.first_name, 
-                "reference_number": appointment.reference_number, 
-                "date": appointment.date, 
-                "time": appointment.time, 
-                "products": product_list, 
-                "total_price": total_price, 
-            }
-        ) 
-            
-        # Send confirmation email, but don't let email failures produce a 500
-        try:
-            send_email(
-                subject=f"Appointment Confirmation – Ref #{appointment.reference_number}",
-                text="",
-                html=email_html,
-                from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', settings.EMAIL_HOST_USER),
-                recipient_list=[appointment.email],
-            )
-        except Exception:
-            logger.exception(f"Failed to send appointment confirmation email for appointment {appointment.id}")
-            
         del request.session['appointment_data']
 
         request.session['appointment_complete'] = {
@@ -2409,28 +2314,13 @@ class CartPage(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        cart = self.request.session.get('cart', {})
-
-        # Enhance cart data with product category information
-        for product_id, produkto in cart.items():
-            produkto['sub_total'] = produkto['price'] * produkto['quantity']
-            if 'product_id' not in produkto:
-                produkto['product_id'] = product_id
-            produkto['cart_key'] = product_id
-            
-            # Add category information if not already present
-            if 'category_name' not in produkto and 'product_id' in produkto:
-                try:
-                    product = Product.objects.get(id=produkto['product_id'])
-                    produkto['category_name'] = product.category_name.category_name if product.category_name else 'Unknown'
-                except Product.DoesNotExist:
-                    produkto['category_name'] = 'Unknown'
+        cart = ShoppingCart(self.request)
 
-        context['cart_products'] = cart
-        context['total_price'] = sum(produkto['price'] * produkto['quantity'] for produkto in cart.values())
+        # Lines carry live prices and category names from a single query
+        context['cart_products'] = cart.as_dict()
+        context['total_price'] = cart.total_price()
         context['favorites'] = self.request.session.get('favorites', [])
-        all_products = Product.objects.all().order_by('-created_at')[:30]
-        context['products'] = filter_products_with_valid_images(all_products)
+        context['products'] = latest_products(30)
         return context
 
 class FavoritePage(TemplateView):
@@ -2451,66 +2341,60 @@ class AdminDashboard(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        total_appointments = Appointment.objects.exclude(status__in=['Cancelled', 'Pending']).count()
-        total_trades = Selling.objects.exclude(status__in=['Cancelled', 'Pending']).count()
+        today = timezone.localdate()
+        week_start = today - timedelta(days=6)
 
-        today = timezone.now().date()
+        # Totals, charts and categories come from the daily rollup (app/analytics.py)
+        totals = analytics.totals()
+        total_appointments = totals['appointments_finished']
+        total_trades = totals['trades_completed']
+        total_sales = totals['revenue']
+
+        # Today's pending bookings
         appointed = Appointment.objects.filter(status='Pending', created_at__date=today).count()
         traded = Selling.objects.filter(status='Pending', selling_at__date=today).count()
 
-        days = [today - timedelta(days=i) for i in range(6, -1, -1)]
-
-        appointment_chart_labels = []
-        appointment_chart_data = []
-        selling_chart_labels = []
-        selling_chart_data = []
-
-        for day in days:
-            appointment_count = Appointment.objects.filter(created_at__date=day).count()
-            selling_count = Selling.objects.filter(selling_at__date=day).count()
-
-            appointment_chart_labels.append(day.strftime('%Y-%m-%d'))
-            appointment_chart_data.append(appointment_count)
-
-            selling_chart_labels.append(day.strftime('%Y-%m-%d'))
-            selling_chart_data.append(selling_count)
-        
-        categories = Category.objects.all()
-        top_categories = []
-
-        for cat in categories:
-            sold = AppointmentProduct.objects.filter(product__category_name=cat).aggregate(total=Sum('quantity'))['total'] or 0
-            top_categories.append({"category_name": cat.category_name,"total_sold": sold})
-            
-        total_sales = AppointmentProduct.objects.aggregate(total=Sum(F('quantity') * F('price')))['total'] or 0
+        week = analytics.daily_series(week_start, today)
+        appointment_chart_labels = week['labels']
+        appointment_chart_data = week['appointments_created']
+        selling_chart_data = week['trades_created']
+
+        # Units sold per category, including categories that sold nothing
+        sold_per_category = analytics.category_totals()
+        top_categories = [
+            {"category_name": name, "total_sold": sold_per_category.get(pk, (0, 0))[0]}
+            for pk, name in Category.objects.order_by('pk').values_list('pk', 'category_name')
+        ]
         top_categories = sorted(top_categories, key=lambda x: x['total_sold'], reverse=True)
-        
+
         all_orders = []
 
-        for appt in Appointment.objects.filter(status='Pending'):
-            delta_days = (timezone.now().date() - appt.date).days
+        pending_appointments = Appointment.objects.filter(status='Pending').annotate(
+            total_amount=Sum(F('products__quantity') * F('products__price')),
+        ).prefetch_related(
+            Prefetch('products', queryset=AppointmentProduct.objects.select_related('product').order_by('pk'))
+        )
+        for appt in pending_appointments:
+            delta_days = (today - appt.date).days
             progress = 100 if delta_days >= 0 else 0
 
-            total_amount = appt.products.aggregate(total=Sum(F('quantity') * F('price')))['total'] or 0
-
-            first_product = appt.products.first()
+            lines = list(appt.products.all())
+            first_product = lines[0] if lines else None
             product_image = first_product.product.image.url if first_product and first_product.product and first_product.product.image else ""
-            
-            product_list = ", ".join([f"{p.product.product_name if p.product else 'Unknown Product'} x {p.quantity}" for p in appt.products.all()])
 
             all_orders.append({
                 "type": "Appointment",
-                "product": ", ".join([f"{p.product.product_name if p.product else 'Unknown Product'} x {p.quantity}" for p in appt.products.all()]),
+                "product": ", ".join([f"{p.product.product_name if p.product else 'Unknown Product'} x {p.quantity}" for p in lines]),
                 "photo": product_image,
                 "product_id": appt.reference_number,
-                "amount": total_amount,
+                "amount": appt.total_amount or 0,
                 "date": appt.created_at,
                 "shipping_progress": progress,
                 "status": appt.status,
             })
         
         for sell in Selling.objects.filter(status='Pending'):
-            delta_days = (timezone.now().date() - sell.selling_date).days
+            delta_days = (today - sell.selling_date).days
             progress = 100 if delta_days >= 0 else 0
 
             all_orders.append({
@@ -2540,6 +2424,60 @@ class AdminDashboard(TemplateView):
         context['traded'] = traded
         return context
 
+@require_http_methods(["GET"])
+def admin_analytics(request):
+    """
+    Staff-only trends for the last ?days=30|90|365 (default 30): every
+    rollup counter per day, their totals and units and revenue per category.
+    Reads only the daily rollup, so the cost grows with days, not orders.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    try:
+        days = int(request.GET.get('days', analytics.ANALYTICS_WINDOWS[0]))
+    except ValueError:
+        days = None
+    if days not in analytics.ANALYTICS_WINDOWS:
+        windows = ', '.join(str(window) for window in analytics.ANALYTICS_WINDOWS)
+        return JsonResponse({'error': f'days must be one of {windows}'}, status=400)
+
+    end = timezone.localdate()
+    start = end - timedelta(days=days - 1)
+    series = analytics.daily_series(start, end)
+    series['revenue'] = [float(value) for value in series['revenue']]
+    totals = analytics.totals(start, end)
+    totals['revenue'] = float(totals['revenue'])
+
+    names = dict(Category.objects.values_list('pk', 'category_name'))
+    categories = sorted(
+        [
+            {'category': names.get(pk, 'Uncategorized'), 'units_sold': units, 'revenue': float(revenue)}
+            for pk, (units, revenue) in analytics.category_totals(start, end).items()
+        ],
+        key=lambda row: row['units_sold'], reverse=True,
+    )
+    return JsonResponse({
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'series': series,
+        'totals': totals,
+        'categories': categories,
+    })
+
+@require_http_methods(["GET"])
+def admin_cache_stats(request):
+    """Staff-only cache hit/miss/build counters of this process (see app/caching.py)."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    return JsonResponse({'backend': settings.CACHES['default']['BACKEND'], 'stats': cache_stats()})
+
+@require_http_methods(["GET"])
+def admin_chat_stats(request):
+    """Staff-only assistant reply counters and time to first token of this process (see app/llm.py)."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+    return JsonResponse(llm.stats())
+
 class AdminInventory(TemplateView):
     template_name = 'app/admin/admin_inventory.html'
 
@@ -2576,14 +2514,17 @@ class AdminProduct(TemplateView):
         products = Product.objects.all()
 
         if search_query:
-            products = products.filter(
-                Q(category_name__category_name__icontains=search_query) |
-                Q(brand__brand__icontains=search_query) |
-                Q(product_name__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(price__icontains=search_query) |
-                Q(stock__icontains=search_query)
-            )
+            matches = search_products(Product.objects.all(), search_query).values('pk')
+            numeric_q = Q()
+            try:
+                price_query = Decimal(search_query)
+                if price_query.is_finite():
+                    numeric_q |= Q(price=price_query)
+            except InvalidOperation:
+                pass
+            if search_query.isdigit():
+                numeric_q |= Q(stock=int(search_query))
+            products = products.filter(Q(pk__in=matches) | numeric_q)
         if category_filter:
             products = products.filter(category_name__id=category_filter)
         if brand_filter: